@@ -1,23 +1,117 @@
+import asyncio
+import json
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Awaitable, Iterator
+
 import aiohttp
+from aiohttp.compression_utils import HAS_BROTLI
 
+from app.common.deadline.deadline import request_deadline
 from app.common.exceptions.http_exception_wrapper import http_exception
+from app.common.metrics.metrics import metrics
+from app.common.single_flight.single_flight import SingleFlight
+from .response_cache import ResponseCache
+from .traffic_archive import TrafficArchive
 
 
 class APIHandler:
 
+    # aiohttp decompresses response bodies by chunks while they are read, brotli is supported if it is installed
+    accept_encoding = "gzip, deflate, br" if HAS_BROTLI else "gzip, deflate"
+
     def __init__(
             self,
             base_url: str,
+            cache: ResponseCache | None = None,
+            archive: TrafficArchive | None = None,
     ) -> None:
         """Initialisation function
 
         Args:
             base_url (str): Base api url
+            cache (ResponseCache | None): Cache for GET responses, defaults to None (no caching)
+            archive (TrafficArchive | None): Archive GET responses are recorded to or replayed from, defaults to None
+            (responses are requested from api)
         Returns:
             None
         """
 
         self.base_url = base_url
+        self.cache = cache
+        self.archive = archive
+        self._get_flight = SingleFlight("urban_api_get")
+
+    @staticmethod
+    def _get_timeout() -> aiohttp.ClientTimeout:
+        """Function creates session timeout limited by request deadline
+
+        Returns:
+            aiohttp.ClientTimeout: session timeout, aiohttp default one if request has no deadline
+        Raises:
+            504, http exception request deadline exceeded
+        """
+
+        request_deadline.check("urban_api")
+        if (remaining := request_deadline.remaining()) is None:
+            return aiohttp.ClientTimeout(total=5 * 60, sock_connect=30)
+        return aiohttp.ClientTimeout(total=remaining, sock_connect=min(remaining, 30))
+
+    @staticmethod
+    @contextmanager
+    def _deadline_timeout(endpoint_url: str) -> Iterator[None]:
+        """Function converts session timeout caused by request deadline to http exception
+
+        Args:
+            endpoint_url (str): Endpoint url
+        Raises:
+            504, http exception request deadline exceeded while waiting for api
+        """
+
+        try:
+            yield
+        except asyncio.TimeoutError:
+            if request_deadline.remaining() is None:
+                raise
+            raise http_exception(
+                status_code=504,
+                msg="Request deadline exceeded while waiting for API",
+                _input=endpoint_url,
+                _detail={},
+            )
+
+    def _get_headers(
+            self,
+            headers: dict | None,
+    ) -> dict:
+        """Function adds Accept-Encoding header to request headers, so api can send compressed body
+
+        Args:
+            headers (dict | None): Headers
+        Returns:
+            dict: Request headers
+        """
+
+        return {"Accept-Encoding": self.accept_encoding, **(headers or {})}
+
+    @staticmethod
+    def _count_bytes(
+            response: aiohttp.ClientResponse,
+            size: int,
+    ) -> None:
+        """Function counts response body bytes received from api and decoded ones by content encoding
+
+        Args:
+            response (aiohttp.ClientResponse): Response object
+            size (int): Decoded body size in bytes
+        Returns:
+            None
+        """
+
+        encoding = response.headers.get("Content-Encoding", "identity")
+        metrics.increment(f"urban_api.{encoding}.bytes_decoded", size)
+        if response.content_length is not None:
+            metrics.increment(f"urban_api.{encoding}.bytes_received", response.content_length)
 
     @staticmethod
     async def _check_response_status(
@@ -34,7 +128,9 @@ class APIHandler:
         """
 
         if response.status in (200, 201):
-            return await response.json(content_type="application/json")
+            result = await response.json(content_type="application/json")
+            APIHandler._count_bytes(response, len(await response.read()))
+            return result
         elif response.status == 500:
             if response.content_type == "application/json":
                 response_info = await response.json()
@@ -63,40 +159,239 @@ class APIHandler:
             params: dict | None = None,
             session: aiohttp.ClientSession | None = None,
     ) -> dict | list:
-        """Function to get data from api
+        """Function to get data from api. Concurrent identical requests share one in-flight request on its own
+        session, each caller gets own object parsed from shared raw body
 
         Args:
             endpoint_url (str): Endpoint url
             headers (dict | None): Headers
             params (dict | None): Query parameters
-            session (aiohttp.ClientSession | None): Session to use
+            session (aiohttp.ClientSession | None): Session to use, request on passed session is not shared
         Returns:
             dict | list: Response data as python object
         """
 
+        if self.archive and self.archive.replaying:
+            return json.loads(await self.archive.replay(endpoint_url, params))
+        key = (
+            endpoint_url,
+            tuple(sorted((name, str(value)) for name, value in (params or {}).items())),
+            tuple(sorted((headers or {}).items())),
+        )
+        ttl = self.cache.get_ttl(endpoint_url) if self.cache else None
+        if ttl and (entry := self.cache.get(key)) and entry.is_fresh:
+            return json.loads(entry.body)
+
+        def fetch(request_session: aiohttp.ClientSession | None = None) -> Awaitable[bytes]:
+            if ttl:
+                return self._get_cached(
+                    key=key,
+                    ttl=ttl,
+                    endpoint_url=endpoint_url,
+                    headers=headers,
+                    params=params,
+                    session=request_session,
+                )
+            return self._get(
+                endpoint_url=endpoint_url,
+                headers=headers,
+                params=params,
+                session=request_session,
+            )
+
+        if session:
+            return json.loads(await fetch(session))
+        return json.loads(await self._get_flight.do(key, fetch))
+
+    async def _get_cached(
+            self,
+            key: tuple,
+            ttl: int,
+            endpoint_url: str,
+            headers: dict | None = None,
+            params: dict | None = None,
+            session: aiohttp.ClientSession | None = None,
+    ) -> bytes:
+        """Function to get raw response body from cache or from api with conditional revalidation by etag
+
+        Args:
+            key (tuple): Request cache key
+            ttl (int): Cache ttl in seconds
+            endpoint_url (str): Endpoint url
+            headers (dict | None): Headers
+            params (dict | None): Query parameters
+            session (aiohttp.ClientSession | None): Session to use
+        Returns:
+            bytes: Raw response body
+        """
+
         if not session:
-            async with aiohttp.ClientSession() as session:
-                return await self.get(
+            with self._deadline_timeout(endpoint_url):
+                async with aiohttp.ClientSession(timeout=self._get_timeout()) as session:
+                    return await self._get_cached(
+                        key=key,
+                        ttl=ttl,
+                        endpoint_url=endpoint_url,
+                        headers=headers,
+                        params=params,
+                        session=session,
+                    )
+        entry = self.cache.peek(key)
+        if entry and entry.is_fresh:
+            return entry.body
+        request_headers = self._get_headers(headers)
+        if entry and entry.etag:
+            request_headers["If-None-Match"] = entry.etag
+        start = time.perf_counter()
+        async with session.get(
+                url=self.base_url + endpoint_url,
+                headers=request_headers,
+                params=params
+        ) as response:
+            if response.status == 304 and entry:
+                self.cache.refresh(key, ttl)
+                if self.archive:
+                    await self.archive.record(endpoint_url, params, entry.body, time.perf_counter() - start)
+                return entry.body
+            result = await self._check_response_status(response)
+            if not result:
+                return await self._get_cached(
+                    key=key,
+                    ttl=ttl,
                     endpoint_url=endpoint_url,
                     headers=headers,
                     params=params,
                     session=session,
                 )
+            body = await response.read()
+            if self.archive:
+                await self.archive.record(endpoint_url, params, body, time.perf_counter() - start)
+            self.cache.set(
+                key=key,
+                endpoint_url=endpoint_url,
+                body=body,
+                etag=response.headers.get("ETag"),
+                ttl=ttl,
+            )
+            return body
+
+    async def stream(
+            self,
+            endpoint_url: str,
+            headers: dict | None = None,
+            params: dict | None = None,
+            chunk_size: int = 65536,
+    ) -> AsyncIterator[bytes]:
+        """Function to get response body from api by chunks. Next chunk is read from connection only when previous
+        one is consumed, so memory is bounded by consumer pace
+
+        Args:
+            endpoint_url (str): Endpoint url
+            headers (dict | None): Headers
+            params (dict | None): Query parameters
+            chunk_size (int): Max chunk size in bytes
+        Returns:
+            AsyncIterator[bytes]: Response body chunks
+        Raises:
+            http_exception with response status code from API
+        """
+
+        if self.archive and self.archive.replaying:
+            body = await self.archive.replay(endpoint_url, params)
+            for position in range(0, len(body), chunk_size):
+                yield body[position:position + chunk_size]
+            return
+        with self._deadline_timeout(endpoint_url):
+            async with aiohttp.ClientSession(timeout=self._get_timeout()) as session:
+                start = time.perf_counter()
+                async with session.get(
+                        url=self.base_url + endpoint_url,
+                        headers=self._get_headers(headers),
+                        params=params
+                ) as response:
+                    if response.status in (200, 201):
+                        size = 0
+                        # recorded body is kept whole, recording is not meant for memory bounded runs
+                        chunks = [] if self.archive else None
+                        async for chunk in response.content.iter_chunked(chunk_size):
+                            size += len(chunk)
+                            if chunks is not None:
+                                chunks.append(chunk)
+                            yield chunk
+                        self._count_bytes(response, size)
+                        if chunks is not None:
+                            await self.archive.record(
+                                endpoint_url, params, b"".join(chunks), time.perf_counter() - start
+                            )
+                        return
+                    await self._check_response_status(response)
+        async for chunk in self.stream(
+                endpoint_url=endpoint_url,
+                headers=headers,
+                params=params,
+                chunk_size=chunk_size,
+        ):
+            yield chunk
+
+    def invalidate_project(self, project_id: int) -> int:
+        """Function deletes cached responses of project endpoints
+
+        Args:
+            project_id (int): Project id
+        Returns:
+            int: Number of deleted cache entries
+        """
+
+        if not self.cache:
+            return 0
+        return self.cache.invalidate_project(project_id)
+
+    async def _get(
+            self,
+            endpoint_url: str,
+            headers: dict | None = None,
+            params: dict | None = None,
+            session: aiohttp.ClientSession | None = None,
+    ) -> bytes:
+        """Function to get raw response body from api
+
+        Args:
+            endpoint_url (str): Endpoint url
+            headers (dict | None): Headers
+            params (dict | None): Query parameters
+            session (aiohttp.ClientSession | None): Session to use
+        Returns:
+            bytes: Raw response body
+        """
+
+        if not session:
+            with self._deadline_timeout(endpoint_url):
+                async with aiohttp.ClientSession(timeout=self._get_timeout()) as session:
+                    return await self._get(
+                        endpoint_url=endpoint_url,
+                        headers=headers,
+                        params=params,
+                        session=session,
+                    )
         url = self.base_url + endpoint_url
+        start = time.perf_counter()
         async with session.get(
                 url=url,
-                headers=headers,
+                headers=self._get_headers(headers),
                 params=params
         ) as response:
             result = await self._check_response_status(response)
             if not result:
-                return await self.get(
+                return await self._get(
                     endpoint_url=endpoint_url,
                     headers=headers,
                     params=params,
                     session=session,
                 )
-            return result
+            body = await response.read()
+            if self.archive:
+                await self.archive.record(endpoint_url, params, body, time.perf_counter() - start)
+            return body
 
     async def post(
             self,
@@ -119,14 +414,15 @@ class APIHandler:
         """
 
         if not session:
-            async with aiohttp.ClientSession() as session:
-                return await self.post(
-                    endpoint_url=endpoint_url,
-                    headers=headers,
-                    params=params,
-                    data=data,
-                    session=session,
-                )
+            with self._deadline_timeout(endpoint_url):
+                async with aiohttp.ClientSession(timeout=self._get_timeout()) as session:
+                    return await self.post(
+                        endpoint_url=endpoint_url,
+                        headers=headers,
+                        params=params,
+                        data=data,
+                        session=session,
+                    )
         url = self.base_url + endpoint_url
         async with session.post(
             url=url,
@@ -165,14 +461,15 @@ class APIHandler:
         """
 
         if not session:
-            async with aiohttp.ClientSession() as session:
-                return await self.put(
-                    endpoint_url=endpoint_url,
-                    headers=headers,
-                    params=params,
-                    data=data,
-                    session=session,
-                )
+            with self._deadline_timeout(endpoint_url):
+                async with aiohttp.ClientSession(timeout=self._get_timeout()) as session:
+                    return await self.put(
+                        endpoint_url=endpoint_url,
+                        headers=headers,
+                        params=params,
+                        data=data,
+                        session=session,
+                    )
         url = self.base_url + endpoint_url
         async with session.put(
                 url=url,
@@ -211,14 +508,15 @@ class APIHandler:
         """
 
         if not session:
-            async with aiohttp.ClientSession() as session:
-                return await self.delete(
-                    endpoint_url=endpoint_url,
-                    headers=headers,
-                    params=params,
-                    data=data,
-                    session=session,
-                )
+            with self._deadline_timeout(endpoint_url):
+                async with aiohttp.ClientSession(timeout=self._get_timeout()) as session:
+                    return await self.delete(
+                        endpoint_url=endpoint_url,
+                        headers=headers,
+                        params=params,
+                        data=data,
+                        session=session,
+                    )
         url = self.base_url + endpoint_url
         async with session.delete(
                 url=url,
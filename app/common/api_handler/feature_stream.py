@@ -0,0 +1,123 @@
+import codecs
+import json
+
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import shape
+
+
+class FeatureStreamParser:
+    """
+    Class incrementally parses features of GeoJSON feature collection from raw response body chunks
+    """
+
+    def __init__(self) -> None:
+        """Initialisation function
+
+        Returns:
+            None
+        """
+
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._in_features = False
+        self.finished = False
+
+    def feed(self, chunk: bytes) -> list[dict]:
+        """
+        Function parses features completed by chunk. Incomplete feature is kept until next chunks
+        Args:
+            chunk (bytes): response body chunk
+        Returns:
+            list[dict]: parsed features
+        """
+
+        if self.finished:
+            return []
+        self._buffer += self._text_decoder.decode(chunk)
+        if not self._in_features:
+            features_key = self._buffer.find('"features"')
+            if features_key == -1:
+                return []
+            array_start = self._buffer.find("[", features_key)
+            if array_start == -1:
+                return []
+            self._buffer = self._buffer[array_start + 1:]
+            self._in_features = True
+        features = []
+        position = 0
+        size = len(self._buffer)
+        while position < size:
+            char = self._buffer[position]
+            if char in " \t\r\n,":
+                position += 1
+                continue
+            if char == "]":
+                self.finished = True
+                position = size
+                break
+            try:
+                feature, position = self._decoder.raw_decode(self._buffer, position)
+            except json.JSONDecodeError:
+                break
+            features.append(feature)
+        self._buffer = self._buffer[position:]
+        return features
+
+
+class FeatureColumns:
+    """
+    Class accumulates features batches as geometry arrays and properties columns
+    """
+
+    def __init__(self) -> None:
+        """Initialisation function
+
+        Returns:
+            None
+        """
+
+        self._geometries: list[np.ndarray] = []
+        self._columns: dict[str, list] = {}
+        self.size = 0
+
+    def append(self, features: list[dict]) -> None:
+        """
+        Function appends features batch to buffers
+        Args:
+            features (list[dict]): GeoJSON features
+        Returns:
+            None
+        """
+
+        if not features:
+            return
+        geometries = np.empty(len(features), dtype=object)
+        geometries[:] = [shape(feature["geometry"]) if feature["geometry"] else None for feature in features]
+        self._geometries.append(geometries)
+        for row, feature in enumerate(features, start=self.size):
+            properties = feature.get("properties") or {}
+            for name, value in properties.items():
+                if (column := self._columns.get(name)) is None:
+                    column = self._columns[name] = [None] * row
+                column.append(value)
+            if len(properties) != len(self._columns):
+                for column in self._columns.values():
+                    if len(column) == row:
+                        column.append(None)
+        self.size += len(features)
+
+    def to_geodataframe(self) -> gpd.GeoDataFrame:
+        """
+        Function builds layer from buffers
+        Returns:
+            gpd.GeoDataFrame: layer without crs, empty layer if no features were appended
+        """
+
+        if not self.size:
+            return gpd.GeoDataFrame()
+        return gpd.GeoDataFrame(
+            {"geometry": np.concatenate(self._geometries)} | self._columns,
+            geometry="geometry",
+        )
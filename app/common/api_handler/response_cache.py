@@ -0,0 +1,180 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+from app.common.metrics.metrics import metrics
+
+
+class CacheEntry:
+
+    __slots__ = ("body", "etag", "expires_at", "project_ids")
+
+    def __init__(
+            self,
+            body: bytes,
+            etag: str | None,
+            expires_at: float,
+            project_ids: set[int],
+    ) -> None:
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+        self.project_ids = project_ids
+
+    @property
+    def is_fresh(self) -> bool:
+        return self.expires_at > time.monotonic()
+
+
+class ResponseCache:
+    """
+    Class for upstream responses cache with per-endpoint ttl policies and LRU eviction bounded by body size
+    """
+
+    project_pattern = re.compile(r"/projects/(\d+)")
+
+    def __init__(
+            self,
+            policies: dict[str, int],
+            max_bytes: int,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            policies (dict[str, int]): ttl in seconds by endpoint url regex. Endpoints without policy are not cached
+            max_bytes (int): max total size of cached response bodies
+        Returns:
+            None
+        """
+
+        self.policies = [(re.compile(pattern), ttl) for pattern, ttl in policies.items()]
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+
+    def get_ttl(self, endpoint_url: str) -> int | None:
+        """
+        Function returns ttl of the first policy matching endpoint url
+        Args:
+            endpoint_url (str): endpoint url
+        Returns:
+            int | None: ttl in seconds, None if endpoint is not cached
+        """
+
+        for pattern, ttl in self.policies:
+            if pattern.fullmatch(endpoint_url):
+                return ttl
+        return None
+
+    def get(self, key: Hashable) -> CacheEntry | None:
+        """
+        Function returns cached entry, fresh or stale. Stale entries without etag are deleted
+        Args:
+            key (Hashable): request key
+        Returns:
+            CacheEntry | None: cached entry
+        """
+
+        entry = self._entries.get(key)
+        if not entry:
+            metrics.increment("urban_api_cache.miss")
+            return None
+        if not entry.is_fresh and not entry.etag:
+            self._delete(key)
+            metrics.increment("urban_api_cache.expired")
+            return None
+        self._entries.move_to_end(key)
+        if entry.is_fresh:
+            metrics.increment("urban_api_cache.hit")
+        else:
+            metrics.increment("urban_api_cache.stale")
+        return entry
+
+    def peek(self, key: Hashable) -> CacheEntry | None:
+        """
+        Function returns cached entry without updating its recency and cache metrics
+        Args:
+            key (Hashable): request key
+        Returns:
+            CacheEntry | None: cached entry
+        """
+
+        return self._entries.get(key)
+
+    def set(
+            self,
+            key: Hashable,
+            endpoint_url: str,
+            body: bytes,
+            etag: str | None,
+            ttl: int,
+    ) -> None:
+        """
+        Function stores response body and evicts least recently used entries above size limit
+        Args:
+            key (Hashable): request key
+            endpoint_url (str): endpoint url, used to tag entry with project ids
+            body (bytes): raw response body
+            etag (str | None): response etag for conditional revalidation
+            ttl (int): entry ttl in seconds
+        Returns:
+            None
+        """
+
+        if len(body) > self.max_bytes:
+            return
+        self._delete(key)
+        self._entries[key] = CacheEntry(
+            body=body,
+            etag=etag,
+            expires_at=time.monotonic() + ttl,
+            project_ids={int(project_id) for project_id in self.project_pattern.findall(endpoint_url)},
+        )
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            evicted_key = next(iter(self._entries))
+            self._delete(evicted_key)
+            metrics.increment("urban_api_cache.evicted")
+
+    def refresh(self, key: Hashable, ttl: int) -> None:
+        """
+        Function extends entry expiry after successful revalidation
+        Args:
+            key (Hashable): request key
+            ttl (int): entry ttl in seconds
+        Returns:
+            None
+        """
+
+        if entry := self._entries.get(key):
+            entry.expires_at = time.monotonic() + ttl
+            metrics.increment("urban_api_cache.revalidated")
+
+    def _delete(self, key: Hashable) -> None:
+        if entry := self._entries.pop(key, None):
+            self.size -= len(entry.body)
+
+    def invalidate_project(self, project_id: int) -> int:
+        """
+        Function deletes all entries of project endpoints
+        Args:
+            project_id (int): project id
+        Returns:
+            int: number of deleted entries
+        """
+
+        keys = [key for key, entry in self._entries.items() if project_id in entry.project_ids]
+        for key in keys:
+            self._delete(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        """
+        Function deletes all entries
+        Returns:
+            None
+        """
+
+        self._entries.clear()
+        self.size = 0
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import threading
+import zipfile
+from pathlib import Path
+
+from loguru import logger
+
+from app.common.exceptions.http_exception_wrapper import http_exception
+from app.common.metrics.metrics import metrics
+
+
+class TrafficArchive:
+    """
+    Class records api GET responses to compressed zip archive by endpoint and query parameters and replays them, so
+    traffic of real request can be reproduced without network. Archive is written by one process, record with one
+    worker
+    """
+
+    modes = ("record", "replay")
+
+    def __init__(
+            self,
+            path: str,
+            mode: str,
+            latency: float = 0.0,
+            recorded_latency: bool = False,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            path (str): archive path
+            mode (str): "record" to store responses, "replay" to serve responses from archive
+            latency (float): simulated latency of replayed responses in seconds
+            recorded_latency (bool): whether replayed responses are delayed by their recorded durations instead of
+            latency
+        Returns:
+            None
+        """
+
+        if mode not in self.modes:
+            raise ValueError(f"Unknown traffic archive mode {mode}, expected one of {self.modes}")
+        self.path = Path(path)
+        self.mode = mode
+        self.latency = latency
+        self.recorded_latency = recorded_latency
+        self._lock = threading.Lock()
+        self._archive: zipfile.ZipFile | None = None
+        self._recorded: set[str] = set()
+        if self.path.exists():
+            with zipfile.ZipFile(self.path) as archive:
+                self._recorded = {name.removesuffix(".body") for name in archive.namelist() if name.endswith(".body")}
+        if self.replaying:
+            self._archive = zipfile.ZipFile(self.path)
+            logger.info(f"urban_api responses are replayed from {self.path}, {len(self._recorded)} responses")
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    @staticmethod
+    def _get_name(
+            endpoint_url: str,
+            params: dict | None,
+    ) -> str:
+        """
+        Function returns archive entry name of request. Base url and headers are not used, so archive recorded
+        against one api instance is replayed with any
+        Args:
+            endpoint_url (str): Endpoint url
+            params (dict | None): Query parameters
+        Returns:
+            str: entry name
+        """
+
+        key = json.dumps([endpoint_url, sorted((name, str(value)) for name, value in (params or {}).items())])
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _write(
+            self,
+            name: str,
+            meta: dict,
+            body: bytes,
+    ) -> None:
+        with self._lock:
+            if name in self._recorded:
+                return
+            with zipfile.ZipFile(self.path, "a", compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr(f"{name}.json", json.dumps(meta))
+                archive.writestr(f"{name}.body", body)
+            self._recorded.add(name)
+
+    async def record(
+            self,
+            endpoint_url: str,
+            params: dict | None,
+            body: bytes,
+            elapsed: float,
+    ) -> None:
+        """
+        Function stores response body if request is not recorded yet
+        Args:
+            endpoint_url (str): Endpoint url
+            params (dict | None): Query parameters
+            body (bytes): Raw response body
+            elapsed (float): Response duration in seconds
+        Returns:
+            None
+        """
+
+        name = self._get_name(endpoint_url, params)
+        if name in self._recorded:
+            return
+        meta = {"endpoint_url": endpoint_url, "params": params, "elapsed": elapsed, "size": len(body)}
+        await asyncio.to_thread(self._write, name, meta, body)
+        metrics.increment("traffic_archive.recorded")
+
+    def _read(
+            self,
+            name: str,
+    ) -> tuple[dict, bytes]:
+        with self._lock:
+            return json.loads(self._archive.read(f"{name}.json")), self._archive.read(f"{name}.body")
+
+    async def replay(
+            self,
+            endpoint_url: str,
+            params: dict | None,
+    ) -> bytes:
+        """
+        Function returns recorded response body after simulated latency
+        Args:
+            endpoint_url (str): Endpoint url
+            params (dict | None): Query parameters
+        Returns:
+            bytes: Raw response body
+        Raises:
+            404, http exception response is not recorded
+        """
+
+        name = self._get_name(endpoint_url, params)
+        if name not in self._recorded:
+            metrics.increment("traffic_archive.missed")
+            raise http_exception(
+                status_code=404,
+                msg="Response is not recorded in urban_api traffic archive",
+                _input={"endpoint_url": endpoint_url, "params": params},
+                _detail={"archive": str(self.path)},
+            )
+        meta, body = await asyncio.to_thread(self._read, name)
+        if latency := meta["elapsed"] if self.recorded_latency else self.latency:
+            await asyncio.sleep(latency)
+        metrics.increment("traffic_archive.replayed")
+        return body
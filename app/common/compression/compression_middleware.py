@@ -0,0 +1,102 @@
+import asyncio
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .response_codecs import ResponseCodecs
+
+
+class CompressionMiddleware:
+    """
+    Middleware compresses responses with encoding negotiated by Accept-Encoding header. Responses already having
+    Content-Encoding (e.g. stored compressed results) and streamed responses are sent as is, bodies are compressed
+    in worker threads, so large results don't block event loop
+    """
+
+    compressible_types = (
+        "application/json",
+        "application/geo+json",
+        "application/vnd.mapbox-vector-tile",
+        "text/plain",
+        "text/html",
+    )
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            codecs: ResponseCodecs,
+            paths: tuple[str, ...] = ("/effects",),
+            min_size: int = 1024,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            app (ASGIApp): wrapped application
+            codecs (ResponseCodecs): response codecs
+            paths (tuple[str, ...]): prefixes of paths which responses are compressed
+            min_size (int): min body size in bytes to compress
+        Returns:
+            None
+        """
+
+        self.app = app
+        self.codecs = codecs
+        self.paths = paths
+        self.min_size = min_size
+
+    def _is_compressible(
+            self,
+            headers: Headers,
+            body: bytes,
+    ) -> bool:
+        """
+        Function checks whether response body should be compressed
+        Args:
+            headers (Headers): response headers
+            body (bytes): response body
+        Returns:
+            bool: True if body is not encoded yet, has compressible type and is large enough
+        """
+
+        if "content-encoding" in headers or len(body) < self.min_size:
+            return False
+        return headers.get("content-type", "").startswith(self.compressible_types)
+
+    async def __call__(
+            self,
+            scope: Scope,
+            receive: Receive,
+            send: Send,
+    ) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+        encoding = self.codecs.negotiate(Headers(scope=scope).get("accept-encoding"))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+        start_message: Message | None = None
+        started = False
+
+        async def send_message(message: Message) -> None:
+            nonlocal start_message, started
+            if message["type"] == "http.response.start":
+                # headers are sent with the first body message when it is known whether body is compressed
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or started:
+                await send(message)
+                return
+            started = True
+            headers = MutableHeaders(scope=start_message)
+            body = message.get("body", b"")
+            if not message.get("more_body", False) and self._is_compressible(headers, body):
+                body = await asyncio.to_thread(self.codecs.compress, body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                message = {**message, "body": body}
+            await send(start_message)
+            await send(message)
+
+        await self.app(scope, receive, send_message)
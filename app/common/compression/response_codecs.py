@@ -0,0 +1,144 @@
+import gzip
+import time
+from typing import Callable
+
+from app.common.metrics.metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ResponseCodecs:
+    """
+    Class negotiates response content encoding by Accept-Encoding header and compresses bodies. gzip is always
+    available, brotli and zstd are used only if their optional packages are installed
+    """
+
+    def __init__(
+            self,
+            gzip_level: int = 6,
+            brotli_quality: int = 5,
+            zstd_level: int = 3,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            gzip_level (int): gzip compression level
+            brotli_quality (int): brotli compression quality
+            zstd_level (int): zstd compression level
+        Returns:
+            None
+        """
+
+        # order sets server preference when client accepts several encodings with the same weight
+        self._compressors: dict[str, Callable[[bytes], bytes]] = {}
+        self._decompressors: dict[str, Callable[[bytes], bytes]] = {}
+        if zstandard:
+            # zstandard contexts are not thread safe, bodies are compressed in worker threads
+            self._compressors["zstd"] = lambda body: zstandard.ZstdCompressor(level=zstd_level).compress(body)
+            self._decompressors["zstd"] = lambda body: zstandard.ZstdDecompressor().decompress(body)
+        if brotli:
+            self._compressors["br"] = lambda body: brotli.compress(body, quality=brotli_quality)
+            self._decompressors["br"] = brotli.decompress
+        self._compressors["gzip"] = lambda body: gzip.compress(body, compresslevel=gzip_level, mtime=0)
+        self._decompressors["gzip"] = gzip.decompress
+
+    @property
+    def encodings(self) -> tuple[str, ...]:
+        return tuple(self._compressors)
+
+    @staticmethod
+    def _parse_accept_encoding(accept_encoding: str) -> dict[str, float]:
+        """
+        Function parses Accept-Encoding header
+        Args:
+            accept_encoding (str): header value, e.g. "gzip, br;q=0.9, *;q=0"
+        Returns:
+            dict[str, float]: weights by encoding name
+        """
+
+        weights = {}
+        for item in accept_encoding.split(","):
+            name, _, params = item.partition(";")
+            if not (name := name.strip().lower()):
+                continue
+            weight = 1.0
+            for param in params.split(";"):
+                param_name, _, value = param.partition("=")
+                if param_name.strip() == "q":
+                    try:
+                        weight = float(value)
+                    except ValueError:
+                        weight = 0.0
+            weights[name] = weight
+        return weights
+
+    def negotiate(
+            self,
+            accept_encoding: str | None,
+            preferred: str | None = None,
+    ) -> str | None:
+        """
+        Function selects response encoding accepted by client with the highest weight
+        Args:
+            accept_encoding (str | None): Accept-Encoding header value
+            preferred (str | None): encoding to select among encodings with the same weight, e.g. encoding of
+            already compressed body, defaults to None (server preference)
+        Returns:
+            str | None: encoding name, None if body should not be compressed
+        """
+
+        if not accept_encoding:
+            return None
+        weights = self._parse_accept_encoding(accept_encoding)
+        encodings = sorted(self._compressors, key=lambda name: name != preferred)
+        encoding, encoding_weight = None, 0.0
+        for name in encodings:
+            weight = weights.get(name, weights.get("*", 0.0))
+            if weight > encoding_weight:
+                encoding, encoding_weight = name, weight
+        return encoding
+
+    def compress(
+            self,
+            body: bytes,
+            encoding: str,
+    ) -> bytes:
+        """
+        Function compresses body and counts compressed bytes and spent cpu time by encoding
+        Args:
+            body (bytes): body to compress
+            encoding (str): encoding name
+        Returns:
+            bytes: compressed body
+        """
+
+        start = time.thread_time()
+        compressed = self._compressors[encoding](body)
+        metrics.increment(f"compression.{encoding}.cpu_seconds", time.thread_time() - start)
+        metrics.increment(f"compression.{encoding}.bytes_in", len(body))
+        metrics.increment(f"compression.{encoding}.bytes_out", len(compressed))
+        return compressed
+
+    def decompress(
+            self,
+            body: bytes,
+            encoding: str,
+    ) -> bytes:
+        """
+        Function decompresses body
+        Args:
+            body (bytes): compressed body
+            encoding (str): encoding name
+        Returns:
+            bytes: decompressed body
+        """
+
+        return self._decompressors[encoding](body)
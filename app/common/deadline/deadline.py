@@ -0,0 +1,211 @@
+import asyncio
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable
+
+from app.common.exceptions.http_exception_wrapper import http_exception
+from app.common.metrics.metrics import metrics
+from app.common.profiling.request_profiler import request_profiler
+
+
+class Deadline:
+    """
+    Class describes time limit of request and cancellation of work done for it. Work in threads can't be interrupted,
+    so long stages check deadline between their steps and stop when it is expired or cancelled
+    """
+
+    def __init__(
+            self,
+            timeout: float | None = None,
+            parent: "Deadline | None" = None,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            timeout (float | None): time limit in seconds, defaults to None (no limit except parent one)
+            parent (Deadline | None): deadline of outer work, its limit and cancellation apply to this deadline
+        Returns:
+            None
+        """
+
+        self.parent = parent
+        self.expires_at = time.monotonic() + timeout if timeout else None
+        if parent and parent.expires_at is not None:
+            self.expires_at = parent.expires_at if self.expires_at is None else min(self.expires_at, parent.expires_at)
+        self._cancelled = threading.Event()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set() or bool(self.parent and self.parent.is_cancelled)
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def remaining(self) -> float | None:
+        """
+        Function returns time left before deadline
+        Returns:
+            float | None: remaining seconds, None if deadline has no time limit
+        """
+
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def check(
+            self,
+            stage: str | None = None,
+    ) -> None:
+        """
+        Function stops work if deadline is cancelled or expired
+        Args:
+            stage (str | None): name of current stage for error details
+        Returns:
+            None
+        Raises:
+            499, http exception work is cancelled
+            504, http exception deadline exceeded
+        """
+
+        if self.is_cancelled:
+            raise http_exception(
+                status_code=499,
+                msg="Request is cancelled",
+                _input={"stage": stage},
+                _detail={},
+            )
+        if (remaining := self.remaining()) is not None and remaining <= 0:
+            metrics.increment("request_deadline.exceeded")
+            raise http_exception(
+                status_code=504,
+                msg="Request deadline exceeded",
+                _input={"stage": stage},
+                _detail={"exceeded_by": round(-remaining, 3)},
+            )
+
+
+class RequestDeadline:
+    """
+    Class carries deadline of current request by context variable, so it is available in pipeline coroutines, in
+    urban_api requests and in threads started by to_thread
+    """
+
+    def __init__(self) -> None:
+        """Initialisation function
+
+        Returns:
+            None
+        """
+
+        self._deadline: ContextVar[Deadline | None] = ContextVar("request_deadline", default=None)
+
+    def get(self) -> Deadline | None:
+        return self._deadline.get()
+
+    def start(
+            self,
+            timeout: float | None,
+    ) -> Any:
+        """
+        Function sets deadline of current context
+        Args:
+            timeout (float | None): time limit in seconds, None means request is not limited
+        Returns:
+            Any: context variable token to reset deadline with
+        """
+
+        return self._deadline.set(Deadline(timeout) if timeout else None)
+
+    def reset(self, token: Any) -> None:
+        self._deadline.reset(token)
+
+    def remaining(self) -> float | None:
+        """
+        Function returns time left before deadline of current context
+        Returns:
+            float | None: remaining seconds, None if there is no deadline
+        """
+
+        if deadline := self._deadline.get():
+            return deadline.remaining()
+        return None
+
+    def check(
+            self,
+            stage: str | None = None,
+    ) -> None:
+        """
+        Function stops work if deadline of current context is cancelled or expired
+        Args:
+            stage (str | None): name of current stage for error details
+        Returns:
+            None
+        Raises:
+            499, http exception work is cancelled
+            504, http exception deadline exceeded
+        """
+
+        if deadline := self._deadline.get():
+            deadline.check(stage)
+
+    def bind(
+            self,
+            func: Callable,
+    ) -> Callable:
+        """
+        Function binds deadline of current context to func. Executors threads don't copy context, so functions
+        submitted to them are bound to keep deadline checks working. Thread running func is sampled if request is
+        profiled
+        Args:
+            func (Callable): function to bind
+        Returns:
+            Callable: function running with current deadline
+        """
+
+        deadline = self._deadline.get()
+        func = request_profiler.bind(func)
+
+        @wraps(func)
+        def bound(*args, **kwargs):
+            token = self._deadline.set(deadline)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._deadline.reset(token)
+
+        return bound
+
+    async def to_thread(
+            self,
+            func: Callable,
+            /,
+            *args,
+            **kwargs,
+    ) -> Any:
+        """
+        Function runs func in thread as asyncio.to_thread does. Thread gets own deadline cancelled when awaiting task
+        is cancelled, so func stops on its next deadline check instead of running to completion. Thread is sampled if
+        request is profiled
+        Args:
+            func (Callable): function to run
+            *args: func positional arguments
+            **kwargs: func keyword arguments
+        Returns:
+            Any: func result
+        """
+
+        deadline = Deadline(parent=self._deadline.get())
+        token = self._deadline.set(deadline)
+        try:
+            return await asyncio.to_thread(request_profiler.bind(func), *args, **kwargs)
+        except asyncio.CancelledError:
+            deadline.cancel()
+            metrics.increment("request_deadline.cancelled_threads")
+            raise
+        finally:
+            self._deadline.reset(token)
+
+
+request_deadline = RequestDeadline()
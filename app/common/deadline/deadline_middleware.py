@@ -0,0 +1,104 @@
+import asyncio
+
+from loguru import logger
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.common.metrics.metrics import metrics
+from .deadline import request_deadline
+
+
+class DeadlineMiddleware:
+    """
+    Middleware starts request deadline and cancels request handling when client disconnects. Deadline is taken from
+    X-Request-Deadline header as seconds left for request, default timeout is used if header is not set and limits
+    header value
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            timeout: float | None = None,
+            header: str = "x-request-deadline",
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            app (ASGIApp): wrapped application
+            timeout (float | None): default request timeout in seconds, defaults to None (requests are not limited)
+            header (str): deadline header name
+        Returns:
+            None
+        """
+
+        self.app = app
+        self.timeout = timeout
+        self.header = header.lower().encode()
+
+    def _get_timeout(
+            self,
+            scope: Scope,
+    ) -> float | None:
+        """
+        Function derives request timeout from deadline header and default timeout
+        Args:
+            scope (Scope): request scope
+        Returns:
+            float | None: request timeout in seconds, None if request is not limited
+        """
+
+        for name, value in scope["headers"]:
+            if name == self.header:
+                try:
+                    timeout = float(value)
+                except ValueError:
+                    break
+                if timeout > 0:
+                    return min(timeout, self.timeout) if self.timeout else timeout
+                break
+        return self.timeout
+
+    async def __call__(
+            self,
+            scope: Scope,
+            receive: Receive,
+            send: Send,
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        messages: asyncio.Queue[Message] = asyncio.Queue()
+        response_sent = False
+
+        async def send_message(message: Message) -> None:
+            nonlocal response_sent
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_sent = True
+            await send(message)
+
+        async def read_messages() -> None:
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        token = request_deadline.start(self._get_timeout(scope))
+        try:
+            app_task = asyncio.create_task(self.app(scope, messages.get, send_message))
+        finally:
+            request_deadline.reset(token)
+        reader_task = asyncio.create_task(read_messages())
+        try:
+            await asyncio.wait((app_task, reader_task), return_when=asyncio.FIRST_COMPLETED)
+            if not app_task.done() and not response_sent:
+                # client is gone, nobody will read response
+                app_task.cancel()
+                metrics.increment("request_deadline.disconnected")
+                logger.info(f"Client disconnected, handling of {scope['path']} is cancelled")
+                await asyncio.wait((app_task,))
+                return
+            await app_task
+        finally:
+            reader_task.cancel()
+            if not app_task.done():
+                app_task.cancel()
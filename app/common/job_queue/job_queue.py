@@ -0,0 +1,459 @@
+import asyncio
+import contextvars
+import gzip
+import json
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Literal
+
+from fastapi import HTTPException
+from loguru import logger
+
+from app.common.exceptions.http_exception_wrapper import http_exception
+
+
+JobStatus = Literal["queued", "running", "done", "failed", "cancelled"]
+
+
+class Job:
+    """
+    Class describes single job state, its stage-level progress and its result
+    """
+
+    def __init__(
+            self,
+            key: str,
+            params: dict,
+            stages: list[str] | tuple[str, ...],
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            key (str): job deduplication key
+            params (dict): job parameters
+            stages (list[str] | tuple[str, ...]): ordered list of job stages names
+        Returns:
+            None
+        """
+
+        self.job_id = uuid.uuid4().hex
+        self.key = key
+        self.params = params
+        self.stages = list(stages)
+        self.status: JobStatus = "queued"
+        self.stage: str | None = None
+        self.completed_stages: list[str] = []
+        self.result: Any = None
+        self.error: dict | None = None
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.task: asyncio.Task | None = None
+        self.on_stage: Callable[["Job"], None] | None = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def report_stage(self, stage: str) -> None:
+        """
+        Function marks previous stage as completed and sets current stage
+        Args:
+            stage (str): name of started stage
+        Returns:
+            None
+        """
+
+        if self.stage and self.stage not in self.completed_stages:
+            self.completed_stages.append(self.stage)
+        self.stage = stage
+        if self.on_stage:
+            self.on_stage(self)
+
+    def as_dict(self) -> dict[str, Any]:
+        """
+        Function returns job state without result
+        Returns:
+            dict[str, Any]: job state
+        """
+
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "completed_stages": self.completed_stages,
+            "progress": round(len(self.completed_stages) / len(self.stages), 2) if self.stages else 0,
+            "params": self.params,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict[str, Any]) -> "Job":
+        """
+        Function restores job without result from state stored by another process
+        Args:
+            state (dict[str, Any]): job state with "key" and "stages"
+        Returns:
+            Job: restored job
+        """
+
+        job = cls(key=state["key"], params=state["params"], stages=state["stages"])
+        job.job_id, job.status, job.stage = state["job_id"], state["status"], state["stage"]
+        job.completed_stages, job.error = state["completed_stages"], state["error"]
+        job.created_at, job.started_at, job.finished_at = state["created_at"], state["started_at"], state["finished_at"]
+        return job
+
+
+class JobQueue:
+    """
+    Class for in-process job queue with bounded worker concurrency, in-flight jobs deduplication
+    and finished jobs store with expiry. If directory is set, jobs states and results are stored on disk, so job
+    submitted to one worker process is polled, cancelled and downloaded from any. Job is executed by process it was
+    submitted to, other processes cancel it by marker file checked before its next stage
+    """
+
+    job_id_pattern = re.compile(r"[0-9a-f]{32}")
+
+    def __init__(
+            self,
+            max_workers: int,
+            result_ttl: int,
+            max_pending: int = 100,
+            max_finished: int = 100,
+            directory: str | None = None,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            max_workers (int): number of jobs executed simultaneously
+            result_ttl (int): time in seconds finished job with its result is stored
+            max_pending (int): max number of queued and running jobs, new jobs are rejected when it is reached
+            max_finished (int): max number of stored finished jobs, the oldest are deleted when it is exceeded
+            directory (str | None): jobs directory shared by worker processes, defaults to None (jobs are stored in
+            memory of process)
+        Returns:
+            None
+        """
+
+        self.max_workers = max_workers
+        self.result_ttl = result_ttl
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.directory = Path(directory) if directory else None
+        self._jobs: dict[str, Job] = {}
+        self._in_flight: dict[str, str] = {}
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+
+    def _start(self) -> None:
+        """
+        Function starts workers in current event loop if they are not started yet
+        Returns:
+            None
+        """
+
+        if self._workers:
+            return
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self._queue = asyncio.Queue()
+        # workers are started by request, they must not inherit its context with request deadline
+        self._workers = [
+            asyncio.create_task(self._worker(), context=contextvars.Context()) for _ in range(self.max_workers)
+        ]
+
+    async def stop(self) -> None:
+        """
+        Function cancels all workers and running jobs
+        Returns:
+            None
+        """
+
+        for job in self._jobs.values():
+            if not job.is_finished:
+                self.cancel(job.job_id)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def _get_path(
+            self,
+            job_id: str,
+            suffix: str,
+    ) -> Path:
+        return self.directory / f"{job_id}{suffix}"
+
+    def _save(
+            self,
+            job: Job,
+    ) -> None:
+        """
+        Function writes job state to temporary file and renames it, so other processes never read partial state
+        Args:
+            job (Job): job to save
+        Returns:
+            None
+        """
+
+        if not self.directory:
+            return
+        path = self._get_path(job.job_id, ".json")
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as state:
+            json.dump({**job.as_dict(), "key": job.key, "stages": job.stages}, state)
+        os.replace(tmp_path, path)
+
+    def _save_result(
+            self,
+            job: Job,
+    ) -> None:
+        path = self._get_path(job.job_id, ".result.json.gz")
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as result:
+            json.dump(job.result, result)
+        os.replace(tmp_path, path)
+
+    def _load(
+            self,
+            job_id: str,
+    ) -> Job | None:
+        """
+        Function reads job stored by another process. Job cancelled by marker is reported as cancelled before its
+        process stops it
+        Args:
+            job_id (str): job id
+        Returns:
+            Job | None: job if it is stored
+        """
+
+        if not self.directory or not self.job_id_pattern.fullmatch(job_id):
+            return None
+        try:
+            with open(self._get_path(job_id, ".json")) as state:
+                job = Job.from_state(json.load(state))
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Failed to read job {job_id}: {e}")
+            return None
+        if not job.is_finished and (marker := self._get_path(job_id, ".cancel")).exists():
+            job.status = "cancelled"
+            job.finished_at = marker.stat().st_mtime
+        return job
+
+    def _delete(
+            self,
+            job_id: str,
+    ) -> None:
+        if not self.directory:
+            return
+        for suffix in (".json", ".result.json.gz", ".cancel"):
+            self._get_path(job_id, suffix).unlink(missing_ok=True)
+
+    def _purge_expired(self) -> None:
+        """
+        Function deletes finished jobs with expired results and the oldest finished jobs exceeding max number
+        Returns:
+            None
+        """
+
+        expire_before = time.time() - self.result_ttl
+        finished = sorted(
+            (job for job in self._jobs.values() if job.is_finished), key=lambda job: job.finished_at, reverse=True
+        )
+        expired = [
+            job.job_id for index, job in enumerate(finished)
+            if index >= self.max_finished or job.finished_at < expire_before
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+            self._delete(job_id)
+
+    def submit(
+            self,
+            key: str,
+            params: dict,
+            stages: list[str] | tuple[str, ...],
+            job_func: Callable[[Job], Awaitable[Any]],
+    ) -> Job:
+        """
+        Function puts job to queue. If identical job is already queued or running returns it instead
+        Args:
+            key (str): job deduplication key
+            params (dict): job parameters
+            stages (list[str] | tuple[str, ...]): ordered list of job stages names
+            job_func (Callable[[Job], Awaitable[Any]]): coroutine function to execute with job as argument, its
+            result must be json serializable if jobs are stored on disk
+        Returns:
+            Job: new or already existing in-flight job
+        Raises:
+            503, http exception max number of queued and running jobs is reached
+        """
+
+        self._purge_expired()
+        if job_id := self._in_flight.get(key):
+            return self._jobs[job_id]
+        if len(self._in_flight) >= self.max_pending:
+            raise http_exception(
+                status_code=503,
+                msg="Job queue is full",
+                _input={"params": params},
+                _detail={"max_pending": self.max_pending},
+            )
+        self._start()
+        job = Job(key=key, params=params, stages=stages)
+        job.on_stage = self._on_stage
+        self._jobs[job.job_id] = job
+        self._in_flight[key] = job.job_id
+        self._save(job)
+        self._queue.put_nowait((job, job_func))
+        logger.info(f"Job {job.job_id} queued with params {params}")
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """
+        Function returns job by its id. Job of another process is returned without result
+        Args:
+            job_id (str): job id
+        Returns:
+            Job | None: job if it exists and its result is not expired
+        """
+
+        self._purge_expired()
+        if job := self._jobs.get(job_id):
+            return job
+        if (job := self._load(job_id)) and job.is_finished and job.finished_at < time.time() - self.result_ttl:
+            self._delete(job_id)
+            return None
+        return job
+
+    def get_result(
+            self,
+            job: Job,
+    ) -> Any:
+        """
+        Function returns result of finished job, reading it from disk if jobs are stored there
+        Args:
+            job (Job): finished job
+        Returns:
+            Any: job result, None if it is not available
+        """
+
+        if job.result is not None or not self.directory:
+            return job.result
+        try:
+            with gzip.open(self._get_path(job.job_id, ".result.json.gz"), "rt", encoding="utf-8") as result:
+                return json.load(result)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read result of job {job.job_id}: {e}")
+            return None
+
+    def cancel(self, job_id: str) -> Job | None:
+        """
+        Function cancels queued or running job. Running job is stopped before its next stage. Job of another
+        process is marked to be cancelled by it
+        Args:
+            job_id (str): job id
+        Returns:
+            Job | None: cancelled job if it exists
+        """
+
+        job = self.get(job_id)
+        if not job or job.is_finished:
+            return job
+        if job_id not in self._jobs:
+            self._get_path(job_id, ".cancel").touch()
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return job
+        if job.task:
+            job.task.cancel()
+        self._finish(job, "cancelled")
+        return job
+
+    def _finish(self, job: Job, status: JobStatus) -> None:
+        """
+        Function marks job as finished and releases its deduplication key
+        Args:
+            job (Job): job to finish
+            status (JobStatus): final job status
+        Returns:
+            None
+        """
+
+        job.status = status
+        job.finished_at = time.time()
+        if self._in_flight.get(job.key) == job.job_id:
+            del self._in_flight[job.key]
+        self._save(job)
+
+    def _on_stage(
+            self,
+            job: Job,
+    ) -> None:
+        """
+        Function saves progress of job and cancels it if it is marked to be cancelled by another process
+        Args:
+            job (Job): job which started new stage
+        Returns:
+            None
+        """
+
+        if self.directory and self._get_path(job.job_id, ".cancel").exists():
+            self.cancel(job.job_id)
+        else:
+            self._save(job)
+
+    async def _worker(self) -> None:
+        """
+        Function executes queued jobs one by one
+        Returns:
+            None
+        """
+
+        while True:
+            job, job_func = await self._queue.get()
+            if not job.is_finished and self.directory and self._get_path(job.job_id, ".cancel").exists():
+                self._finish(job, "cancelled")
+            if job.is_finished:
+                continue
+            job.status = "running"
+            job.started_at = time.time()
+            self._save(job)
+            with logger.contextualize(request_id=job.job_id):
+                job.task = asyncio.create_task(job_func(job))
+            try:
+                result = await job.task
+                job.on_stage = None
+                job.report_stage("done")
+                if self.directory:
+                    job.result = result
+                    await asyncio.to_thread(self._save_result, job)
+                    # result is read from disk, so process memory is not held by finished jobs
+                    job.result = None
+                else:
+                    job.result = result
+                self._finish(job, "done")
+                logger.info(f"Job {job.job_id} finished")
+            except asyncio.CancelledError:
+                # job cancellation is swallowed, worker cancellation by stop() is not
+                if not job.task.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                logger.info(f"Job {job.job_id} cancelled on stage {job.stage}")
+            except HTTPException as e:
+                job.error = {"status_code": e.status_code, "detail": e.detail}
+                self._finish(job, "failed")
+                logger.warning(f"Job {job.job_id} failed with {e.status_code}: {e.detail}")
+            except Exception as e:
+                job.error = {"status_code": 500, "detail": repr(e)}
+                self._finish(job, "failed")
+                logger.exception(f"Job {job.job_id} failed")
+            finally:
+                job.task = None
@@ -0,0 +1,86 @@
+import threading
+from collections import deque
+
+from loguru import logger
+
+
+class LogBuffer:
+    """
+    Class for loguru sink storing last log records as structured dicts in bounded ring buffer. Records keep
+    request id, stage, duration and other values bound to logger
+    """
+
+    def __init__(
+            self,
+            max_records: int = 10000,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            max_records (int): max number of stored records, the oldest records are dropped
+        Returns:
+            None
+        """
+
+        self._records: deque[dict] = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_value(value):
+        if value is None or isinstance(value, (bool, int, float, str, dict, list)):
+            return value
+        return repr(value)
+
+    def write(self, message) -> None:
+        """
+        Function stores log message record, it is called by loguru
+        Args:
+            message (loguru.Message): formatted message with record
+        Returns:
+            None
+        """
+
+        record = message.record
+        entry = {
+            "time": record["time"].isoformat(),
+            "level": record["level"].name,
+            "level_no": record["level"].no,
+            "message": record["message"],
+            "module": record["name"],
+            "function": record["function"],
+            "line": record["line"],
+        }
+        entry |= {name: self._get_value(value) for name, value in record["extra"].items()}
+        if record["exception"]:
+            entry["exception"] = f"{record['exception'].type.__name__}: {record['exception'].value}"
+        with self._lock:
+            self._records.append(entry)
+
+    def get_records(
+            self,
+            limit: int,
+            level: str | None = None,
+            request_id: str | None = None,
+    ) -> list[dict]:
+        """
+        Function returns last records matching filters. Records are scanned from the newest one and scan stops when
+        limit is reached
+        Args:
+            limit (int): max number of records
+            level (str | None): min records level name, defaults to None (all levels)
+            request_id (str | None): request id of records, defaults to None (all requests)
+        Returns:
+            list[dict]: records in chronological order
+        """
+
+        level_no = logger.level(level.upper()).no if level else 0
+        records = []
+        with self._lock:
+            for entry in reversed(self._records):
+                if len(records) >= limit:
+                    break
+                if entry["level_no"] < level_no or (request_id and entry.get("request_id") != request_id):
+                    continue
+                records.append(entry)
+        records.reverse()
+        return records
@@ -0,0 +1,101 @@
+import os
+import re
+from typing import Iterator
+
+from loguru import logger
+
+
+class LogTail:
+    """
+    Class reads last records of log file. File is read by blocks from its end, so reading cost depends on number
+    of scanned lines, not on file size
+    """
+
+    line_pattern = re.compile(
+        r"^(?P<time>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\.\d{3}) \| (?P<level>[A-Z]+) *\| "
+        r"(?:(?P<request_id>[\w-]+) \| )?(?P<message>.*)$"
+    )
+
+    def __init__(
+            self,
+            path: str,
+            block_size: int = 65536,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            path (str): log file path
+            block_size (int): size of block read from file at once in bytes
+        Returns:
+            None
+        """
+
+        self.path = path
+        self.block_size = block_size
+
+    def _read_lines_reversed(self) -> Iterator[str]:
+        """
+        Function reads file lines from the last one to the first one
+        Returns:
+            Iterator[str]: file lines without line breaks
+        """
+
+        with open(self.path, "rb") as log_file:
+            position = log_file.seek(0, os.SEEK_END)
+            rest = b""
+            while position > 0:
+                size = min(self.block_size, position)
+                position -= size
+                log_file.seek(position)
+                lines = (log_file.read(size) + rest).split(b"\n")
+                # first line can continue in previous block
+                rest = lines.pop(0)
+                for line in reversed(lines):
+                    if line:
+                        yield line.decode(errors="replace")
+            if rest:
+                yield rest.decode(errors="replace")
+
+    def read(
+            self,
+            limit: int,
+            level: str | None = None,
+            request_id: str | None = None,
+    ) -> list[dict]:
+        """
+        Function returns last log file records matching filters. Lines not matching log format (e.g. traceback
+        lines) are attached to the preceding record
+        Args:
+            limit (int): max number of records
+            level (str | None): min records level name, defaults to None (all levels)
+            request_id (str | None): request id of records, defaults to None (all requests)
+        Returns:
+            list[dict]: records with "time", "level", "request_id" and "message" in chronological order
+        """
+
+        if not os.path.exists(self.path):
+            return []
+        level_no = logger.level(level.upper()).no if level else 0
+        levels_no = {}
+        records = []
+        continuation = []
+        for line in self._read_lines_reversed():
+            if not (match := self.line_pattern.match(line)):
+                continuation.append(line)
+                continue
+            record = match.groupdict()
+            if continuation:
+                record["message"] = "\n".join([record["message"], *reversed(continuation)])
+                continuation = []
+            if record["level"] not in levels_no:
+                try:
+                    levels_no[record["level"]] = logger.level(record["level"]).no
+                except ValueError:
+                    levels_no[record["level"]] = 0
+            if levels_no[record["level"]] < level_no or (request_id and record["request_id"] != request_id):
+                continue
+            records.append(record)
+            if len(records) >= limit:
+                break
+        records.reverse()
+        return records
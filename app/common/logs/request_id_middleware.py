@@ -0,0 +1,81 @@
+import re
+import time
+import uuid
+
+from loguru import logger
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class RequestIdMiddleware:
+    """
+    Middleware binds request id to all logs written while request is handled. Request id is taken from X-Request-ID
+    header or generated, it is returned in response header and request handling duration is logged with it
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            header: str = "x-request-id",
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            app (ASGIApp): wrapped application
+            header (str): request id header name
+        Returns:
+            None
+        """
+
+        self.app = app
+        self.header = header.lower().encode()
+
+    def _get_request_id(
+            self,
+            scope: Scope,
+    ) -> str:
+        """
+        Function returns request id from header or generates new one. Header value is limited to word characters and
+        hyphens, so it can be matched in log file lines
+        Args:
+            scope (Scope): request scope
+        Returns:
+            str: request id
+        """
+
+        for name, value in scope["headers"]:
+            if name == self.header:
+                if request_id := re.sub(r"[^\w-]", "", value.decode(errors="replace"))[:64]:
+                    return request_id
+                break
+        return uuid.uuid4().hex
+
+    async def __call__(
+            self,
+            scope: Scope,
+            receive: Receive,
+            send: Send,
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = self._get_request_id(scope)
+        # available in endpoints as request.state.request_id
+        scope.setdefault("state", {})["request_id"] = request_id
+        status_code = 500
+
+        async def send_message(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (self.header, request_id.encode())]
+            await send(message)
+
+        start = time.perf_counter()
+        with logger.contextualize(request_id=request_id):
+            try:
+                await self.app(scope, receive, send_message)
+            finally:
+                duration = time.perf_counter() - start
+                logger.bind(duration=round(duration, 3), status_code=status_code).debug(
+                    f"{scope['method']} {scope['path']} handled with {status_code} in {duration:.3f} s"
+                )
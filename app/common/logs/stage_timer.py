@@ -0,0 +1,53 @@
+import time
+from typing import Callable
+
+from loguru import logger
+
+
+class StageTimer:
+    """
+    Class measures durations of sequential pipeline stages. It is used as stage callback, started stages are logged
+    with stage name and forwarded to wrapped callback
+    """
+
+    def __init__(
+            self,
+            on_stage: Callable[[str], None] | None = None,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            on_stage (Callable[[str], None] | None): callback to forward started stages to
+        Returns:
+            None
+        """
+
+        self.on_stage = on_stage
+        self.started_at = time.perf_counter()
+        self.durations: dict[str, float] = {}
+        self._stage: str | None = None
+        self._stage_started_at = self.started_at
+
+    def _finish_stage(self) -> None:
+        now = time.perf_counter()
+        if self._stage:
+            self.durations[self._stage] = round(now - self._stage_started_at, 3)
+        self._stage_started_at = now
+
+    def __call__(self, stage: str) -> None:
+        self._finish_stage()
+        self._stage = stage
+        logger.bind(stage=stage).debug(f"Stage {stage} started")
+        if self.on_stage:
+            self.on_stage(stage)
+
+    def finish(self) -> float:
+        """
+        Function finishes the last stage
+        Returns:
+            float: total duration in seconds
+        """
+
+        self._finish_stage()
+        self._stage = None
+        return round(time.perf_counter() - self.started_at, 3)
@@ -0,0 +1,44 @@
+from collections import defaultdict
+
+
+class MetricsRegistry:
+    """
+    Class for in-process counters exposed by /metrics endpoint
+    """
+
+    def __init__(self) -> None:
+        """Initialisation function
+
+        Returns:
+            None
+        """
+
+        self._counters: dict[str, int | float] = defaultdict(int)
+
+    def increment(
+            self,
+            name: str,
+            value: int | float = 1,
+    ) -> None:
+        """
+        Function increments counter by value
+        Args:
+            name (str): counter name
+            value (int | float): value to add, defaults to 1
+        Returns:
+            None
+        """
+
+        self._counters[name] += value
+
+    def snapshot(self) -> dict[str, int | float]:
+        """
+        Function returns current counters values
+        Returns:
+            dict[str, int | float]: counters values by names
+        """
+
+        return dict(sorted(self._counters.items()))
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,151 @@
+import hmac
+import json
+import os
+import re
+from pathlib import Path
+
+from app.common.exceptions.http_exception_wrapper import http_exception
+from .request_profiler import ProfileSession
+
+
+class ProfileStore:
+    """
+    Class stores request profiles on disk by request id, so profile can be downloaded from any worker. Profiling is
+    enabled only if access token is set, the oldest profiles are deleted when max number of profiles is exceeded
+    """
+
+    request_id_pattern = re.compile(r"[\w-]{1,64}")
+
+    def __init__(
+            self,
+            directory: str,
+            token: str | None = None,
+            max_profiles: int = 50,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            directory (str): profiles directory
+            token (str | None): access token of profiling, defaults to None (profiling is disabled)
+            max_profiles (int): max number of stored profiles
+        Returns:
+            None
+        """
+
+        self.directory = Path(directory)
+        self.token = token
+        self.max_profiles = max_profiles
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def check_token(
+            self,
+            token: str | None,
+    ) -> None:
+        """
+        Function checks profiling access token
+        Args:
+            token (str | None): token from request
+        Returns:
+            None
+        Raises:
+            404, http exception profiling is disabled
+            403, http exception token is invalid
+        """
+
+        if not self.enabled:
+            raise http_exception(
+                status_code=404,
+                msg="Profiling is disabled",
+                _input={},
+                _detail={},
+            )
+        if not token or not hmac.compare_digest(token.encode(), self.token.encode()):
+            raise http_exception(
+                status_code=403,
+                msg="Invalid profiling token",
+                _input={},
+                _detail={},
+            )
+
+    def _get_path(
+            self,
+            request_id: str,
+            suffix: str,
+    ) -> Path:
+        """
+        Function returns profile file path
+        Args:
+            request_id (str): profiled request id
+            suffix (str): profile file suffix
+        Returns:
+            Path: profile file path
+        Raises:
+            404, http exception profile not found
+        """
+
+        path = self.directory / f"{request_id}{suffix}"
+        if not self.request_id_pattern.fullmatch(request_id) or not path.exists():
+            raise http_exception(
+                status_code=404,
+                msg="Profile not found",
+                _input={"request_id": request_id},
+                _detail={},
+            )
+        return path
+
+    def save(
+            self,
+            session: ProfileSession,
+    ) -> None:
+        """
+        Function stores profile summary and folded stacks of finished session and deletes the oldest profiles
+        Args:
+            session (ProfileSession): finished profile session
+        Returns:
+            None
+        """
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / f"{session.request_id}.folded").write_text(session.get_folded_stacks())
+        with open(self.directory / f"{session.request_id}.json", "w") as summary:
+            json.dump(session.get_summary(), summary)
+        profiles = sorted(self.directory.glob("*.json"), key=os.path.getmtime)
+        for path in profiles[:-self.max_profiles]:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".folded").unlink(missing_ok=True)
+
+    def get_summary(
+            self,
+            request_id: str,
+    ) -> dict:
+        """
+        Function returns profile summary with duration, peak memory and top allocation sites
+        Args:
+            request_id (str): profiled request id
+        Returns:
+            dict: profile summary
+        Raises:
+            404, http exception profile not found
+        """
+
+        with open(self._get_path(request_id, ".json")) as summary:
+            return json.load(summary)
+
+    def get_folded_stacks_path(
+            self,
+            request_id: str,
+    ) -> Path:
+        """
+        Function returns path of profile stacks in folded format
+        Args:
+            request_id (str): profiled request id
+        Returns:
+            Path: folded stacks file path
+        Raises:
+            404, http exception profile not found
+        """
+
+        return self._get_path(request_id, ".folded")
@@ -0,0 +1,238 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Iterator
+
+from app.common.exceptions.http_exception_wrapper import http_exception
+from app.common.metrics.metrics import metrics
+
+
+class ProfileSession:
+    """
+    Class samples stacks of threads doing work of one request and optionally traces memory allocations while request
+    is handled. Event loop thread is sampled for the whole request, worker threads only while they run request
+    functions
+    """
+
+    def __init__(
+            self,
+            request_id: str,
+            interval: float = 0.005,
+            trace_memory: bool = False,
+            top_allocations: int = 30,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            request_id (str): profiled request id
+            interval (float): sampling interval in seconds
+            trace_memory (bool): whether memory allocations are traced, tracing slows down allocating code several
+            times, so sampled durations are distorted
+            top_allocations (int): number of allocation sites in result
+        Returns:
+            None
+        """
+
+        self.request_id = request_id
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.top_allocations = top_allocations
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self.peak_memory = 0
+        self.allocations: list[dict] = []
+        self._threads: dict[int, str] = {}
+        self._stopped = threading.Event()
+        self._sampler: threading.Thread | None = None
+        self._started_at = 0.0
+        self._started_tracing = False
+
+    @staticmethod
+    def _format_frame(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self) -> None:
+        """
+        Function collects stacks of tracked threads until session is stopped. Stacks are counted in folded format,
+        root frame first with frames separated by semicolons
+        Returns:
+            None
+        """
+
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, thread_name in list(self._threads.items()):
+                if (frame := frames.get(thread_id)) is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._format_frame(frame))
+                    frame = frame.f_back
+                stack.append(thread_name)
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> None:
+        self._threads[threading.get_ident()] = "event_loop"
+        if self.trace_memory:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self._started_at = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.request_id}", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        """
+        Function stops sampling and collects allocation sites of memory still allocated at the end of request
+        Returns:
+            None
+        """
+
+        self.duration = time.perf_counter() - self._started_at
+        self._stopped.set()
+        self._sampler.join()
+        if not self.trace_memory:
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        self.peak_memory = tracemalloc.get_traced_memory()[1]
+        if self._started_tracing:
+            tracemalloc.stop()
+        self.allocations = [
+            {
+                "location": f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+                "size": statistic.size,
+                "count": statistic.count,
+            }
+            for statistic in snapshot.statistics("lineno")[:self.top_allocations]
+        ]
+
+    @contextmanager
+    def track_thread(self) -> Iterator[None]:
+        """
+        Function adds current thread to sampled threads while context is active
+        Returns:
+            Iterator[None]: context
+        """
+
+        thread_id = threading.get_ident()
+        if thread_id in self._threads:
+            yield
+            return
+        self._threads[thread_id] = "worker"
+        try:
+            yield
+        finally:
+            del self._threads[thread_id]
+
+    def get_folded_stacks(self) -> str:
+        """
+        Function returns sampled stacks in folded format, which is read by flamegraph.pl, speedscope and inferno
+        Returns:
+            str: lines of stack and its samples count
+        """
+
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def get_summary(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "duration": round(self.duration, 3),
+            "samples": self.samples,
+            "interval": self.interval,
+            "trace_memory": self.trace_memory,
+            "peak_memory": self.peak_memory,
+            "allocations": self.allocations,
+        }
+
+
+class RequestProfiler:
+    """
+    Class profiles single requests on demand. Profile session is carried by context variable, so functions run in
+    threads for profiled request are sampled too. Only one request is profiled at a time, as memory tracing is
+    process wide
+    """
+
+    def __init__(self) -> None:
+        """Initialisation function
+
+        Returns:
+            None
+        """
+
+        self._session: ContextVar[ProfileSession | None] = ContextVar("profile_session", default=None)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def profile(
+            self,
+            request_id: str,
+            interval: float = 0.005,
+            trace_memory: bool = False,
+    ) -> Iterator[ProfileSession]:
+        """
+        Function profiles work done in context
+        Args:
+            request_id (str): profiled request id
+            interval (float): sampling interval in seconds
+            trace_memory (bool): whether memory allocations are traced
+        Returns:
+            Iterator[ProfileSession]: active session, its results are available after context exit
+        Raises:
+            409, http exception another request is being profiled
+        """
+
+        if not self._lock.acquire(blocking=False):
+            raise http_exception(
+                status_code=409,
+                msg="Another request is being profiled",
+                _input={"request_id": request_id},
+                _detail={},
+            )
+        session = ProfileSession(request_id, interval=interval, trace_memory=trace_memory)
+        token = self._session.set(session)
+        session.start()
+        try:
+            yield session
+        finally:
+            self._session.reset(token)
+            try:
+                session.stop()
+            finally:
+                self._lock.release()
+            metrics.increment("request_profiler.profiled")
+
+    def bind(
+            self,
+            func: Callable,
+    ) -> Callable:
+        """
+        Function binds profile session of current context to func, so thread running func is sampled. func is
+        returned as is if request is not profiled
+        Args:
+            func (Callable): function to bind
+        Returns:
+            Callable: function tracked by current session
+        """
+
+        if not (session := self._session.get()):
+            return func
+
+        @wraps(func)
+        def bound(*args, **kwargs):
+            with session.track_thread():
+                return func(*args, **kwargs)
+
+        return bound
+
+
+request_profiler = RequestProfiler()
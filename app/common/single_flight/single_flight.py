@@ -0,0 +1,77 @@
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable, Hashable
+
+from app.common.deadline.deadline import request_deadline
+from app.common.metrics.metrics import metrics
+
+
+class _Call:
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Class collapses concurrent identical calls into one in-flight call which result is shared by all callers
+    """
+
+    def __init__(self, name: str) -> None:
+        """Initialisation function
+
+        Args:
+            name (str): name used as metrics prefix
+        Returns:
+            None
+        """
+
+        self.name = name
+        self._calls: dict[Hashable, _Call] = {}
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(
+            self,
+            key: Hashable,
+            func: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        Function executes func or joins identical in-flight call. Call is cancelled only when all its callers
+        are cancelled. Call runs without request deadline, as it is shared by callers with different deadlines,
+        each caller stops waiting at its own deadline
+        Args:
+            key (Hashable): call identity key
+            func (Callable[[], Awaitable[Any]]): coroutine function to execute
+        Returns:
+            Any: func result
+        Raises:
+            504, http exception caller deadline exceeded
+        """
+
+        if call := self._calls.get(key):
+            metrics.increment(f"{self.name}.collapsed")
+        else:
+            metrics.increment(f"{self.name}.executed")
+            context = contextvars.copy_context()
+            context.run(request_deadline.start, None)
+            call = _Call(asyncio.create_task(func(), context=context))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        call.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.task), request_deadline.remaining())
+        except asyncio.TimeoutError:
+            if call.task.done():
+                raise
+            request_deadline.check(self.name)
+            raise
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                call.task.cancel()
@@ -1,17 +1,31 @@
 import sys
+import tempfile
 from datetime import datetime
 
 from loguru import logger
 from iduconfig import Config
+# objectnat resets loguru handlers on import, so it is imported before handlers are added
+import objectnat  # noqa: F401
 
 from app.common.exceptions.http_exception_wrapper import http_exception
 from app.common.api_handler.api_handler import APIHandler
+from app.common.api_handler.response_cache import ResponseCache
+from app.common.api_handler.traffic_archive import TrafficArchive
+from app.common.compression.response_codecs import ResponseCodecs
+from app.common.job_queue.job_queue import JobQueue
+from app.common.logs.log_buffer import LogBuffer
+from app.common.logs.log_tail import LogTail
+from app.common.profiling.profile_store import ProfileStore
 
 
 logger.remove()
+logger.configure(extra={"request_id": "-"})
 logger.add(sys.stderr, level="INFO")
 log_level = "INFO"
-log_format = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <b>{message}</b>"
+log_format = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[request_id]} | "
+    "<b>{message}</b>"
+)
 logger.add(
     sys.stderr,
     format=log_format,
@@ -21,10 +35,69 @@ logger.add(
 
 config = Config()
 
+
+def get_config_value(key: str, default: str | None = None) -> str | None:
+    """
+    Function retrieves optional value from config
+    Args:
+        key (str): name of variable
+        default (str | None): value to return if variable is not set
+    Returns:
+        str | None: variable value or default
+    """
+
+    try:
+        return config.get(key)
+    except ValueError:
+        return default
+
+
 logger.add(
     f"{config.get('LOGS_FILE')}.log",
     format=log_format,
     level="INFO",
 )
+log_buffer = LogBuffer(
+    max_records=int(get_config_value("LOGS_BUFFER_SIZE", "10000")),
+)
+logger.add(
+    log_buffer.write,
+    format="{message}",
+    level=get_config_value("LOGS_BUFFER_LEVEL", "DEBUG"),
+)
+log_tail = LogTail(f"{config.get('LOGS_FILE')}.log")
 
-urban_api_handler = APIHandler(config.get("URBAN_API"))
+urban_api_cache = ResponseCache(
+    policies={
+        r"/api/v1/projects/\d+": int(get_config_value("PROJECT_CACHE_TTL", "300")),
+        r"/api/v1/projects/\d+/territory": int(get_config_value("PROJECT_CACHE_TTL", "300")),
+    },
+    max_bytes=int(get_config_value("URBAN_API_CACHE_SIZE_MB", "64")) * 1024 * 1024,
+)
+response_codecs = ResponseCodecs(
+    gzip_level=int(get_config_value("COMPRESSION_GZIP_LEVEL", "6")),
+    brotli_quality=int(get_config_value("COMPRESSION_BROTLI_QUALITY", "5")),
+    zstd_level=int(get_config_value("COMPRESSION_ZSTD_LEVEL", "3")),
+)
+profile_store = ProfileStore(
+    directory=get_config_value("PROFILES_DIR", f"{tempfile.gettempdir()}/effects_profiles"),
+    token=get_config_value("PROFILING_TOKEN"),
+    max_profiles=int(get_config_value("PROFILES_MAX", "50")),
+)
+urban_api_mode = get_config_value("URBAN_API_MODE", "live")
+urban_api_replay_latency = get_config_value("URBAN_API_REPLAY_LATENCY", "0")
+urban_api_archive = TrafficArchive(
+    path=get_config_value("URBAN_API_ARCHIVE", "urban_api_traffic.zip"),
+    mode=urban_api_mode,
+    latency=0.0 if urban_api_replay_latency == "recorded" else float(urban_api_replay_latency),
+    recorded_latency=urban_api_replay_latency == "recorded",
+) if urban_api_mode != "live" else None
+urban_api_handler = APIHandler(config.get("URBAN_API"), cache=urban_api_cache, archive=urban_api_archive)
+effects_job_queue = JobQueue(
+    max_workers=int(get_config_value("JOB_WORKERS", "2")),
+    result_ttl=int(get_config_value("JOB_RESULT_TTL", "3600")),
+    max_pending=int(get_config_value("JOB_MAX_PENDING", "100")),
+    max_finished=int(get_config_value("JOB_MAX_FINISHED", "100")),
+    # shared by gunicorn workers of one host, must be shared volume if workers run on several hosts
+    directory=get_config_value("JOBS_DIR", f"{tempfile.gettempdir()}/effects_jobs"),
+)
@@ -17,3 +17,70 @@ class EffectsDTO(BaseModel):
         examples=[200],
         description="Target population for project territory"
     )
+    delta_only: bool = Field(
+        default=False,
+        examples=[False],
+        description="Return only buildings and services which provision changed with unchanged objects summary"
+    )
+
+
+class CapacitySweepDTO(EffectsDTO):
+
+    variants: list[dict[int, int]] = Field(
+        ...,
+        min_length=1,
+        max_length=100,
+        examples=[[{9000: 300}, {9000: 600}, {9000: 900}]],
+        description="Capacities of target scenario services by service id for each variant"
+    )
+
+
+class DemandUncertaintyDTO(EffectsDTO):
+
+    realizations: int = Field(
+        default=100,
+        ge=2,
+        le=1000,
+        examples=[100],
+        description="Number of random demand realizations"
+    )
+    confidence: float = Field(
+        default=0.9,
+        gt=0,
+        lt=1,
+        examples=[0.9],
+        description="Confidence level of intervals"
+    )
+    seed: Optional[int] = Field(
+        default=0,
+        examples=[0],
+        description="Random generator seed, realizations are not reproducible without seed"
+    )
+
+
+class PlacementDTO(EffectsDTO):
+
+    capacity: int = Field(
+        ...,
+        ge=1,
+        examples=[600],
+        description="Capacity of new service"
+    )
+    candidates: Optional[list[tuple[float, float]]] = Field(
+        default=None,
+        examples=[[[30.3015, 59.9015], [30.3021, 59.9009]]],
+        description="Candidate locations as longitude and latitude, defaults to grid over project territory"
+    )
+    grid_step: float = Field(
+        default=50,
+        ge=5,
+        examples=[50],
+        description="Step of candidates grid over project territory in meters"
+    )
+    top: int = Field(
+        default=20,
+        ge=1,
+        le=1000,
+        examples=[20],
+        description="Number of best candidates to return"
+    )
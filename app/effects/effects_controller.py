@@ -1,11 +1,18 @@
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
+from app.dependencies import profile_store, response_codecs
 
-from .dto.effects_dto import EffectsDTO
+from .dto.effects_dto import EffectsDTO, CapacitySweepDTO, DemandUncertaintyDTO, PlacementDTO
 from .shemas.effects_base_schema import EffectsSchema
+from .shemas.job_schema import JobSchema
+from .shemas.capacity_sweep_schema import CapacitySweepSchema
+from .shemas.demand_uncertainty_schema import DemandUncertaintySchema
+from .shemas.placement_schema import PlacementSchema
 from .effects_service import effects_service
+from .modules import result_snapshots
 
 
 effects_router = APIRouter(prefix="/effects")
@@ -13,14 +20,208 @@ effects_router = APIRouter(prefix="/effects")
 @effects_router.get("/evaluate_provision", response_model=EffectsSchema)
 async def calculate_effects(
         params: Annotated[EffectsDTO, Depends(EffectsDTO)],
-) -> EffectsSchema:
+        request: Request,
+        x_profile_token: Annotated[str | None, Header()] = None,
+        x_profile_memory: Annotated[bool, Header()] = False,
+) -> EffectsSchema | Response:
     """
-    Get method for retrieving effects with objectnat
+    Get method for retrieving effects with objectnat. Stored result is sent compressed as is if client accepts its
+    encoding
     Params:
 
     project ID: Project ID
     scenario ID: Scenario ID
+    X-Profile-Token header: Profiling token, request is profiled and profile is available by its X-Request-ID
+    X-Profile-Memory header: Whether memory allocations of profiled request are traced
     """
 
+    if x_profile_token is not None:
+        profile_store.check_token(x_profile_token)
+        result = await effects_service.profile_effects(params, request.state.request_id, x_profile_memory)
+        return EffectsSchema(**result)
+    accept_encoding = request.headers.get("accept-encoding")
+    encoding = response_codecs.negotiate(accept_encoding, preferred=result_snapshots.encoding)
+    if encoding == result_snapshots.encoding and (body := await effects_service.get_effects_snapshot(params)):
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+        )
     result = await effects_service.calculate_effects(params)
     return EffectsSchema(**result)
+
+
+@effects_router.get("/evaluate_provision/stream", response_class=StreamingResponse)
+async def stream_effects(
+        params: Annotated[EffectsDTO, Depends(EffectsDTO)],
+) -> StreamingResponse:
+    """
+    Get method for retrieving effects with objectnat as server-sent events stream. Stages progress and pivot are
+    sent as soon as they are available, result layers are sent one by one as they are serialized
+    Params:
+
+    project ID: Project ID
+    scenario ID: Scenario ID
+    """
+
+    return StreamingResponse(
+        effects_service.stream_effects(params),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@effects_router.post("/capacity_sweep", response_model=CapacitySweepSchema)
+async def sweep_capacities(
+        params: CapacitySweepDTO,
+) -> CapacitySweepSchema:
+    """
+    Post method for retrieving effects pivot for target scenario services capacities variants
+    Params:
+
+    project ID: Project ID
+    scenario ID: Scenario ID
+    variants: Capacities of target scenario services by service id for each variant
+    """
+
+    result = await effects_service.sweep_capacities(params)
+    return CapacitySweepSchema(**result)
+
+
+@effects_router.get("/demand_uncertainty", response_model=DemandUncertaintySchema)
+async def estimate_demand_uncertainty(
+        params: Annotated[DemandUncertaintyDTO, Depends(DemandUncertaintyDTO)],
+) -> DemandUncertaintySchema:
+    """
+    Get method for retrieving effects confidence intervals over random demand realizations
+    Params:
+
+    project ID: Project ID
+    scenario ID: Scenario ID
+    realizations: Number of random demand realizations
+    confidence: Confidence level of intervals
+    """
+
+    result = await effects_service.estimate_demand_uncertainty(params)
+    return DemandUncertaintySchema(**result)
+
+
+@effects_router.post("/placement", response_model=PlacementSchema)
+async def optimize_placement(
+        params: PlacementDTO,
+) -> PlacementSchema:
+    """
+    Post method for ranking candidate locations of new service by marginal provision gain over target scenario.
+    Candidate gain is provision recalculated for unsupplied buildings within its reach and services competing for them
+    Params:
+
+    project ID: Project ID
+    scenario ID: Scenario ID
+    capacity: Capacity of new service
+    candidates: Candidate locations, defaults to grid over project territory
+    """
+
+    result = await effects_service.optimize_placement(params)
+    return PlacementSchema(**result)
+
+
+@effects_router.get("/tiles/{z}/{x}/{y}.mvt", response_class=Response)
+async def get_effects_tile(
+        z: int,
+        x: int,
+        y: int,
+        params: Annotated[EffectsDTO, Depends(EffectsDTO)],
+        layers: Annotated[list[str] | None, Query()] = None,
+) -> Response:
+    """
+    Get method for retrieving Mapbox Vector Tile of effects and provision layers. Tiles are built from stored
+    calculation result, effects are calculated only if there is no result
+    Params:
+
+    z, x, y: Tile zoom, column and row
+    project ID: Project ID
+    scenario ID: Scenario ID
+    layers: Layers to include from effects, before_buildings, before_services, after_buildings, after_services
+    """
+
+    tile = await effects_service.get_effects_tile(params, z, x, y, layers)
+    return Response(
+        content=tile,
+        media_type="application/vnd.mapbox-vector-tile",
+        headers={"Cache-Control": "private, max-age=300"},
+    )
+
+
+@effects_router.post("/jobs", response_model=JobSchema, status_code=202)
+async def submit_effects_job(
+        params: EffectsDTO,
+) -> JobSchema:
+    """
+    Post method for submitting effects calculation job. Identical in-flight job is returned if it exists
+    Params:
+
+    project ID: Project ID
+    scenario ID: Scenario ID
+    """
+
+    job = effects_service.submit_effects_job(params)
+    return JobSchema(**job.as_dict())
+
+
+@effects_router.get("/jobs/{job_id}", response_model=JobSchema)
+async def get_effects_job(
+        job_id: str,
+) -> JobSchema:
+    """
+    Get method for retrieving effects calculation job status with stage-level progress
+    Params:
+
+    job ID: Job ID
+    """
+
+    job = effects_service.get_effects_job(job_id)
+    return JobSchema(**job.as_dict())
+
+
+@effects_router.get("/jobs/{job_id}/result", response_model=EffectsSchema)
+async def get_effects_job_result(
+        job_id: str,
+) -> EffectsSchema:
+    """
+    Get method for retrieving finished effects calculation job result
+    Params:
+
+    job ID: Job ID
+    """
+
+    result = effects_service.get_effects_job_result(job_id)
+    return EffectsSchema(**result)
+
+
+@effects_router.delete("/jobs/{job_id}", response_model=JobSchema)
+async def cancel_effects_job(
+        job_id: str,
+) -> JobSchema:
+    """
+    Delete method for cancelling effects calculation job
+    Params:
+
+    job ID: Job ID
+    """
+
+    job = effects_service.cancel_effects_job(job_id)
+    return JobSchema(**job.as_dict())
+
+
+@effects_router.delete("/cache/{project_id}", response_model=dict[str, int])
+async def invalidate_project_cache(
+        project_id: int,
+) -> dict[str, int]:
+    """
+    Delete method for invalidating all cached data of project
+    Params:
+
+    project ID: Project ID
+    """
+
+    return effects_service.invalidate_project_cache(project_id)
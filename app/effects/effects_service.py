@@ -1,17 +1,36 @@
 import json
+import time
 import asyncio
+from typing import AsyncIterator, Callable
 
+import numpy as np
 import geopandas as gpd
 import pandas as pd
+import shapely
+from fastapi import HTTPException
 from loguru import logger
 
-from app.dependencies import http_exception
-from .dto.effects_dto import EffectsDTO
+from app.dependencies import http_exception, effects_job_queue, profile_store, urban_api_handler
+from app.common.deadline.deadline import request_deadline
+from app.common.logs.stage_timer import StageTimer
+from app.common.profiling.request_profiler import request_profiler
+from app.common.job_queue.job_queue import Job
+from app.common.single_flight.single_flight import SingleFlight
+from .dto.effects_dto import EffectsDTO, CapacitySweepDTO, DemandUncertaintyDTO, PlacementDTO
+from .shemas.effects_base_schema import EffectsSchema
 from .modules import (
     effects_api_gateway,
     data_restorator,
     attribute_parser,
-    matrix_builder, objectnat_calculator
+    matrix_builder, objectnat_calculator,
+    project_geometry_service,
+    layer_composer,
+    tile_builder,
+    capacity_sweeper,
+    demand_uncertainty_estimator,
+    placement_optimizer,
+    provision_solver,
+    result_snapshots,
 )
 
 
@@ -20,6 +39,125 @@ class EffectsService:
     Class for handling services calculation
     """
 
+    stages = (
+        "project_data",
+        "context",
+        "target_scenario",
+        "base_scenario",
+        "layers",
+        "matrices",
+        "provision",
+        "effects",
+        "serialization",
+    )
+
+    def __init__(self) -> None:
+        """Initialisation function
+
+        Returns:
+            None
+        """
+
+        self._effects_flight = SingleFlight("effects_calculation")
+        self._stage_listeners: dict[str, list[Callable[[str], None]]] = {}
+        self._progress_listeners: dict[str, list[Callable[[str, dict], None]]] = {}
+
+    @staticmethod
+    def _report_stage(
+            on_stage: Callable[[str], None] | None,
+            stage: str,
+    ) -> None:
+        """
+        Function checks request deadline before pipeline stage and reports started stage to callback if it is
+        provided
+        Args:
+            on_stage (Callable[[str], None] | None): callback to report stage to
+            stage (str): started stage name
+        Returns:
+            None
+        Raises:
+            504, http exception request deadline exceeded
+        """
+
+        request_deadline.check(stage)
+        if on_stage:
+            on_stage(stage)
+
+    @staticmethod
+    def _report_progress(
+            on_progress: Callable[[str, dict], None] | None,
+            event: str,
+            get_data: Callable[[], dict],
+    ) -> None:
+        """
+        Function reports pipeline progress event to callback if it is provided. Event data is collected only if
+        there is callback to report to
+        Args:
+            on_progress (Callable[[str, dict], None] | None): callback to report event to
+            event (str): event name
+            get_data (Callable[[], dict]): function collecting event data
+        Returns:
+            None
+        """
+
+        if on_progress:
+            on_progress(event, get_data())
+
+    @staticmethod
+    def _serialize_layer(
+            layer: gpd.GeoDataFrame,
+    ) -> dict:
+        """
+        Function serializes layer to feature collection in EPSG:4326
+        Args:
+            layer (gpd.GeoDataFrame): result layer
+        Returns:
+            dict: feature collection
+        """
+
+        return json.loads(layer.to_crs(4326).to_json())
+
+    @staticmethod
+    def _get_demands_summary(
+            name: str,
+            buildings: gpd.GeoDataFrame,
+    ) -> dict[str, int | str]:
+        """
+        Function summarizes restored buildings layer for progress event
+        Args:
+            name (str): layer name
+            buildings (gpd.GeoDataFrame): buildings with restored population and demands
+        Returns:
+            dict[str, int | str]: layer name, number of buildings, total population and total demand
+        """
+
+        return {
+            "layer": name,
+            "buildings": len(buildings),
+            "population": int(buildings["population"].sum()) if "population" in buildings else 0,
+            "demand": int(buildings["demand"].sum()) if "demand" in buildings else 0,
+        }
+
+    @staticmethod
+    def _get_matrix_summary(
+            name: str,
+            matrix: pd.DataFrame,
+    ) -> dict[str, int | str | list[int]]:
+        """
+        Function summarizes availability matrix for progress event
+        Args:
+            name (str): layer name
+            matrix (pd.DataFrame): availability matrix with nan for unreachable pairs
+        Returns:
+            dict[str, int | str | list[int]]: layer name, matrix shape and number of reachable pairs
+        """
+
+        return {
+            "layer": name,
+            "shape": list(matrix.shape),
+            "nnz": int(np.count_nonzero(~np.isnan(matrix.to_numpy()))),
+        }
+
     @staticmethod
     async def _get_pivot(
             effects: pd.DataFrame | gpd.GeoDataFrame,
@@ -61,23 +199,127 @@ class EffectsService:
         result["median_index_scenario_project"] = int(effects[effects["is_project"]]["index_scenario_project"].median())
         return result
 
-    # ToDo Split function
-    # ToDo Rewrite to context ids normal handling
     async def calculate_effects(
             self,
-            effects_params: EffectsDTO
+            effects_params: EffectsDTO,
+            on_stage: Callable[[str], None] | None = None,
+            use_snapshots: bool = True,
+            on_progress: Callable[[str, dict], None] | None = None,
     ) -> dict[str, dict]:
         """
-        Calculate provision effects by project data and target scenario
+        Calculate provision effects by project data and target scenario. Concurrent identical requests share
+        one calculation, stored result snapshot is returned without calculation if it exists
         Args:
             effects_params (EffectsDTO): Project data
+            on_stage (Callable[[str], None] | None): callback called with stage name each time new stage starts
+            use_snapshots (bool): whether stored result snapshot can be returned, defaults to True
+            on_progress (Callable[[str, dict], None] | None): callback called with event name and data each time
+            pipeline progresses within stage
         Returns:
-             gpd.GeoDataFrame: Provision effects
+             dict[str, dict]: Provision effects
         """
 
-        logger.info(
-            f"Started calculating effects for {effects_params.scenario_id} and service{effects_params.service_type_id}"
+        key = effects_params.model_dump_json()
+        if use_snapshots and result_snapshots.enabled:
+            if result := await asyncio.to_thread(result_snapshots.get, key, effects_params.project_id):
+                return result
+        callbacks = ((self._stage_listeners, on_stage), (self._progress_listeners, on_progress))
+        for listeners, callback in callbacks:
+            if callback:
+                listeners.setdefault(key, []).append(callback)
+        try:
+            return await self._effects_flight.do(
+                key,
+                lambda: self._calculate_effects(
+                    effects_params=effects_params,
+                    on_stage=lambda stage: [listener(stage) for listener in self._stage_listeners.get(key, [])],
+                    on_progress=lambda event, data: [
+                        listener(event, data) for listener in self._progress_listeners.get(key, [])
+                    ],
+                )
+            )
+        finally:
+            for listeners, callback in callbacks:
+                if callback:
+                    listeners[key].remove(callback)
+                    if not listeners[key]:
+                        del listeners[key]
+
+    async def profile_effects(
+            self,
+            effects_params: EffectsDTO,
+            request_id: str,
+            trace_memory: bool = False,
+    ) -> dict[str, dict]:
+        """
+        Function calculates effects under profiler and stores profile by request id. Result snapshot is not used, so
+        profile covers full calculation. Calculation joined to in-flight identical one is not sampled in threads
+        Args:
+            effects_params (EffectsDTO): Project data
+            request_id (str): profiled request id
+            trace_memory (bool): whether memory allocations are traced, defaults to False
+        Returns:
+            dict[str, dict]: Provision effects
+        Raises:
+            409, http exception another request is being profiled
+        """
+
+        session = None
+        try:
+            with request_profiler.profile(request_id, trace_memory=trace_memory) as session:
+                return await self.calculate_effects(effects_params, use_snapshots=False)
+        finally:
+            if session:
+                await asyncio.to_thread(profile_store.save, session)
+                logger.info(
+                    f"Profile of effects for {effects_params.scenario_id} and service type "
+                    f"{effects_params.service_type_id} is stored, {session.samples} samples in "
+                    f"{session.duration:.2f} s"
+                )
+
+    @staticmethod
+    async def get_effects_snapshot(
+            effects_params: EffectsDTO,
+    ) -> bytes | None:
+        """
+        Function returns stored result snapshot as compressed response body, so it is sent without serialization
+        and compression
+        Args:
+            effects_params (EffectsDTO): Project data
+        Returns:
+            bytes | None: response body compressed with result_snapshots.encoding, None if there is no snapshot
+        """
+
+        if not result_snapshots.enabled:
+            return None
+        return await asyncio.to_thread(
+            result_snapshots.get_compressed,
+            effects_params.model_dump_json(),
+            effects_params.project_id,
         )
+
+    # ToDo Rewrite to context ids normal handling
+    async def _prepare_layers(
+            self,
+            effects_params: EffectsDTO,
+            on_stage: Callable[[str], None] | None = None,
+            on_progress: Callable[[str, dict], None] | None = None,
+    ) -> dict:
+        """
+        Function retrieves project data, restores demands, composes before and after layers and calculates their
+        availability matrices
+        Args:
+            effects_params (EffectsDTO): Project data
+            on_stage (Callable[[str], None] | None): callback called with stage name each time new stage starts
+            on_progress (Callable[[str, dict], None] | None): callback called with fetched layers sizes, restored
+            demands and matrices sizes
+        Returns:
+             dict: "normative_data", restored "context_buildings", "target_scenario_buildings" and
+             "base_scenario_buildings", composed "before_buildings", "before_services", "before_matrix",
+             "after_buildings", "after_services" and "after_matrix"
+        """
+
+        self._report_stage(on_stage, "project_data")
         project_data = await effects_api_gateway.get_project_data(
             effects_params.project_id
         )
@@ -90,14 +332,28 @@ class EffectsService:
         context_population = await effects_api_gateway.get_context_population(
             territory_ids_list=project_data["properties"]["context"]
         )
+        self._report_stage(on_stage, "context")
         context_buildings = await effects_api_gateway.get_project_context_buildings(
             project_id=effects_params.project_id,
         )
-        context_buildings.drop(index=context_buildings.sjoin(project_territory).index, inplace=True)
+        self._report_progress(
+            on_progress, "layer_fetched", lambda: {"layer": "context_buildings", "size": len(context_buildings)}
+        )
         context_buildings = await attribute_parser.parse_all_from_buildings(
             living_buildings=context_buildings,
         )
-        context_buildings = await asyncio.to_thread(
+        excluded_building_ids = await request_deadline.to_thread(
+            project_geometry_service.get_excluded_building_ids,
+            project_id=effects_params.project_id,
+            project_territory=project_territory,
+            context_buildings=context_buildings,
+        )
+        if not context_buildings.empty:
+            context_buildings.drop(
+                index=context_buildings.index[context_buildings["building_id"].isin(excluded_building_ids)],
+                inplace=True,
+            )
+        context_buildings = await request_deadline.to_thread(
             data_restorator.restore_demands,
             buildings=context_buildings,
             service_normative=normative_data["services_capacity_per_1000_normative"],
@@ -105,10 +361,16 @@ class EffectsService:
             target_population=context_population,
         )
         context_buildings["is_project"] = False
+        self._report_progress(
+            on_progress, "demands_restored", lambda: self._get_demands_summary("context_buildings", context_buildings)
+        )
         context_services = await effects_api_gateway.get_project_context_services(
             project_id=effects_params.project_id,
             service_type_id=effects_params.service_type_id,
         )
+        self._report_progress(
+            on_progress, "layer_fetched", lambda: {"layer": "context_services", "size": len(context_services)}
+        )
         if context_services.empty:
             raise http_exception(
                 status_code=404,
@@ -119,16 +381,22 @@ class EffectsService:
         context_services = await attribute_parser.parse_all_from_services(
             services=context_services,
         )
+        self._report_stage(on_stage, "target_scenario")
         target_scenario_population = await effects_api_gateway.get_scenario_population_data(
             scenario_id=effects_params.scenario_id,
         )
         target_scenario_buildings = await effects_api_gateway.get_scenario_buildings(
             scenario_id=effects_params.scenario_id
         )
+        self._report_progress(
+            on_progress,
+            "layer_fetched",
+            lambda: {"layer": "target_scenario_buildings", "size": len(target_scenario_buildings)},
+        )
         target_scenario_buildings = await attribute_parser.parse_all_from_buildings(
             living_buildings=target_scenario_buildings,
         )
-        target_scenario_buildings = await asyncio.to_thread(
+        target_scenario_buildings = await request_deadline.to_thread(
             data_restorator.restore_demands,
             buildings=target_scenario_buildings,
             service_normative=normative_data["services_capacity_per_1000_normative"],
@@ -136,97 +404,161 @@ class EffectsService:
             target_population=target_scenario_population,
         )
         target_scenario_buildings["is_project"] = True
+        self._report_progress(
+            on_progress,
+            "demands_restored",
+            lambda: self._get_demands_summary("target_scenario_buildings", target_scenario_buildings),
+        )
         target_scenario_services = await effects_api_gateway.get_scenario_services(
             scenario_id=effects_params.scenario_id,
             service_type_id=effects_params.service_type_id,
         )
+        self._report_progress(
+            on_progress,
+            "layer_fetched",
+            lambda: {"layer": "target_scenario_services", "size": len(target_scenario_services)},
+        )
         target_scenario_services = await attribute_parser.parse_all_from_services(
             services=target_scenario_services,
         )
+        self._report_stage(on_stage, "base_scenario")
         base_scenario_buildings = await effects_api_gateway.get_scenario_buildings(
             scenario_id=project_data["base_scenario"]["id"]
         )
+        self._report_progress(
+            on_progress,
+            "layer_fetched",
+            lambda: {"layer": "base_scenario_buildings", "size": len(base_scenario_buildings)},
+        )
         base_scenario_buildings = await attribute_parser.parse_all_from_buildings(
             living_buildings=base_scenario_buildings,
         )
-        base_scenario_buildings = await asyncio.to_thread(
+        base_scenario_buildings = await request_deadline.to_thread(
             data_restorator.restore_demands,
             buildings=base_scenario_buildings,
             service_normative=normative_data["services_capacity_per_1000_normative"],
             service_normative_type=normative_data["capacity_type"],
         )
         base_scenario_buildings["is_project"] = True
+        self._report_progress(
+            on_progress,
+            "demands_restored",
+            lambda: self._get_demands_summary("base_scenario_buildings", base_scenario_buildings),
+        )
         base_scenario_services = await effects_api_gateway.get_scenario_services(
             scenario_id=project_data["base_scenario"]["id"],
             service_type_id=effects_params.service_type_id,
         )
+        self._report_progress(
+            on_progress,
+            "layer_fetched",
+            lambda: {"layer": "base_scenario_services", "size": len(base_scenario_services)},
+        )
         base_scenario_services = await attribute_parser.parse_all_from_services(
             services=base_scenario_services,
         )
-        after_buildings = await asyncio.to_thread(
-            pd.concat,
-            objs=[context_buildings, target_scenario_buildings]
-        )
-        after_services = await asyncio.to_thread(
-            pd.concat,
-            objs=[context_services, target_scenario_services]
-        )
-        before_buildings = await  asyncio.to_thread(
-            pd.concat,
-            objs=[context_buildings, base_scenario_buildings],
-        )
-        before_services = await asyncio.to_thread(
-            pd.concat,
-            objs=[context_services, base_scenario_services]
-        )
-        after_buildings.sort_values("is_project", ascending=False, inplace=True)
-        after_buildings.drop_duplicates("building_id", keep="first", inplace=True)
-        after_buildings.set_index("building_id", inplace=True)
-        after_services.set_index("service_id", inplace=True)
-        before_buildings.sort_values("is_project", ascending=False, inplace=True)
-        before_buildings.drop_duplicates("building_id", keep="first", inplace=True)
-        before_buildings.set_index("building_id", inplace=True)
-        before_services.set_index("service_id", inplace=True)
-        before_services.drop_duplicates("geometry", inplace=True)
+        self._report_stage(on_stage, "layers")
         if target_scenario_buildings.empty:
             local_crs = context_buildings.estimate_utm_crs()
         else:
             local_crs = target_scenario_buildings.estimate_utm_crs()
-        before_buildings.to_crs(local_crs, inplace=True)
-        before_services.to_crs(local_crs, inplace=True)
-        after_buildings.to_crs(local_crs, inplace=True)
-        after_services.to_crs(local_crs, inplace=True)
+        before_buildings, after_buildings = await request_deadline.to_thread(
+            layer_composer.compose_buildings,
+            context_buildings=context_buildings,
+            target_scenario_buildings=target_scenario_buildings,
+            base_scenario_buildings=base_scenario_buildings,
+            local_crs=local_crs,
+        )
         #ToDo context - project objects relation should be revised
-        after_services.drop_duplicates("geometry", inplace=True)
-        before_matrix = await asyncio.to_thread(
+        before_services, after_services = await request_deadline.to_thread(
+            layer_composer.compose_services,
+            context_services=context_services,
+            target_scenario_services=target_scenario_services,
+            base_scenario_services=base_scenario_services,
+            local_crs=local_crs,
+        )
+        self._report_stage(on_stage, "matrices")
+        before_matrix = await request_deadline.to_thread(
             matrix_builder.calculate_availability_matrix,
             buildings=before_buildings,
             services=before_services,
             normative_value=normative_data["normative_value"],
             normative_type=normative_data["normative_type"],
         )
-        after_matrix = await asyncio.to_thread(
+        self._report_progress(on_progress, "matrix_built", lambda: self._get_matrix_summary("before", before_matrix))
+        after_matrix = await request_deadline.to_thread(
             matrix_builder.calculate_availability_matrix,
             buildings=after_buildings,
             services=after_services,
             normative_value=normative_data["normative_value"],
             normative_type=normative_data["normative_type"],
         )
-        before_prove_data = await asyncio.to_thread(
+        self._report_progress(on_progress, "matrix_built", lambda: self._get_matrix_summary("after", after_matrix))
+        return {
+            "normative_data": normative_data,
+            "context_buildings": context_buildings,
+            "target_scenario_buildings": target_scenario_buildings,
+            "base_scenario_buildings": base_scenario_buildings,
+            "before_buildings": before_buildings,
+            "before_services": before_services,
+            "before_matrix": before_matrix,
+            "after_buildings": after_buildings,
+            "after_services": after_services,
+            "after_matrix": after_matrix,
+        }
+
+    async def _calculate_effects(
+            self,
+            effects_params: EffectsDTO,
+            on_stage: Callable[[str], None] | None = None,
+            on_progress: Callable[[str, dict], None] | None = None,
+    ) -> dict[str, dict]:
+        """
+        Calculate provision effects by project data and target scenario. Pivot is reported to progress callback as
+        soon as effects are estimated, result layers are reported one by one as they are serialized
+        Args:
+            effects_params (EffectsDTO): Project data
+            on_stage (Callable[[str], None] | None): callback called with stage name each time new stage starts
+            on_progress (Callable[[str, dict], None] | None): callback called with event name and data each time
+            pipeline progresses within stage
+        Returns:
+             dict[str, dict]: Provision effects
+        """
+
+        logger.info(
+            f"Started calculating effects for {effects_params.scenario_id} and service{effects_params.service_type_id}"
+        )
+        on_stage = StageTimer(on_stage)
+        layers = await self._prepare_layers(effects_params, on_stage, on_progress)
+        self._report_stage(on_stage, "provision")
+        before_prove_data = await request_deadline.to_thread(
             objectnat_calculator.evaluate_provision,
-            buildings=before_buildings,
-            services=before_services,
-            matrix=before_matrix,
-            service_normative=normative_data["normative_value"],
+            buildings=layers["before_buildings"],
+            services=layers["before_services"],
+            matrix=layers["before_matrix"],
+            service_normative=layers["normative_data"]["normative_value"],
         )
-        after_prove_data = await asyncio.to_thread(
+        after_prove_data = await request_deadline.to_thread(
             objectnat_calculator.evaluate_provision,
-            buildings=after_buildings,
-            services=after_services,
-            matrix=after_matrix,
-            service_normative=normative_data["normative_value"],
+            buildings=layers["after_buildings"],
+            services=layers["after_services"],
+            matrix=layers["after_matrix"],
+            service_normative=layers["normative_data"]["normative_value"],
         )
-        effects = await asyncio.to_thread(
+        for name, prove_data in (("before", before_prove_data), ("after", after_prove_data)):
+            self._report_progress(
+                on_progress,
+                "provision_evaluated",
+                lambda: {
+                    "layer": name,
+                    "demand": int(prove_data["buildings"]["demand"].sum()),
+                    "supplied_within": int(prove_data["buildings"]["supplyed_demands_within"].sum()),
+                    "supplied_without": int(prove_data["buildings"]["supplyed_demands_without"].sum()),
+                    "links": len(prove_data["links"]),
+                },
+            )
+        self._report_stage(on_stage, "effects")
+        effects = await request_deadline.to_thread(
             objectnat_calculator.estimate_effects,
             provision_before=before_prove_data["buildings"],
             provision_after=after_prove_data["buildings"],
@@ -235,28 +567,590 @@ class EffectsService:
             f"Calculated effects for {effects_params.scenario_id} and service type {effects_params.service_type_id}"
         )
         pivot = await self._get_pivot(effects)
+        self._report_progress(on_progress, "pivot", lambda: pivot)
+        delta_summary = None
+        if effects_params.delta_only:
+            delta = await request_deadline.to_thread(
+                objectnat_calculator.get_delta,
+                provision_before=before_prove_data,
+                provision_after=after_prove_data,
+                effects=effects,
+            )
+            before_prove_data = delta["before_prove_data"]
+            after_prove_data = delta["after_prove_data"]
+            effects = delta["effects"]
+            delta_summary = delta["summary"]
+            self._report_progress(on_progress, "delta_summary", lambda: delta_summary)
+        tile_builder.set_result(
+            key=effects_params.model_dump_json(),
+            project_id=effects_params.project_id,
+            layers={
+                "effects": effects,
+                "before_buildings": before_prove_data["buildings"],
+                "before_services": before_prove_data["services"],
+                "after_buildings": after_prove_data["buildings"],
+                "after_services": after_prove_data["services"],
+            },
+        )
 
+        self._report_stage(on_stage, "serialization")
+        layers = {
+            "before_buildings": before_prove_data["buildings"],
+            "before_services": before_prove_data["services"],
+            "before_links": before_prove_data["links"],
+            "after_buildings": after_prove_data["buildings"],
+            "after_services": after_prove_data["services"],
+            "after_links": after_prove_data["links"],
+            "effects": effects,
+        }
+        serialized = {}
+        for index, (name, layer) in enumerate(layers.items()):
+            serialized[name] = await request_deadline.to_thread(self._serialize_layer, layer)
+            self._report_progress(
+                on_progress,
+                "layer_serialized",
+                lambda: {"name": name, "index": index, "total": len(layers), "layer": serialized[name]},
+            )
         result = {
             "before_prove_data": {
-                "buildings": json.loads(
-                    before_prove_data["buildings"].to_crs(4326).to_json()
-                ),
-                "services": json.loads(
-                    before_prove_data["services"].to_crs(4326).to_json()
-                ),
-                "links": json.loads(before_prove_data["links"].to_crs(4326).to_json()),
+                "buildings": serialized["before_buildings"],
+                "services": serialized["before_services"],
+                "links": serialized["before_links"],
             },
             "after_prove_data": {
-                "buildings": json.loads(
-                    after_prove_data["buildings"].to_crs(4326).to_json()
-                ),
-                "services": json.loads(after_prove_data["services"].to_crs(4326).to_json()),
-                "links": json.loads(after_prove_data["links"].to_crs(4326).to_json()),
+                "buildings": serialized["after_buildings"],
+                "services": serialized["after_services"],
+                "links": serialized["after_links"],
             },
-            "effects": json.loads(effects.to_crs(4326).to_json()),
+            "effects": serialized["effects"],
             "pivot": pivot,
+            "delta_summary": delta_summary,
         }
+        duration = on_stage.finish()
+        logger.bind(duration=duration, stages=on_stage.durations).info(
+            f"Effects for {effects_params.scenario_id} and service type {effects_params.service_type_id} are "
+            f"ready in {duration:.2f} s"
+        )
         return result
 
+    async def sweep_capacities(
+            self,
+            sweep_params: CapacitySweepDTO,
+    ) -> dict:
+        """
+        Function estimates effects pivot for each target scenario services capacities variant. Data, demands and
+        matrices are prepared once and provision before is shared by all variants
+        Args:
+            sweep_params (CapacitySweepDTO): Project data with capacities variants
+        Returns:
+            dict: "pivot" of scenario without overrides and "variants" with capacities and pivot
+        Raises:
+            400, http exception variant contains services missing in target scenario
+        """
+
+        logger.info(
+            f"Started capacity sweep of {len(sweep_params.variants)} variants for {sweep_params.scenario_id} and "
+            f"service type {sweep_params.service_type_id}"
+        )
+        layers = await self._prepare_layers(sweep_params)
+        after_services = layers["after_services"]
+        missing_ids = {
+            service_id for variant in sweep_params.variants for service_id in variant
+        }.difference(after_services.index)
+        if missing_ids:
+            raise http_exception(
+                status_code=400,
+                msg="Variants contain services missing in scenario",
+                _input={"variants": sweep_params.variants},
+                _detail={"missing_service_ids": sorted(missing_ids)},
+            )
+        before_prove_data = await request_deadline.to_thread(
+            objectnat_calculator.evaluate_provision,
+            buildings=layers["before_buildings"],
+            services=layers["before_services"],
+            matrix=layers["before_matrix"],
+            service_normative=layers["normative_data"]["normative_value"],
+        )
+        variants_effects = await request_deadline.to_thread(
+            capacity_sweeper.estimate_variants,
+            provision_before=before_prove_data["buildings"],
+            buildings=layers["after_buildings"],
+            services=after_services,
+            matrix=layers["after_matrix"],
+            service_normative=layers["normative_data"]["normative_value"],
+            variants=[{}, *sweep_params.variants],
+        )
+        logger.info(
+            f"Finished capacity sweep for {sweep_params.scenario_id} and service type {sweep_params.service_type_id}"
+        )
+        return {
+            "pivot": await self._get_pivot(variants_effects[0]),
+            "variants": [
+                {
+                    "capacities": variant,
+                    "pivot": await self._get_pivot(effects),
+                }
+                for variant, effects in zip(sweep_params.variants, variants_effects[1:])
+            ],
+        }
+
+    async def estimate_demand_uncertainty(
+            self,
+            uncertainty_params: DemandUncertaintyDTO,
+    ) -> dict:
+        """
+        Function estimates effects confidence intervals over random demand realizations. Data, population and
+        matrices are prepared once, demands realizations are generated for all realizations together
+        Args:
+            uncertainty_params (DemandUncertaintyDTO): Project data with realizations number and confidence level
+        Returns:
+            dict: "realizations", "confidence", "pivot" intervals by pivot field and "effects" layer with buildings
+            effects intervals
+        """
+
+        logger.info(
+            f"Started {uncertainty_params.realizations} demand realizations for {uncertainty_params.scenario_id} and "
+            f"service type {uncertainty_params.service_type_id}"
+        )
+        layers = await self._prepare_layers(uncertainty_params)
+        realizations_effects = await request_deadline.to_thread(
+            demand_uncertainty_estimator.estimate_realizations,
+            layers=layers,
+            realizations=uncertainty_params.realizations,
+            seed=uncertainty_params.seed,
+        )
+        pivots = [await self._get_pivot(effects) for effects in realizations_effects]
+        pivot = {}
+        for field in pivots[0]:
+            intervals = demand_uncertainty_estimator.get_intervals(
+                np.array([realization_pivot[field] for realization_pivot in pivots], dtype=float),
+                uncertainty_params.confidence,
+            )
+            pivot[field] = {name: float(value) for name, value in intervals.items()}
+        effects = realizations_effects[0][["geometry", "is_project"]].copy()
+        for column in ("absolute_total", "absolute_within", "index_total", "demand"):
+            intervals = demand_uncertainty_estimator.get_intervals(
+                np.stack([realization[column].to_numpy(dtype=float) for realization in realizations_effects]),
+                uncertainty_params.confidence,
+            )
+            for name, values in intervals.items():
+                effects[f"{column}_{name}"] = values
+        logger.info(
+            f"Finished demand realizations for {uncertainty_params.scenario_id} and service type "
+            f"{uncertainty_params.service_type_id}"
+        )
+        return {
+            "realizations": uncertainty_params.realizations,
+            "confidence": uncertainty_params.confidence,
+            "pivot": pivot,
+            "effects": json.loads(effects.to_crs(4326).to_json()),
+        }
+
+    async def _get_placement_state(
+            self,
+            placement_params: PlacementDTO,
+    ) -> dict:
+        """
+        Function returns cached scenario provision state for placement or calculates it
+        Args:
+            placement_params (PlacementDTO): Project data
+        Returns:
+            dict: scenario provision state
+        """
+
+        key = placement_params.model_dump_json(
+            include={"project_id", "scenario_id", "service_type_id", "year", "target_population"}
+        )
+        if state := placement_optimizer.get_state(key):
+            return state
+        layers = await self._prepare_layers(placement_params)
+        threshold = objectnat_calculator.get_provision_threshold(layers["normative_data"]["normative_value"])
+        matrix = layers["after_matrix"].to_numpy()
+        capacity = layers["after_services"]["capacity"].to_numpy()
+        destination = await request_deadline.to_thread(
+            provision_solver.distribute,
+            distances=provision_solver.prepare_matrix(matrix, threshold),
+            demand=layers["after_buildings"]["demand"].to_numpy(),
+            capacity=capacity,
+            threshold=threshold,
+        )
+        return placement_optimizer.set_state(
+            key=key,
+            project_id=placement_params.project_id,
+            buildings=layers["after_buildings"],
+            matrix=matrix,
+            capacity=capacity,
+            destination=destination,
+            max_distance=matrix_builder.get_max_distance(
+                layers["normative_data"]["normative_value"],
+                layers["normative_data"]["normative_type"],
+            ),
+            threshold=threshold,
+        )
+
+    async def optimize_placement(
+            self,
+            placement_params: PlacementDTO,
+    ) -> dict:
+        """
+        Function ranks candidate locations of new service by marginal provision gain over target scenario. Candidates
+        default to grid over project territory
+        Args:
+            placement_params (PlacementDTO): Project data with new service capacity and candidates
+        Returns:
+            dict: "capacity", "candidates_count" and best "candidates" layer
+        Raises:
+            400, http exception no candidates or too many candidates
+        """
+
+        state = await self._get_placement_state(placement_params)
+        if placement_params.candidates:
+            candidates = gpd.GeoSeries(
+                gpd.points_from_xy(*zip(*placement_params.candidates)),
+                crs=4326,
+            ).to_crs(state["crs"])
+            candidates = shapely.get_coordinates(np.asarray(candidates.values))
+        else:
+            project_territory = await effects_api_gateway.get_project_territory(placement_params.project_id)
+            candidates = placement_optimizer.get_grid(project_territory, state["crs"], placement_params.grid_step)
+        if not 0 < len(candidates) <= placement_optimizer.max_candidates:
+            raise http_exception(
+                status_code=400,
+                msg="Number of candidates is out of bounds",
+                _input={"candidates_count": len(candidates), "grid_step": placement_params.grid_step},
+                _detail={"max_candidates": placement_optimizer.max_candidates},
+            )
+        ranked = await request_deadline.to_thread(
+            placement_optimizer.rank,
+            state=state,
+            candidates=candidates,
+            capacity=placement_params.capacity,
+            top=placement_params.top,
+        )
+        return {
+            "capacity": placement_params.capacity,
+            "candidates_count": len(candidates),
+            "candidates": json.loads(ranked.to_crs(4326).to_json()),
+        }
+
+    @staticmethod
+    def _format_event(
+            event: str,
+            data: dict | None,
+    ) -> str:
+        """
+        Function formats server-sent event
+        Args:
+            event (str): event name
+            data (dict | None): json serializable event data
+        Returns:
+            str: server-sent event message
+        """
+
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    async def stream_effects(
+            self,
+            effects_params: EffectsDTO,
+    ) -> AsyncIterator[str]:
+        """
+        Function calculates provision effects and streams its progress as server-sent events: "stage" on each
+        started stage, "layer_fetched", "demands_restored", "matrix_built" and "provision_evaluated" with stage
+        details, "pivot" as soon as effects are estimated, "layer_serialized" with each result layer and "done" or
+        "error" in the end. Layers not streamed during calculation (stored snapshot or calculation joined after its
+        serialization started) are streamed from result
+        Args:
+            effects_params (EffectsDTO): Project data
+        Returns:
+            AsyncIterator[str]: server-sent events messages
+        """
+
+        events: asyncio.Queue[tuple[str, dict]] = asyncio.Queue()
+        calculation = asyncio.create_task(
+            self.calculate_effects(
+                effects_params,
+                on_stage=lambda stage: events.put_nowait(("stage", {"stage": stage})),
+                on_progress=lambda event, data: events.put_nowait((event, data)),
+            )
+        )
+        sent_events = set()
+
+        def format_event(event: str, data: dict) -> str:
+            sent_events.add(data["name"] if event == "layer_serialized" else event)
+            return self._format_event(event, data)
+
+        next_event = None
+        try:
+            while not calculation.done():
+                next_event = asyncio.ensure_future(events.get())
+                await asyncio.wait((next_event, calculation), return_when=asyncio.FIRST_COMPLETED)
+                if next_event.done():
+                    yield format_event(*next_event.result())
+                else:
+                    next_event.cancel()
+            while not events.empty():
+                yield format_event(*events.get_nowait())
+            try:
+                result = calculation.result()
+            except HTTPException as e:
+                yield self._format_event("error", {"status_code": e.status_code, "detail": e.detail})
+                return
+            except Exception as e:
+                logger.exception(f"Effects stream for {effects_params.scenario_id} failed")
+                yield self._format_event("error", {"status_code": 500, "detail": repr(e)})
+                return
+            if "pivot" not in sent_events:
+                yield self._format_event("pivot", result["pivot"])
+            if result["delta_summary"] and "delta_summary" not in sent_events:
+                yield self._format_event("delta_summary", result["delta_summary"])
+            layers = {
+                "before_buildings": result["before_prove_data"]["buildings"],
+                "before_services": result["before_prove_data"]["services"],
+                "before_links": result["before_prove_data"]["links"],
+                "after_buildings": result["after_prove_data"]["buildings"],
+                "after_services": result["after_prove_data"]["services"],
+                "after_links": result["after_prove_data"]["links"],
+                "effects": result["effects"],
+            }
+            for index, (name, layer) in enumerate(layers.items()):
+                if name not in sent_events:
+                    yield self._format_event(
+                        "layer_serialized", {"name": name, "index": index, "total": len(layers), "layer": layer}
+                    )
+            yield self._format_event("done", {})
+        finally:
+            if next_event and not next_event.done():
+                next_event.cancel()
+            if not calculation.done():
+                calculation.cancel()
+
+    async def get_effects_tile(
+            self,
+            effects_params: EffectsDTO,
+            z: int,
+            x: int,
+            y: int,
+            layers: list[str] | None = None,
+    ) -> bytes:
+        """
+        Function returns Mapbox Vector Tile of effects calculation result layers. Effects are calculated only if
+        result is not stored for tiling
+        Args:
+            effects_params (EffectsDTO): Project data
+            z (int): zoom
+            x (int): tile column
+            y (int): tile row from the top
+            layers (list[str] | None): names of layers to include, defaults to None (all result layers)
+        Returns:
+            bytes: Mapbox Vector Tile, empty if tile has no features
+        Raises:
+            400, http exception tile is out of zoom bounds
+        """
+
+        if not 0 <= z <= 24 or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+            raise http_exception(
+                status_code=400,
+                msg="Tile is out of bounds",
+                _input={"z": z, "x": x, "y": y},
+                _detail={"max_zoom": 24},
+            )
+        key = effects_params.model_dump_json()
+        tile = await asyncio.to_thread(tile_builder.get_tile, key, z, x, y, layers)
+        if tile is None:
+            await self.calculate_effects(effects_params, use_snapshots=False)
+            tile = await asyncio.to_thread(tile_builder.get_tile, key, z, x, y, layers)
+        return tile or b""
+
+    @staticmethod
+    def warmup() -> float:
+        """
+        Function runs pipeline stages on tiny synthetic layers, so crs database, transformers, kd-tree and provision
+        code paths are initialised before the first request
+        Returns:
+            float: warmup duration in seconds
+        """
+
+        start = time.perf_counter()
+        rng = np.random.default_rng(0)
+        buildings_points = shapely.points(rng.uniform((30.30, 59.93), (30.31, 59.94), size=(20, 2)))
+        buildings = gpd.GeoDataFrame(
+            {"building_id": np.arange(20), "storeys_count": rng.integers(1, 10, 20).astype(float)},
+            geometry=shapely.buffer(buildings_points, 0.0001, quad_segs=2),
+            crs=4326,
+        )
+        buildings = data_restorator.restore_demands(
+            buildings=buildings,
+            service_normative=100,
+            service_normative_type="capacity",
+            target_population=500,
+        )
+        buildings["is_project"] = np.arange(20) >= 15
+        services = gpd.GeoDataFrame(
+            {"service_id": np.arange(3), "capacity": np.full(3, 20.0)},
+            geometry=shapely.points(rng.uniform((30.30, 59.93), (30.31, 59.94), size=(3, 2))),
+            crs=4326,
+        )
+        local_crs = buildings.estimate_utm_crs()
+        provision = []
+        for layer_buildings, layer_services in zip(
+                layer_composer.compose_buildings(
+                    context_buildings=buildings[~buildings["is_project"]],
+                    target_scenario_buildings=buildings[buildings["is_project"]],
+                    base_scenario_buildings=buildings.iloc[:0],
+                    local_crs=local_crs,
+                ),
+                layer_composer.compose_services(
+                    context_services=services.iloc[:2],
+                    target_scenario_services=services.iloc[2:],
+                    base_scenario_services=services.iloc[:0],
+                    local_crs=local_crs,
+                ),
+        ):
+            matrix = matrix_builder.calculate_availability_matrix(
+                buildings=layer_buildings,
+                services=layer_services,
+                normative_value=10,
+                normative_type="time",
+            )
+            provision.append(
+                objectnat_calculator.evaluate_provision(
+                    buildings=layer_buildings,
+                    services=layer_services,
+                    matrix=matrix,
+                    service_normative=10,
+                )
+            )
+        objectnat_calculator.estimate_effects(
+            provision_before=provision[0]["buildings"],
+            provision_after=provision[1]["buildings"],
+        ).to_crs(4326)
+        if matrix_builder.mode == "network":
+            from .modules.walk_graph import walk_graph_store
+
+            walk_graph_store.warmup()
+        duration = time.perf_counter() - start
+        logger.info(f"Effects pipeline warmed up in {duration:.2f} s")
+        return duration
+
+    def submit_effects_job(
+            self,
+            effects_params: EffectsDTO,
+    ) -> Job:
+        """
+        Function puts effects calculation to job queue. Identical in-flight job is returned if it exists. Job result
+        is json serializable, as it is stored on disk shared by workers
+        Args:
+            effects_params (EffectsDTO): Project data
+        Returns:
+            Job: effects calculation job
+        Raises:
+            503, http exception job queue is full
+        """
+
+        async def calculate(job: Job) -> dict:
+            result = await self.calculate_effects(effects_params, on_stage=job.report_stage)
+            return EffectsSchema(**result).model_dump(mode="json")
+
+        return effects_job_queue.submit(
+            key=effects_params.model_dump_json(),
+            params=effects_params.model_dump(),
+            stages=self.stages,
+            job_func=calculate,
+        )
+
+    @staticmethod
+    def get_effects_job(
+            job_id: str,
+    ) -> Job:
+        """
+        Function retrieves effects calculation job
+        Args:
+            job_id (str): job id
+        Returns:
+            Job: effects calculation job
+        Raises:
+            404, http exception job not found
+        """
+
+        if job := effects_job_queue.get(job_id):
+            return job
+        raise http_exception(
+            status_code=404,
+            msg="Job not found or its result expired",
+            _input={"job_id": job_id},
+            _detail={},
+        )
+
+    def cancel_effects_job(
+            self,
+            job_id: str,
+    ) -> Job:
+        """
+        Function cancels effects calculation job. Remaining pipeline stages of running job are not executed
+        Args:
+            job_id (str): job id
+        Returns:
+            Job: cancelled job
+        Raises:
+            404, http exception job not found
+        """
+
+        self.get_effects_job(job_id)
+        return effects_job_queue.cancel(job_id)
+
+    def get_effects_job_result(
+            self,
+            job_id: str,
+    ) -> dict[str, dict]:
+        """
+        Function retrieves result of finished effects calculation job
+        Args:
+            job_id (str): job id
+        Returns:
+            dict[str, dict]: effects calculation result
+        Raises:
+            404, http exception job not found
+            409, http exception job is not finished or cancelled
+            job error status code, http exception job failed
+        """
+
+        job = self.get_effects_job(job_id)
+        if job.status == "done" and (result := effects_job_queue.get_result(job)) is not None:
+            return result
+        if job.status == "failed":
+            raise http_exception(
+                status_code=job.error["status_code"],
+                msg="Job failed",
+                _input={"job_id": job_id},
+                _detail=job.error["detail"],
+            )
+        raise http_exception(
+            status_code=409,
+            msg="Job result is not available",
+            _input={"job_id": job_id},
+            _detail={"status": job.status, "stage": job.stage},
+        )
+
+
+    @staticmethod
+    def invalidate_project_cache(
+            project_id: int,
+    ) -> dict[str, int]:
+        """
+        Function deletes all cached data of project
+        Args:
+            project_id (int): project id
+        Returns:
+            dict[str, int]: number of deleted entries by cache name
+        """
+
+        return {
+            "urban_api": urban_api_handler.invalidate_project(project_id),
+            "project_geometry": project_geometry_service.invalidate_project(project_id),
+            "tiles": tile_builder.invalidate_project(project_id),
+            "placement": placement_optimizer.invalidate_project(project_id),
+            "snapshots": result_snapshots.invalidate_project(project_id),
+        }
+
 
 effects_service = EffectsService()
@@ -2,4 +2,14 @@ from .attribute_parser import attribute_parser
 from .effects_api_gateway import effects_api_gateway
 from .data_restorator import data_restorator
 from .matrix_builder import matrix_builder
-from .objectnat_calculator import objectnat_calculator
\ No newline at end of file
+from .objectnat_calculator import objectnat_calculator
+from .project_geometry_service import project_geometry_service
+from .layer_composer import layer_composer
+from .population_loader import population_loader
+from .normatives_catalog import normatives_catalog
+from .tile_builder import tile_builder
+from .provision_solver import provision_solver
+from .capacity_sweeper import capacity_sweeper
+from .demand_uncertainty import demand_uncertainty_estimator
+from .placement_optimizer import placement_optimizer
+from .result_snapshots import result_snapshots
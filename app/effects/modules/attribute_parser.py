@@ -5,6 +5,7 @@ import pandas as pd
 import geopandas as gpd
 
 from app.dependencies import http_exception
+from .layer_schema import parsed_buildings_schema, services_schema
 
 
 class AttributeParser:
@@ -17,14 +18,13 @@ class AttributeParser:
             living_buildings: pd.DataFrame | gpd.GeoDataFrame,
     ) -> gpd.GeoDataFrame:
         """
-        Function purses living building area for buildings from nested response
+        Function purses living building area for buildings from nested response. Layer is parsed in place
         Args:
-            living_buildings (gpd.GeoDataFrame): nested response from api as feature collection
+            living_buildings (gpd.GeoDataFrame): nested response from api as feature collection owned by caller
         Returns:
             gpd.GeoDataFrame: living building area with parsed storeys data. Can be empty
         """
 
-        living_buildings = living_buildings.copy()
         if living_buildings.empty:
             return living_buildings
         living_buildings["storeys_count"] = await asyncio.to_thread(
@@ -40,11 +40,12 @@ class AttributeParser:
             living_buildings["physical_objects"].apply,
             lambda x: x[0]["physical_object_id"],
         )
-        living_buildings = living_buildings.drop(
+        living_buildings.drop(
             ['object_geometry_id', 'territory', 'address', 'osm_id', 'physical_objects', 'services'],
             axis=1,
+            inplace=True,
         )
-        return living_buildings
+        return parsed_buildings_schema.apply(living_buildings)
 
     @staticmethod
     def _parse_service_capacity(
@@ -81,13 +82,12 @@ class AttributeParser:
             services: gpd.GeoDataFrame,
     ) -> gpd.GeoDataFrame:
         """
-        Function parses all required data from service request data
+        Function parses all required data from service request data. Layer is parsed in place
         Args:
-            services (gpd.GeoDataFrame): nested response from api as feature collection
+            services (gpd.GeoDataFrame): nested response from api as feature collection owned by caller
         Returns:
             gpd.GeoDataFrame: service capacity with parsed storeys data. Can be empty
         """
-        services = services.copy()
         if services.empty:
             return services
         services = await asyncio.to_thread(
@@ -98,10 +98,11 @@ class AttributeParser:
             self._parse_service_capacity,
             services=services
         )
-        services = services.drop(
+        services.drop(
             ['object_geometry_id', 'territory', 'address', 'osm_id', 'physical_objects', 'services'],
-            axis=1
+            axis=1,
+            inplace=True,
         )
-        return services
+        return services_schema.apply(services)
 
 attribute_parser = AttributeParser()
@@ -0,0 +1,107 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from app.common.deadline.deadline import request_deadline
+from app.common.metrics.metrics import metrics
+from app.dependencies import get_config_value
+from .objectnat_calculator import objectnat_calculator
+from .provision_solver import provision_solver
+
+
+class CapacitySweeper:
+    """
+    Class estimates effects of services capacity variants over fixed buildings demands and availability matrix.
+    Matrix is prepared once and variants provision is solved by provision solver
+    """
+
+    def __init__(
+            self,
+            workers: int = 1,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            workers (int): number of threads calculating variants provision
+        Returns:
+            None
+        """
+
+        self.workers = workers
+
+    @staticmethod
+    def _apply_capacities(
+            services: gpd.GeoDataFrame,
+            capacities: dict[int, int],
+    ) -> np.ndarray:
+        """
+        Function creates services capacities array with overridden capacities
+        Args:
+            services (gpd.GeoDataFrame): services layer indexed by service id
+            capacities (dict[int, int]): capacities by service id
+        Returns:
+            np.ndarray: variant capacities in services order
+        """
+
+        capacity = services["capacity"].to_numpy(copy=True)
+        if capacities:
+            capacity[services.index.get_indexer(list(capacities))] = list(capacities.values())
+        return capacity
+
+    def estimate_variants(
+            self,
+            provision_before: gpd.GeoDataFrame,
+            buildings: gpd.GeoDataFrame,
+            services: gpd.GeoDataFrame,
+            matrix: pd.DataFrame,
+            service_normative: int,
+            variants: list[dict[int, int]],
+    ) -> list[gpd.GeoDataFrame]:
+        """
+        Function estimates effects of each capacities variant. Identical variants are calculated once
+        Args:
+            provision_before (gpd.GeoDataFrame): buildings provision before
+            buildings (gpd.GeoDataFrame): buildings after with demands
+            services (gpd.GeoDataFrame): services after indexed by service id
+            matrix (pd.DataFrame): availability matrix after
+            service_normative (int): service normative accessibility
+            variants (list[dict[int, int]]): capacities by service id for each variant
+        Returns:
+            list[gpd.GeoDataFrame]: effects of each variant in variants order
+        """
+
+        keys = [json.dumps(variant, sort_keys=True) for variant in variants]
+        unique_variants = dict(zip(keys, variants))
+        threshold = objectnat_calculator.get_provision_threshold(service_normative)
+        matrix = matrix.to_numpy()
+        distances = provision_solver.prepare_matrix(matrix, threshold)
+        demand = buildings["demand"].to_numpy()
+
+        def estimate(capacities: dict[int, int]) -> gpd.GeoDataFrame:
+            within, without = provision_solver.solve(
+                matrix=matrix,
+                distances=distances,
+                demand=demand,
+                capacity=self._apply_capacities(services, capacities),
+                threshold=threshold,
+            )
+            provision_after = buildings.copy()
+            provision_after["supplyed_demands_within"] = within
+            provision_after["supplyed_demands_without"] = without
+            return objectnat_calculator.estimate_effects(
+                provision_before=provision_before.copy(),
+                provision_after=provision_after,
+            )
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            effects = dict(zip(unique_variants, executor.map(request_deadline.bind(estimate), unique_variants.values())))
+        metrics.increment("capacity_sweeper.variants", len(unique_variants))
+        return [effects[key] for key in keys]
+
+
+capacity_sweeper = CapacitySweeper(
+    workers=int(get_config_value("SWEEP_WORKERS", "4")),
+)
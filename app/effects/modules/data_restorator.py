@@ -4,8 +4,11 @@ import numpy as np
 import pandas as pd
 import geopandas as gpd
 from objectnat import get_balanced_buildings
+from population_restorator.balancer import balance_houses, balance_territories
+from population_restorator.models.territories import Territory
 
-from app.dependencies import http_exception
+from app.dependencies import http_exception, urban_api_mode
+from .layer_schema import restored_buildings_schema
 
 
 class DataRestorator:
@@ -13,6 +16,46 @@ class DataRestorator:
     Class for restoration demand and population for buildings layer
     """
 
+    def __init__(
+            self,
+            seed: int | None = None,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            seed (int | None): population balancing random generator seed, defaults to None (objectnat seeds it by
+            current time)
+        Returns:
+            None
+        """
+
+        self.seed = seed
+
+    def _balance_buildings(
+            self,
+            buildings: gpd.GeoDataFrame,
+            population: int,
+    ) -> gpd.GeoDataFrame:
+        """
+        Function balances population into buildings by living area as objectnat get_balanced_buildings does. If seed
+        is set, balancing is done with generator seeded by it, so restored population is reproducible
+        Args:
+            buildings (gpd.GeoDataFrame): living buildings with "living_area" attribute
+            population (int): population to balance
+        Returns:
+            gpd.GeoDataFrame: buildings with "population" attribute
+        """
+
+        if self.seed is None:
+            return get_balanced_buildings(living_buildings=buildings, population=population)
+        index = buildings.index
+        territory = Territory("city", population, None, buildings.reset_index(drop=True))
+        balance_territories(territory, rng=np.random.default_rng(seed=self.seed))
+        balance_houses(territory, rng=np.random.default_rng(seed=self.seed))
+        houses = territory.get_all_houses()
+        houses.set_index(index, drop=True, inplace=True)
+        return houses
+
     @staticmethod
     def _restore_stores(
             buildings: gpd.GeoDataFrame,
@@ -31,33 +74,31 @@ class DataRestorator:
             buildings["storeys_count"] = 3
             return buildings
         average_stores = buildings["storeys_count"].mean()
-        buildings["storeys_count"] = buildings["storeys_count"].fillna(average_stores)
+        buildings["storeys_count"] = buildings["storeys_count"].fillna(round(average_stores)).astype(np.int16)
         return buildings
 
     @staticmethod
     def _restore_target_population(
-            buildings: gpd.GeoDataFrame,
+            floor_area: pd.Series,
     ) -> int:
         """
         Function estimates target population for territory
         Args:
-            buildings (gpd.GeoDataFrame): living buildings data
+            floor_area (pd.Series): living buildings floors area in square meters
         Returns:
             int: target population to restore
         """
 
-        local_crs = buildings.estimate_utm_crs()
-        buildings = buildings.to_crs(local_crs)
-        return int(sum(buildings.area * buildings["storeys_count"]) * 0.8/33)
+        return int(floor_area.sum() * 0.8/33)
 
-    # ToDo delete crs transformation
     def _restore_population(
             self,
             buildings: gpd.GeoDataFrame,
             target_population: int | None = None,
     ):
         """
-        Function fills population data with objectnat population restoration
+        Function fills population data with objectnat population restoration. Only geometry is projected to
+        calculate area, layer is restored in place and stays in its crs
         Args:
             buildings (gpd.GeoDataFrame): living buildings data
             target_population (int | None): Target population to restore, defaults to None
@@ -66,17 +107,11 @@ class DataRestorator:
         if buildings.empty:
             return buildings
         buildings = self._restore_stores(buildings)
+        floor_area = buildings.geometry.to_crs(buildings.estimate_utm_crs()).area * buildings["storeys_count"]
         if not target_population:
-            target_population = self._restore_target_population(buildings)
-        local_crs = buildings.estimate_utm_crs()
-        buildings = buildings.to_crs(local_crs)
-        buildings["living_area"] = buildings.area * buildings["storeys_count"] * 0.8
-        buildings["living_area"] = buildings["living_area"].astype(int)
-        balanced_buildings = get_balanced_buildings(
-            living_buildings=buildings,
-            population=int(target_population),
-        )
-        return balanced_buildings.to_crs(4326)
+            target_population = self._restore_target_population(floor_area)
+        buildings["living_area"] = (floor_area * 0.8).astype(int)
+        return self._balance_buildings(buildings, int(target_population))
 
     @staticmethod
     def _generate_demand_per_building(
@@ -100,6 +135,32 @@ class DataRestorator:
         buildings["demand"] = choice.astype(int)
         return buildings
 
+    @staticmethod
+    def sample_demands(
+            buildings: gpd.GeoDataFrame,
+            size: int,
+            seed: int | None = None,
+    ) -> np.ndarray:
+        """
+        Function generates demand realizations by probability with population data per building. Realizations have
+        the same total demand as restored one and are drawn by one multinomial call
+        Args:
+            buildings (gpd.GeoDataFrame): buildings with restored population and demands
+            size (int): number of realizations
+            seed (int | None): random generator seed, defaults to None
+        Returns:
+            np.ndarray: demands with realizations rows and buildings columns
+        """
+
+        if buildings.empty:
+            return np.zeros((size, 0), dtype=np.int64)
+        p = buildings["population"].to_numpy(dtype=np.float64)
+        if not p.sum():
+            # buildings without population have no demand to distribute
+            return np.zeros((size, len(buildings)), dtype=np.int64)
+        rng = np.random.default_rng(seed=seed)
+        return rng.multinomial(int(buildings["demand"].sum()), p / p.sum(), size=size)
+
     # Todo review provision model or at least create capacity solver
     def restore_demands(
             self,
@@ -131,7 +192,7 @@ class DataRestorator:
                 buildings=buildings,
                 target_demand=target_total_demand
             )
-            return buildings
+            return restored_buildings_schema.apply(buildings)
         else:
             raise http_exception(
                 status_code=400,
@@ -147,4 +208,5 @@ class DataRestorator:
             )
 
 
-data_restorator = DataRestorator()
+# replayed urban_api traffic reproduces request only if population is balanced with fixed seed
+data_restorator = DataRestorator(seed=0 if urban_api_mode == "replay" else None)
@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from app.common.deadline.deadline import request_deadline
+from app.common.metrics.metrics import metrics
+from app.dependencies import get_config_value
+from .data_restorator import data_restorator
+from .objectnat_calculator import objectnat_calculator
+from .provision_solver import provision_solver
+
+
+class DemandUncertaintyEstimator:
+    """
+    Class estimates effects for random demand realizations over fixed layers and availability matrices
+    """
+
+    def __init__(
+            self,
+            workers: int = 1,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            workers (int): number of threads calculating realizations provision
+        Returns:
+            None
+        """
+
+        self.workers = workers
+
+    @staticmethod
+    def _get_source_positions(
+            layer_ids: pd.Index,
+            source_buildings: gpd.GeoDataFrame,
+    ) -> np.ndarray:
+        """
+        Function finds positions of layer buildings in source layer. Layers keep first source building with id
+        Args:
+            layer_ids (pd.Index): layer buildings ids
+            source_buildings (gpd.GeoDataFrame): source buildings with "building_id" column
+        Returns:
+            np.ndarray: positions in source layer
+        """
+
+        source_ids = source_buildings["building_id"]
+        first = ~source_ids.duplicated().to_numpy()
+        return np.flatnonzero(first)[pd.Index(source_ids[first]).get_indexer(layer_ids)]
+
+    def _get_layer_demands(
+            self,
+            layer: gpd.GeoDataFrame,
+            context_buildings: gpd.GeoDataFrame,
+            context_demands: np.ndarray,
+            scenario_buildings: gpd.GeoDataFrame,
+            scenario_demands: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Function composes layer demands realizations from context and scenario realizations
+        Args:
+            layer (gpd.GeoDataFrame): composed buildings layer indexed by building id
+            context_buildings (gpd.GeoDataFrame): context buildings
+            context_demands (np.ndarray): context demands realizations
+            scenario_buildings (gpd.GeoDataFrame): scenario buildings of layer
+            scenario_demands (np.ndarray): scenario demands realizations
+        Returns:
+            np.ndarray: layer demands with realizations rows and layer buildings columns
+        """
+
+        is_project = layer["is_project"].to_numpy()
+        demands = np.empty((len(context_demands), len(layer)), dtype=np.int64)
+        if (~is_project).any():
+            demands[:, ~is_project] = context_demands[
+                :, self._get_source_positions(layer.index[~is_project], context_buildings)
+            ]
+        if is_project.any():
+            demands[:, is_project] = scenario_demands[
+                :, self._get_source_positions(layer.index[is_project], scenario_buildings)
+            ]
+        return demands
+
+    def estimate_realizations(
+            self,
+            layers: dict,
+            realizations: int,
+            seed: int | None = None,
+    ) -> list[gpd.GeoDataFrame]:
+        """
+        Function estimates effects for demand realizations. Context demands realizations are shared by before and
+        after layers, provision of both layers is solved for each realization
+        Args:
+            layers (dict): prepared layers with restored source buildings, composed layers and matrices
+            realizations (int): number of realizations
+            seed (int | None): random generator seed, defaults to None
+        Returns:
+            list[gpd.GeoDataFrame]: effects of each realization
+        """
+
+        rng = np.random.default_rng(seed=seed)
+        context_demands, target_demands, base_demands = (
+            data_restorator.sample_demands(layers[name], realizations, rng.integers(2 ** 32))
+            for name in ("context_buildings", "target_scenario_buildings", "base_scenario_buildings")
+        )
+        threshold = objectnat_calculator.get_provision_threshold(layers["normative_data"]["normative_value"])
+        solved_layers = {}
+        for name, scenario_name, scenario_demands in (
+                ("before", "base_scenario_buildings", base_demands),
+                ("after", "target_scenario_buildings", target_demands),
+        ):
+            matrix = layers[f"{name}_matrix"].to_numpy()
+            solved_layers[name] = {
+                "buildings": layers[f"{name}_buildings"],
+                "matrix": matrix,
+                "distances": provision_solver.prepare_matrix(matrix, threshold),
+                "capacity": layers[f"{name}_services"]["capacity"].to_numpy(),
+                "demands": self._get_layer_demands(
+                    layer=layers[f"{name}_buildings"],
+                    context_buildings=layers["context_buildings"],
+                    context_demands=context_demands,
+                    scenario_buildings=layers[scenario_name],
+                    scenario_demands=scenario_demands,
+                ),
+            }
+
+        def solve(layer: dict, realization: int) -> gpd.GeoDataFrame:
+            within, without = provision_solver.solve(
+                matrix=layer["matrix"],
+                distances=layer["distances"],
+                demand=layer["demands"][realization],
+                capacity=layer["capacity"],
+                threshold=threshold,
+            )
+            provision = layer["buildings"].copy()
+            provision["demand"] = layer["demands"][realization]
+            provision["supplyed_demands_within"] = within
+            provision["supplyed_demands_without"] = without
+            return provision
+
+        def estimate(realization: int) -> gpd.GeoDataFrame:
+            return objectnat_calculator.estimate_effects(
+                provision_before=solve(solved_layers["before"], realization),
+                provision_after=solve(solved_layers["after"], realization),
+            )
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            effects = list(executor.map(request_deadline.bind(estimate), range(realizations)))
+        metrics.increment("demand_uncertainty.realizations", realizations)
+        return effects
+
+    @staticmethod
+    def get_intervals(
+            values: np.ndarray,
+            confidence: float,
+    ) -> dict[str, np.ndarray]:
+        """
+        Function calculates mean and percentile confidence interval of values over realizations
+        Args:
+            values (np.ndarray): values with realizations along first axis
+            confidence (float): confidence level
+        Returns:
+            dict[str, np.ndarray]: "mean", "lower" and "upper" values
+        """
+
+        lower, upper = np.percentile(values, [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100], axis=0)
+        return {
+            "mean": values.mean(axis=0),
+            "lower": lower,
+            "upper": upper,
+        }
+
+
+demand_uncertainty_estimator = DemandUncertaintyEstimator(
+    workers=int(get_config_value("UNCERTAINTY_WORKERS", "4")),
+)
@@ -1,13 +1,134 @@
-import asyncio
+import json
+from contextlib import aclosing
 
 from shapely.geometry import shape
 import geopandas as gpd
+from loguru import logger
 
-from app.dependencies import urban_api_handler, http_exception
+from app.common.api_handler.feature_stream import FeatureStreamParser, FeatureColumns
+from app.common.single_flight.single_flight import SingleFlight
+from app.dependencies import urban_api_handler, http_exception, get_config_value
+from .population_loader import population_loader
+from .normatives_catalog import normatives_catalog
 
 
 class EffectsAPIGateway:
 
+    def __init__(
+            self,
+            page_size: int | None = None,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            page_size (int | None): number of features in one layer page request, defaults to None (layers are
+            requested by one request)
+        Returns:
+            None
+        """
+
+        self.page_size = page_size
+        self._layer_flight = SingleFlight("urban_api_layer")
+        self._layers_memo: dict[tuple[str, str], gpd.GeoDataFrame] | None = None
+
+    def memoize_layers(
+            self,
+            enabled: bool = True,
+    ) -> None:
+        """
+        Function switches layers memoization. Memoized layers are requested from urban_api once per process, so it is
+        used by offline jobs calculating many scenarios and service types of one project over shared context
+        Args:
+            enabled (bool): whether layers are memoized, defaults to True
+        Returns:
+            None
+        """
+
+        self._layers_memo = {} if enabled else None
+
+    async def _get_layer(
+            self,
+            endpoint_url: str,
+            params: dict,
+    ) -> gpd.GeoDataFrame:
+        """
+        Function retrieves layer from urban_api feature collection or from layers memo if memoization is enabled.
+        Streamed layers bypass urban_api responses coalescing, so concurrent requests of the same layer share one
+        download here. Each caller gets own copy of layer
+        Args:
+            endpoint_url (str): endpoint url
+            params (dict): query parameters
+        Returns:
+            gpd.GeoDataFrame: layer in EPSG:4326, can be empty
+        Raises:
+            502, http exception feature collection is incomplete
+        """
+
+        key = (endpoint_url, json.dumps(params, sort_keys=True))
+        if self._layers_memo is not None and key in self._layers_memo:
+            return self._layers_memo[key].copy()
+        layer = await self._layer_flight.do(key, lambda: self._request_layer(endpoint_url, params))
+        if self._layers_memo is not None:
+            self._layers_memo[key] = layer
+        return layer.copy()
+
+    async def _request_layer(
+            self,
+            endpoint_url: str,
+            params: dict,
+    ) -> gpd.GeoDataFrame:
+        """
+        Function requests layer from urban_api feature collection. Response body is parsed by chunks as it arrives
+        and features are accumulated as geometry arrays and attribute columns, so raw response is never held
+        in memory as a whole. Pages are requested until incomplete page if page size is set. Page starting with the
+        same feature as previous one is not used and ends paging, as endpoint ignoring paging returns whole layer
+        for each page
+        Args:
+            endpoint_url (str): endpoint url
+            params (dict): query parameters
+        Returns:
+            gpd.GeoDataFrame: layer in EPSG:4326, can be empty
+        Raises:
+            502, http exception feature collection is incomplete
+        """
+
+        columns = FeatureColumns()
+        page = 1
+        previous_first = None
+        while True:
+            page_params = params | {"page": page, "page_size": self.page_size} if self.page_size else params
+            parser = FeatureStreamParser()
+            page_start = columns.size
+            first = None
+            async with aclosing(urban_api_handler.stream(endpoint_url=endpoint_url, params=page_params)) as stream:
+                async for chunk in stream:
+                    features = parser.feed(chunk)
+                    if first is None and features:
+                        first = features[0]
+                        if first == previous_first:
+                            break
+                    columns.append(features)
+            if first is not None and first == previous_first:
+                logger.warning(f"{endpoint_url} repeats page {page - 1} as page {page}, paging is ignored by endpoint")
+                break
+            if not parser.finished:
+                raise http_exception(
+                    status_code=502,
+                    msg="Couldn't get data from API",
+                    _input={"endpoint_url": endpoint_url, "params": page_params},
+                    _detail="Feature collection is incomplete",
+                )
+            # page larger than page size means paging is not supported by endpoint and whole layer is received
+            if not self.page_size or columns.size - page_start != self.page_size:
+                break
+            previous_first = first
+            page += 1
+        layer = columns.to_geodataframe()
+        if layer.empty:
+            return layer
+        layer.set_crs(4326, inplace=True)
+        return layer
+
     @staticmethod
     async def get_service_normative(
             territory_id: int,
@@ -15,7 +136,7 @@ class EffectsAPIGateway:
             year: int = 2024,
     ) -> dict[str, int | str]:
         """
-        Function retrieves normative data from urban_api
+        Function retrieves normative data from normatives catalog of territory
         Args:
             territory_id: territory id to get normative from
             service_type_id: service to get normative from
@@ -26,47 +147,12 @@ class EffectsAPIGateway:
             400, http exception id not found
         """
 
-        response = await urban_api_handler.get(
-            f"/api/v1/territory/{territory_id}/normatives",
-            params={
-                "year": year,
-            }
-        )
-        for service_type in response:
-            if service_type["service_type"]["id"] == service_type_id:
-                if normative_value:=service_type["radius_availability_meters"]:
-                    service_type["normative_value"] = normative_value
-                    service_type["normative_type"] = "dist"
-                    if service_type.get("services_per_1000_normative"):
-                        service_type["capacity_type"] = "unit"
-                    else:
-                        service_type["capacity_type"] = "capacity"
-                    return service_type
-                elif normative_value:=service_type["time_availability_minutes"]:
-                    service_type["normative_value"] = normative_value
-                    service_type["normative_type"] = "time"
-                    if service_type.get("services_per_1000_normative"):
-                        service_type["capacity_type"] = "unit"
-                    else:
-                        service_type["capacity_type"] = "capacity"
-                    return service_type
-                else:
-                    raise http_exception(
-                        status_code=400,
-                        msg="Service type normative not found",
-                        _input={"service_type_id": service_type_id},
-                        _detail={
-                            "Available service ids": [service_type["id"] for service_type in response]
-                        },
-                    )
-        raise http_exception(
-            status_code=400,
-            msg="Service type normative not found",
-            _input={"service_type_id": service_type_id},
-            _detail={
-                "Available service ids": [service_type["service_type"]["id"] for service_type in response]
-            }
+        normative = await normatives_catalog.get_normative(
+            territory_id=territory_id,
+            service_type_id=service_type_id,
+            year=year,
         )
+        return normative.model_dump()
 
     @staticmethod
     async def get_project_data(project_id: int) -> dict[str, int | dict]:
@@ -85,7 +171,21 @@ class EffectsAPIGateway:
         return response
 
     @staticmethod
+    async def get_project_scenarios(project_id: int) -> list[dict]:
+        """
+        Function retrieves project scenarios from urban_api
+        Args:
+            project_id: project id to get scenarios from
+        Returns:
+            list[dict]: scenarios with "scenario_id" and "is_based" fields
+        """
+
+        return await urban_api_handler.get(
+            endpoint_url=f"/api/v1/projects/{project_id}/scenarios",
+        )
+
     async def get_scenario_buildings(
+            self,
             scenario_id: int,
     ) -> gpd.GeoDataFrame:
         """
@@ -96,20 +196,15 @@ class EffectsAPIGateway:
             gpd.GeoDataFrame: buildings layer, can be empty
         """
 
-        buildings = await urban_api_handler.get(
+        return await self._get_layer(
             endpoint_url=f"/api/v1/scenarios/{scenario_id}/geometries_with_all_objects",
             params={
                 "physical_object_type_id": 4
             }
         )
-        buildings_gdf = gpd.GeoDataFrame.from_features(buildings)
-        if buildings_gdf.empty:
-            return buildings_gdf
-        buildings_gdf.set_crs(4326, inplace=True)
-        return buildings_gdf
 
-    @staticmethod
     async def get_project_context_buildings(
+            self,
             project_id: int,
     ) -> gpd.GeoDataFrame:
         """
@@ -122,20 +217,15 @@ class EffectsAPIGateway:
             404, http exception living buildings not found
         """
 
-        context_buildings = await urban_api_handler.get(
+        return await self._get_layer(
             endpoint_url=f"/api/v1/projects/{project_id}/context/geometries_with_all_objects",
             params={
                 "physical_object_type_id": 4,
             }
         )
-        context_buildings_gdf = gpd.GeoDataFrame.from_features(context_buildings)
-        if context_buildings_gdf.empty:
-            return context_buildings_gdf
-        context_buildings_gdf.set_crs(4326, inplace=True)
-        return context_buildings_gdf
 
-    @staticmethod
     async def get_scenario_services(
+            self,
             scenario_id: int,
             service_type_id: int,
     ) -> gpd.GeoDataFrame:
@@ -148,20 +238,15 @@ class EffectsAPIGateway:
             gpd.GeoDataFrame: services layer, can be empty
         """
 
-        services = await urban_api_handler.get(
+        return await self._get_layer(
             endpoint_url=f"/api/v1/scenarios/{scenario_id}/geometries_with_all_objects",
             params={
                 "service_type_id": service_type_id,
             }
         )
-        services_gdf = gpd.GeoDataFrame.from_features(services)
-        if services_gdf.empty:
-            return services_gdf
-        services_gdf.set_crs(4326, inplace=True)
-        return services_gdf
 
-    @staticmethod
     async def get_project_context_services(
+            self,
             project_id: int,
             service_type_id: int,
     ) -> gpd.GeoDataFrame:
@@ -174,17 +259,12 @@ class EffectsAPIGateway:
             gpd.GeoDataFrame: context services layer. Can be empty
         """
 
-        context_services = await urban_api_handler.get(
+        return await self._get_layer(
             endpoint_url=f"/api/v1/projects/{project_id}/context/geometries_with_all_objects",
             params={
                 "service_type_id": service_type_id,
             }
         )
-        context_services_gdf = gpd.GeoDataFrame.from_features(context_services)
-        if context_services_gdf.empty:
-            return context_services_gdf
-        context_services_gdf.set_crs(4326, inplace=True)
-        return context_services_gdf
 
     @staticmethod
     async def get_scenario_population_data(
@@ -214,22 +294,15 @@ class EffectsAPIGateway:
             territory_ids_list: list[int],
     ) -> int:
         """
-        Function retrieves territory population data from urban_api by territory id
+        Function retrieves territory population data from urban_api by territory id. Territories population is
+        loaded with bounded concurrency and cached per territory
         Args:
             territory_ids_list: list[int]: territory ids list to get population data from
         Returns:
-            gpd.GeoDataFrame: territory population data layer
+            int: total territories population
         """
 
-        task_list = [urban_api_handler.get(
-            endpoint_url=f"/api/v1/territory/{territory_id}/indicator_values",
-            params={
-                "indicator_ids": 1
-            }
-        ) for territory_id in territory_ids_list]
-
-        result = await asyncio.gather(*task_list)
-        return sum([item[0]["value"] for item in result])
+        return await population_loader.get_population(territory_ids_list)
 
     @staticmethod
     async def get_project_territory(project_id: int) -> gpd.GeoDataFrame:
@@ -248,4 +321,6 @@ class EffectsAPIGateway:
         return territory_gdf
 
 
-effects_api_gateway = EffectsAPIGateway()
+effects_api_gateway = EffectsAPIGateway(
+    page_size=int(get_config_value("URBAN_API_PAGE_SIZE", "0")) or None,
+)
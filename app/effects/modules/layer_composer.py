@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from pyproj import CRS
+
+
+class LayerComposer:
+    """
+    Class composes before and after layers from context and scenarios layers. Layers are concatenated and projected
+    once, before and after layers are taken from the shared frame by positions
+    """
+
+    @staticmethod
+    def _concat(
+            layers: list[gpd.GeoDataFrame],
+            local_crs: CRS,
+    ) -> tuple[gpd.GeoDataFrame, np.ndarray]:
+        """
+        Function concatenates layers into shared frame in local crs
+        Args:
+            layers (list[gpd.GeoDataFrame]): layers to concatenate
+            local_crs (CRS): local projected crs
+        Returns:
+            tuple[gpd.GeoDataFrame, np.ndarray]: shared frame and number of source layer for each row
+        """
+
+        sources = np.repeat(np.arange(len(layers)), [len(layer) for layer in layers])
+        shared = pd.concat([layer for layer in layers if not layer.empty], ignore_index=True)
+        shared.to_crs(local_crs, inplace=True)
+        return shared, sources
+
+    @staticmethod
+    def _keep_first(
+            positions: np.ndarray,
+            keys: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Function drops positions with duplicated keys keeping the first one
+        Args:
+            positions (np.ndarray): rows positions
+            keys (np.ndarray): rows keys
+        Returns:
+            np.ndarray: positions with unique keys in original order
+        """
+
+        _, first = np.unique(keys[positions], return_index=True)
+        return positions[np.sort(first)]
+
+    def _get_buildings_positions(
+            self,
+            ids: np.ndarray,
+            sources: np.ndarray,
+            project_source: int,
+    ) -> np.ndarray:
+        """
+        Function returns positions of project buildings followed by context buildings not replaced by project ones
+        Args:
+            ids (np.ndarray): buildings ids
+            sources (np.ndarray): number of source layer for each row, context layer is 0
+            project_source (int): number of project layer
+        Returns:
+            np.ndarray: layer rows positions
+        """
+
+        project_positions = self._keep_first(np.flatnonzero(sources == project_source), ids)
+        context_positions = np.flatnonzero(sources == 0)
+        context_positions = context_positions[~np.isin(ids[context_positions], ids[project_positions])]
+        return np.concatenate((project_positions, self._keep_first(context_positions, ids)))
+
+    def compose_buildings(
+            self,
+            context_buildings: gpd.GeoDataFrame,
+            target_scenario_buildings: gpd.GeoDataFrame,
+            base_scenario_buildings: gpd.GeoDataFrame,
+            local_crs: CRS,
+    ) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+        """
+        Function composes before and after buildings layers. Scenario buildings replace context buildings with the
+        same id
+        Args:
+            context_buildings (gpd.GeoDataFrame): context buildings with restored demands
+            target_scenario_buildings (gpd.GeoDataFrame): target scenario buildings with restored demands
+            base_scenario_buildings (gpd.GeoDataFrame): base scenario buildings with restored demands
+            local_crs (CRS): local projected crs
+        Returns:
+            tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]: before and after buildings indexed by building id
+        """
+
+        buildings, sources = self._concat(
+            [context_buildings, target_scenario_buildings, base_scenario_buildings],
+            local_crs,
+        )
+        ids = buildings["building_id"].to_numpy()
+        buildings.set_index("building_id", inplace=True)
+        before_buildings = buildings.take(self._get_buildings_positions(ids, sources, project_source=2))
+        after_buildings = buildings.take(self._get_buildings_positions(ids, sources, project_source=1))
+        return before_buildings, after_buildings
+
+    def compose_services(
+            self,
+            context_services: gpd.GeoDataFrame,
+            target_scenario_services: gpd.GeoDataFrame,
+            base_scenario_services: gpd.GeoDataFrame,
+            local_crs: CRS,
+    ) -> tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+        """
+        Function composes before and after services layers. Services with duplicated geometries are dropped keeping
+        context ones
+        Args:
+            context_services (gpd.GeoDataFrame): context services
+            target_scenario_services (gpd.GeoDataFrame): target scenario services
+            base_scenario_services (gpd.GeoDataFrame): base scenario services
+            local_crs (CRS): local projected crs
+        Returns:
+            tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]: before and after services indexed by service id
+        """
+
+        services, sources = self._concat(
+            [context_services, target_scenario_services, base_scenario_services],
+            local_crs,
+        )
+        geometry_codes = pd.factorize(shapely.to_wkb(np.asarray(services.geometry.values)))[0]
+        services.set_index("service_id", inplace=True)
+        before_services = services.take(
+            self._keep_first(np.flatnonzero(sources != 1), geometry_codes)
+        )
+        after_services = services.take(
+            self._keep_first(np.flatnonzero(sources != 2), geometry_codes)
+        )
+        return before_services, after_services
+
+
+layer_composer = LayerComposer()
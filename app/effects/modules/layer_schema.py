@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+
+class LayerSchema:
+    """
+    Class describes compact dtypes of layer columns passed between pipeline modules. Integer columns are downcast
+    only if their values fit compact dtype, int64 is kept otherwise
+    """
+
+    def __init__(
+            self,
+            name: str,
+            columns: dict[str, str],
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            name (str): layer name used in errors
+            columns (dict[str, str]): required columns dtypes
+        Returns:
+            None
+        """
+
+        self.name = name
+        self.columns = columns
+
+    @staticmethod
+    def _fits(
+            values: pd.Series,
+            dtype: str,
+    ) -> bool:
+        """
+        Function checks whether values can be cast to dtype without overflow
+        Args:
+            values (pd.Series): column values
+            dtype (str): target dtype
+        Returns:
+            bool: True if dtype is not integer or values are within its range
+        """
+
+        if not np.issubdtype(np.dtype(dtype), np.integer) or values.empty:
+            return True
+        info = np.iinfo(dtype)
+        return info.min <= values.min() and values.max() <= info.max
+
+    def apply(
+            self,
+            layer: gpd.GeoDataFrame,
+    ) -> gpd.GeoDataFrame:
+        """
+        Function casts layer columns to schema dtypes in place
+        Args:
+            layer (gpd.GeoDataFrame): layer to cast. Empty layer is returned as is
+        Returns:
+            gpd.GeoDataFrame: layer with schema dtypes
+        Raises:
+            ValueError: if layer misses schema columns
+        """
+
+        if layer.empty:
+            return layer
+        if missing_columns := [column for column in self.columns if column not in layer.columns]:
+            raise ValueError(f"{self.name} layer misses columns {missing_columns}")
+        for column, dtype in self.columns.items():
+            if layer[column].dtype != dtype:
+                layer[column] = layer[column].astype(dtype if self._fits(layer[column], dtype) else "int64")
+        return layer
+
+
+parsed_buildings_schema = LayerSchema(
+    name="parsed buildings",
+    columns={
+        "building_id": "int64",
+        "storeys_count": "float32",
+    },
+)
+restored_buildings_schema = LayerSchema(
+    name="restored buildings",
+    columns={
+        "building_id": "int64",
+        "storeys_count": "int16",
+        "living_area": "int32",
+        "population": "int32",
+        "demand": "int32",
+    },
+)
+services_schema = LayerSchema(
+    name="services",
+    columns={
+        "service_id": "int64",
+        "capacity": "float32",
+    },
+)
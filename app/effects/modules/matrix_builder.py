@@ -1,15 +1,234 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal
 
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from scipy.spatial import KDTree
+import shapely
+from loguru import logger
+from pyproj import CRS
+from scipy.spatial import cKDTree
+
+from app.common.deadline.deadline import request_deadline
+from app.common.metrics.metrics import metrics
+from app.dependencies import get_config_value
 
 
 class MatrixBuilder:
 
+    def __init__(
+            self,
+            tree_cache_size: int = 32,
+            leafsize: int = 16,
+            mode: Literal["direct", "tiled", "network"] = "direct",
+            tile_size: int = 5000,
+            workers: int = 1,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            tree_cache_size (int): max number of kd-trees stored in cache
+            leafsize (int): kd-tree leaf size
+            mode (Literal["direct", "tiled", "network"]): matrix construction mode. "tiled" splits buildings into
+            spatial tiles processed in parallel, "network" calculates walk distances by regional pedestrian graph
+            tile_size (int): tile side in meters for "tiled" mode
+            workers (int): number of threads processing tiles
+        Returns:
+            None
+        """
+
+        self.tree_cache_size = tree_cache_size
+        self.leafsize = leafsize
+        self.mode = mode
+        self.tile_size = tile_size
+        self.workers = workers
+        self._trees: OrderedDict[str, cKDTree] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_points(
+            layer: gpd.GeoDataFrame,
+    ) -> np.ndarray:
+        """
+        Function extracts layer centroids coordinates
+        Args:
+            layer (gpd.GeoDataFrame): layer in projected crs
+        Returns:
+            np.ndarray: centroids coordinates with shape (n, 2)
+        """
+
+        return shapely.get_coordinates(np.asarray(layer.geometry.centroid.values))
+
+    def _get_tree(
+            self,
+            index: pd.Index,
+            points: np.ndarray,
+    ) -> cKDTree:
+        """
+        Function returns kd-tree for layer points from cache or builds it. Trees are keyed by layer ids and
+        coordinates, so identical layers of different requests share one tree
+        Args:
+            index (pd.Index): layer ids
+            points (np.ndarray): layer points coordinates
+        Returns:
+            cKDTree: kd-tree over points
+        """
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(pd.util.hash_array(index.to_numpy()).tobytes())
+        digest.update(np.ascontiguousarray(points).tobytes())
+        key = digest.hexdigest()
+        with self._lock:
+            if tree := self._trees.get(key):
+                self._trees.move_to_end(key)
+                metrics.increment("kd_tree_cache.hit")
+                return tree
+        metrics.increment("kd_tree_cache.miss")
+        tree = cKDTree(points, leafsize=self.leafsize, balanced_tree=False)
+        with self._lock:
+            self._trees[key] = tree
+            while len(self._trees) > self.tree_cache_size:
+                self._trees.popitem(last=False)
+        return tree
+
     @staticmethod
+    def _fill_matrix(
+            matrix: np.ndarray,
+            buildings_kd_tree: cKDTree,
+            services_kd_tree: cKDTree,
+            max_distance: float,
+            rows: np.ndarray | None = None,
+    ) -> None:
+        """
+        Function writes distances between buildings and services within max distance to matrix
+        Args:
+            matrix (np.ndarray): preallocated matrix filled with nan
+            buildings_kd_tree (cKDTree): buildings kd-tree
+            services_kd_tree (cKDTree): services kd-tree
+            max_distance (float): max distance between building and service
+            rows (np.ndarray | None): matrix rows of tree points, defaults to None (tree points are all matrix rows)
+        Returns:
+            None
+        """
+
+        distances = buildings_kd_tree.sparse_distance_matrix(
+            other=services_kd_tree,
+            max_distance=max_distance,
+            output_type="ndarray",
+        )
+        distances = distances[distances["v"] != 0]
+        matrix_rows = distances["i"] if rows is None else rows[distances["i"]]
+        matrix[matrix_rows, distances["j"]] = distances["v"]
+
+    def _fill_tiled_matrix(
+            self,
+            matrix: np.ndarray,
+            buildings_points: np.ndarray,
+            services_kd_tree: cKDTree,
+            max_distance: float,
+    ) -> None:
+        """
+        Function writes distances to matrix tile by tile. Buildings are grouped in square tiles, each tile is
+        queried against services tree in thread pool, so memory is bounded by tile and work scales with cores.
+        Request deadline is checked before each tile
+        Args:
+            matrix (np.ndarray): preallocated matrix filled with nan
+            buildings_points (np.ndarray): buildings coordinates
+            services_kd_tree (cKDTree): services kd-tree
+            max_distance (float): max distance between building and service
+        Returns:
+            None
+        """
+
+        if not len(buildings_points):
+            return
+        tiles_keys = np.floor(buildings_points / self.tile_size).astype(np.int64)
+        order = np.lexsort((tiles_keys[:, 1], tiles_keys[:, 0]))
+        boundaries = np.flatnonzero(np.any(np.diff(tiles_keys[order], axis=0) != 0, axis=1)) + 1
+        tiles = np.split(order, boundaries)
+
+        def fill_tile(tile: np.ndarray) -> None:
+            request_deadline.check("matrices")
+            self._fill_matrix(
+                matrix=matrix,
+                buildings_kd_tree=cKDTree(buildings_points[tile], leafsize=self.leafsize, balanced_tree=False),
+                services_kd_tree=services_kd_tree,
+                max_distance=max_distance,
+                rows=tile,
+            )
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(request_deadline.bind(fill_tile), tiles))
+        metrics.increment("matrix_builder.tiles", len(tiles))
+
+    @staticmethod
+    def _fill_walk_matrix(
+            matrix: np.ndarray,
+            buildings_points: np.ndarray,
+            services_points: np.ndarray,
+            crs: CRS,
+            max_distance: float,
+    ) -> bool:
+        """
+        Function writes walk distances by pedestrian graph to matrix. Straight line search radius includes 1.41
+        detour factor, so graph walk distance is cut off at radius multiplied by it
+        Args:
+            matrix (np.ndarray): preallocated matrix filled with nan
+            buildings_points (np.ndarray): buildings coordinates
+            services_points (np.ndarray): services coordinates
+            crs (CRS): points crs
+            max_distance (float): straight line search radius
+        Returns:
+            bool: True if graph covering layers was found and matrix was filled
+        """
+
+        # numba is imported only in network mode
+        from .walk_graph import walk_graph_store
+
+        layers_points = np.vstack((buildings_points, services_points))
+        (min_x, min_y), (max_x, max_y) = layers_points.min(axis=0), layers_points.max(axis=0)
+        bounds = gpd.GeoSeries(
+            shapely.points([[min_x, min_y], [min_x, max_y], [max_x, min_y], [max_x, max_y]]), crs=crs
+        ).to_crs(4326).total_bounds
+        walk_graph = walk_graph_store.get_graph(bounds)
+        if not walk_graph:
+            logger.warning(f"No walk graph covers {bounds.tolist()}, straight line distances are used")
+            return False
+        walk_graph.fill_matrix(
+            matrix=matrix,
+            buildings_points=buildings_points,
+            services_points=services_points,
+            crs=crs,
+            cutoff=max_distance * 1.41,
+        )
+        return True
+
+    @staticmethod
+    def get_max_distance(
+            normative_value: int,
+            normative_type: Literal["time", "dist"],
+    ) -> float:
+        """
+        Function calculates max straight line distance between building and service stored in availability matrix
+        Args:
+            normative_value (int): Normative value
+            normative_type (Literal["time", "dist"]): Type of normative value
+        Returns:
+            float: max distance in meters
+        """
+
+        if normative_type == "time":
+            normative_value = (normative_value * 1000/60 * 40 )/1.41
+        else:
+            normative_value = (normative_value * 3) / 1.41
+        return normative_value * 3
+
     def calculate_availability_matrix(
+            self,
             buildings: gpd.GeoDataFrame,
             services: gpd.GeoDataFrame,
             normative_value: int,
@@ -23,27 +242,47 @@ class MatrixBuilder:
             normative_value (int): Normative value
             normative_type (Literal["time", "dist"]): Type of normative value
         Returns:
-            pd.DataFrame: Availability matrix with distance in minutes
+            pd.DataFrame: Availability matrix with float32 distance in minutes
         """
 
-        if normative_type == "time":
-            normative_value = (normative_value * 1000/60 * 40 )/1.41
+        max_distance = self.get_max_distance(normative_value, normative_type)
+        if not buildings.crs.is_projected:
+            local_crs = buildings.estimate_utm_crs()
+            buildings = buildings.to_crs(local_crs)
+            services = services.to_crs(local_crs)
+        buildings_points = self._get_points(buildings)
+        services_points = self._get_points(services)
+        matrix = np.full((len(buildings), len(services)), np.nan, dtype=np.float32)
+        if self.mode == "network" and len(buildings) and len(services) and self._fill_walk_matrix(
+            matrix=matrix,
+            buildings_points=buildings_points,
+            services_points=services_points,
+            crs=buildings.crs,
+            max_distance=max_distance,
+        ):
+            return pd.DataFrame(matrix, index=buildings.index, columns=services.index)
+        services_kd_tree = self._get_tree(services.index, services_points)
+        if self.mode == "tiled":
+            self._fill_tiled_matrix(
+                matrix=matrix,
+                buildings_points=buildings_points,
+                services_kd_tree=services_kd_tree,
+                max_distance=max_distance,
+            )
         else:
-            normative_value = (normative_value * 3) / 1.41
-        local_crs = buildings.estimate_utm_crs()
-        buildings = buildings.to_crs(local_crs).set_index(buildings.index, drop=True)
-        services = services.to_crs(local_crs).set_index(services.index, drop=True)
-        buildings_points = [geometry.coords[0] for geometry in buildings.geometry.centroid]
-        services_points = [geometry.coords[0] for geometry in services.geometry.centroid]
-        buildings_kd_tree = KDTree(buildings_points)
-        services_kd_tree = KDTree(services_points)
-        distances = buildings_kd_tree.sparse_distance_matrix(
-            other=services_kd_tree,
-            max_distance=normative_value * 3)
-        matrix = pd.DataFrame.sparse.from_spmatrix(distances, index=buildings.index, columns=services.index)
-        matrix = matrix.sparse.to_dense()
-        matrix.replace(0.0, np.nan, inplace=True)
-        return matrix
+            self._fill_matrix(
+                matrix=matrix,
+                buildings_kd_tree=self._get_tree(buildings.index, buildings_points),
+                services_kd_tree=services_kd_tree,
+                max_distance=max_distance,
+            )
+        return pd.DataFrame(matrix, index=buildings.index, columns=services.index)
 
 
-matrix_builder = MatrixBuilder()
+matrix_builder = MatrixBuilder(
+    tree_cache_size=int(get_config_value("KD_TREE_CACHE_SIZE", "32")),
+    leafsize=int(get_config_value("KD_TREE_LEAFSIZE", "16")),
+    mode=get_config_value("MATRIX_MODE", "direct"),
+    tile_size=int(get_config_value("MATRIX_TILE_SIZE", "5000")),
+    workers=int(get_config_value("MATRIX_WORKERS", str(os.cpu_count() or 1))),
+)
@@ -0,0 +1,173 @@
+import asyncio
+import time
+
+from loguru import logger
+
+from app.common.metrics.metrics import metrics
+from app.common.single_flight.single_flight import SingleFlight
+from app.dependencies import urban_api_handler, http_exception, get_config_value
+from ..shemas.service_normative_schema import ServiceNormativeSchema
+
+
+class NormativesCatalog:
+    """
+    Class stores territories normatives indexed by service type id. Each territory normatives list is requested once
+    per year and refreshed in background after ttl expiration, stale normatives are served while refreshing
+    """
+
+    def __init__(self, ttl: int = 86400) -> None:
+        """Initialisation function
+
+        Args:
+            ttl (int): normatives lifetime in seconds before background refresh
+        Returns:
+            None
+        """
+
+        self.ttl = ttl
+        self._catalogs: dict[tuple[int, int], dict] = {}
+        self._refresh_tasks: dict[tuple[int, int], asyncio.Task] = {}
+        self._load_flight = SingleFlight("normatives_catalog")
+
+    @staticmethod
+    def _parse_normative(
+            service_type: dict,
+    ) -> ServiceNormativeSchema | None:
+        """
+        Function derives normative and capacity types for service type normative
+        Args:
+            service_type (dict): service type normative from urban_api
+        Returns:
+            ServiceNormativeSchema | None: parsed normative, None if service type has no availability normative
+        """
+
+        if normative_value := service_type["radius_availability_meters"]:
+            normative_type = "dist"
+        elif normative_value := service_type["time_availability_minutes"]:
+            normative_type = "time"
+        else:
+            return None
+        return ServiceNormativeSchema.model_validate(
+            service_type | {
+                "normative_value": normative_value,
+                "normative_type": normative_type,
+                "capacity_type": "unit" if service_type.get("services_per_1000_normative") else "capacity",
+            }
+        )
+
+    async def _load(
+            self,
+            territory_id: int,
+            year: int,
+    ) -> dict:
+        """
+        Function requests territory normatives from urban_api and indexes them by service type id
+        Args:
+            territory_id (int): territory id
+            year (int): normatives year
+        Returns:
+            dict: catalog with "normatives" index, "service_type_ids" list and "expires_at" time
+        """
+
+        response = await urban_api_handler.get(
+            f"/api/v1/territory/{territory_id}/normatives",
+            params={
+                "year": year,
+            }
+        )
+        normatives = {}
+        for service_type in response:
+            service_type_id = service_type["service_type"]["id"]
+            if service_type_id not in normatives:
+                normatives[service_type_id] = self._parse_normative(service_type)
+        catalog = {
+            "normatives": normatives,
+            "service_type_ids": list(normatives),
+            "expires_at": time.monotonic() + self.ttl,
+        }
+        self._catalogs[(territory_id, year)] = catalog
+        metrics.increment("normatives_catalog.loaded")
+        return catalog
+
+    async def _refresh(
+            self,
+            territory_id: int,
+            year: int,
+    ) -> None:
+        """
+        Function reloads territory normatives keeping stale catalog on failure
+        Args:
+            territory_id (int): territory id
+            year (int): normatives year
+        Returns:
+            None
+        """
+
+        try:
+            await self._load(territory_id, year)
+        except Exception as e:
+            logger.warning(f"Failed to refresh normatives of territory {territory_id} for {year}: {e}")
+        finally:
+            self._refresh_tasks.pop((territory_id, year), None)
+
+    async def get_normatives(
+            self,
+            territory_id: int,
+            year: int = 2024,
+    ) -> dict[int, ServiceNormativeSchema | None]:
+        """
+        Function returns territory normatives of all service types
+        Args:
+            territory_id (int): territory id
+            year (int): normatives year
+        Returns:
+            dict[int, ServiceNormativeSchema | None]: normatives by service type id, None for service types without
+            availability normative
+        """
+
+        key = (territory_id, year)
+        if not (catalog := self._catalogs.get(key)):
+            metrics.increment("normatives_catalog.miss")
+            catalog = await self._load_flight.do(key, lambda: self._load(territory_id, year))
+        elif catalog["expires_at"] <= time.monotonic():
+            metrics.increment("normatives_catalog.stale")
+            if key not in self._refresh_tasks:
+                self._refresh_tasks[key] = asyncio.create_task(self._refresh(territory_id, year))
+        else:
+            metrics.increment("normatives_catalog.hit")
+        return catalog["normatives"]
+
+    async def get_normative(
+            self,
+            territory_id: int,
+            service_type_id: int,
+            year: int = 2024,
+    ) -> ServiceNormativeSchema:
+        """
+        Function returns territory normative of service type
+        Args:
+            territory_id (int): territory id
+            service_type_id (int): service type id
+            year (int): normatives year
+        Returns:
+            ServiceNormativeSchema: service type normative
+        Raises:
+            400, http exception service type normative not found
+        """
+
+        normatives = await self.get_normatives(territory_id, year)
+        if normative := normatives.get(service_type_id):
+            return normative
+        raise http_exception(
+            status_code=400,
+            msg="Service type normative not found",
+            _input={"service_type_id": service_type_id},
+            _detail={
+                "Available service ids": list(normatives)
+            }
+        )
+
+
+normatives_catalog = NormativesCatalog(
+    ttl=int(get_config_value("NORMATIVES_CACHE_TTL", "86400")),
+)
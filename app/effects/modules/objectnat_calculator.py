@@ -1,6 +1,7 @@
 import json
 from typing import Literal
 
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from objectnat import get_service_provision
@@ -10,6 +11,20 @@ from app.dependencies import http_exception
 
 class ObjectNatCalculator:
 
+    @staticmethod
+    def get_provision_threshold(
+            service_normative: int,
+    ) -> int:
+        """
+        Function calculates provision model threshold from service normative accessibility
+        Args:
+            service_normative (int): service normative accessibility
+        Returns:
+            int: provision threshold
+        """
+
+        return int(service_normative * 1000 / 60 * 40)
+
     @staticmethod
     def evaluate_provision(
             buildings: gpd.GeoDataFrame,
@@ -33,7 +48,7 @@ class ObjectNatCalculator:
             buildings=buildings,
             services=services,
             adjacency_matrix=matrix,
-            threshold=int(service_normative * 1000 / 60 * 40),
+            threshold=ObjectNatCalculator.get_provision_threshold(service_normative),
         )
 
         return {
@@ -99,15 +114,14 @@ class ObjectNatCalculator:
             effects: pd.DataFrame | gpd.GeoDataFrame,
     ) -> pd.DataFrame | gpd.GeoDataFrame:
         """
-        Function calculates provision effects
+        Function calculates provision effects in place
         Args:
-            effects (pd.DataFrame | gpd.GeoDataFrame): GeoDataFrame of effects
+            effects (pd.DataFrame | gpd.GeoDataFrame): GeoDataFrame of effects owned by caller
         Returns:
             pd.Series: effects results
         """
 
         #ToDo fix calculation without/before
-        effects = effects.copy()
         supplied_demand_within_before = effects["supplyed_demands_within_before"].fillna(0)
         supplied_demand_without_before = effects["supplyed_demands_without_before"].fillna(0)
         supplied_demand_within_after = effects["supplyed_demands_within_after"].fillna(0)
@@ -120,7 +134,7 @@ class ObjectNatCalculator:
         total_us_demands_after = effects["us_demands_without_after"].fillna(0)
         total_demand = int(effects["demand"].sum())
 
-        effects.dropna(subset="is_project", inplace=True)
+        effects.drop(index=effects.index[~effects["in_after"]], inplace=True)
 
         project_total_supplied_demands_before = effects[
                                                     effects["is_project"]
@@ -153,14 +167,14 @@ class ObjectNatCalculator:
             unsupplied_demand_before=total_us_demands_before,
             total_demand=total_demand,
         )
-        effects["absolute_scenario_project"] = None
+        effects["absolute_scenario_project"] = np.nan
         effects.loc[effects["is_project"], ["absolute_scenario_project"]] = self._calculate_absolute(
             supplied_demand_before=project_total_supplied_demands_before,
             supplied_demand_after=project_total_supplied_demands_after,
             unsupplied_demand_after=project_total_us_demands_after,
             unsupplied_demand_before=project_total_us_demands_before,
         )
-        effects["index_scenario_project"] = None
+        effects["index_scenario_project"] = np.nan
         effects.loc[effects["is_project"], ["index_scenario_project"]] = self._calculate_index(
             supplied_demand_after=project_total_supplied_demands_after,
             supplied_demand_before=project_total_supplied_demands_before,
@@ -191,7 +205,7 @@ class ObjectNatCalculator:
             gpd.GeoDataFrame: layer with effects, provision before and after attributes
         """
 
-        provision_before["supplyed_demands_within_before"] = provision_before["supplyed_demands_within"].copy()
+        provision_before["supplyed_demands_within_before"] = provision_before["supplyed_demands_within"]
 
         provision_before[
             "us_demands_within_before"
@@ -205,7 +219,7 @@ class ObjectNatCalculator:
             "us_demands_without_before"
         ] = provision_before["demand"] - provision_before["supplyed_demands_within_before"]
 
-        provision_after["supplyed_demands_within_after"] = provision_after["supplyed_demands_within"].copy()
+        provision_after["supplyed_demands_within_after"] = provision_after["supplyed_demands_within"]
 
         provision_after[
             "us_demands_within_after"
@@ -213,7 +227,7 @@ class ObjectNatCalculator:
 
         provision_after[
             "supplyed_demands_without_after"
-        ] = provision_after["supplyed_demands_within_after"] + provision_after["supplyed_demands_without"].copy()
+        ] = provision_after["supplyed_demands_within_after"] + provision_after["supplyed_demands_without"]
 
         provision_after[
             "us_demands_without_after"
@@ -222,16 +236,18 @@ class ObjectNatCalculator:
         effects = provision_after.merge(
             provision_before,
             how="outer",
-            on=["building_id"]
+            on=["building_id"],
+            indicator="in_after",
         )
+        effects["in_after"] = effects["in_after"] != "right_only"
         effects["geometry"] = effects.apply(
             lambda x: x["geometry_x"] if not pd.isna(x["geometry_x"]) else x["geometry_y"],
             axis=1
         )
         effects.drop(columns=["geometry_x", "geometry_y"], inplace=True)
         effects["demand"] = effects["demand_x"].fillna(0) + effects["demand_y"].fillna(0)
-        effects.drop("is_project_y", axis=1, inplace=True)
-        effects.rename(columns={"is_project_x": "is_project"}, inplace=True)
+        effects["is_project"] = effects["is_project_x"].eq(True)
+        effects.drop(["is_project_x", "is_project_y"], axis=1, inplace=True)
         effects = self._calculate_effects(effects)
         effects = effects[
             [
@@ -248,5 +264,83 @@ class ObjectNatCalculator:
         effects = gpd.GeoDataFrame(effects, geometry="geometry", crs=provision_before.crs)
         return effects
 
+    @staticmethod
+    def _get_changed_ids(
+            before: pd.DataFrame,
+            after: pd.DataFrame,
+            columns: list[str],
+    ) -> pd.Index:
+        """
+        Function finds objects with different attributes values before and after. Objects existing only before or
+        only after are changed
+        Args:
+            before (pd.DataFrame): objects before indexed by id
+            after (pd.DataFrame): objects after indexed by id
+            columns (list[str]): attributes to compare
+        Returns:
+            pd.Index: ids of changed objects
+        """
+
+        before = before.loc[~before.index.duplicated(), columns]
+        after = after.loc[~after.index.duplicated(), columns]
+        ids = before.index.union(after.index)
+        before = before.reindex(ids)
+        after = after.reindex(ids)
+        unchanged = ((before == after) | (before.isna() & after.isna())).all(axis=1).to_numpy()
+        return ids[~unchanged]
+
+    def get_delta(
+            self,
+            provision_before: dict[str, gpd.GeoDataFrame],
+            provision_after: dict[str, gpd.GeoDataFrame],
+            effects: gpd.GeoDataFrame,
+    ) -> dict:
+        """
+        Function filters provision and effects layers to buildings and services which provision changed and to
+        buildings with non zero effects
+        Args:
+            provision_before (dict[str, gpd.GeoDataFrame]): provision before with "buildings", "services" and "links"
+            provision_after (dict[str, gpd.GeoDataFrame]): provision after with "buildings", "services" and "links"
+            effects (gpd.GeoDataFrame): effects layer indexed by building id
+        Returns:
+            dict: filtered "before_prove_data", "after_prove_data", "effects" and "summary" with changed and
+            unchanged objects counts
+        """
+
+        changed_buildings = self._get_changed_ids(
+            provision_before["buildings"],
+            provision_after["buildings"],
+            ["demand", "supplyed_demands_within", "supplyed_demands_without"],
+        )
+        effect_ids = effects.index[(effects["absolute_total"] != 0) | (effects["absolute_within"] != 0)]
+        changed_buildings = changed_buildings.union(effect_ids)
+        changed_services = self._get_changed_ids(
+            provision_before["services"],
+            provision_after["services"],
+            ["capacity", "carried_capacity_within", "carried_capacity_without"],
+        )
+        result = {}
+        for name, provision in (("before_prove_data", provision_before), ("after_prove_data", provision_after)):
+            links = provision["links"]
+            result[name] = {
+                "buildings": provision["buildings"][provision["buildings"].index.isin(changed_buildings)],
+                "services": provision["services"][provision["services"].index.isin(changed_services)],
+                "links": links[
+                    links["building_index"].isin(changed_buildings) | links["service_index"].isin(changed_services)
+                ],
+            }
+        result["effects"] = effects[effects.index.isin(changed_buildings)]
+        buildings_total = len(effects)
+        services_total = len(provision_before["services"].index.union(provision_after["services"].index))
+        result["summary"] = {
+            "buildings_total": buildings_total,
+            "buildings_changed": len(result["effects"]),
+            "buildings_unchanged": buildings_total - len(result["effects"]),
+            "services_total": services_total,
+            "services_changed": len(changed_services),
+            "services_unchanged": services_total - len(changed_services),
+        }
+        return result
+
 
 objectnat_calculator = ObjectNatCalculator()
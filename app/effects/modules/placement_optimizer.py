@@ -0,0 +1,292 @@
+import heapq
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import geopandas as gpd
+import shapely
+from pyproj import CRS
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+from app.common.metrics.metrics import metrics
+from app.dependencies import get_config_value
+from .provision_solver import provision_solver
+
+
+class PlacementOptimizer:
+    """
+    Class ranks candidate locations of new service by marginal provision gain over cached scenario provision state.
+    Candidate gain is provision recalculated only for unsupplied buildings within candidate reach and services
+    competing for them, starting from demand and capacity left in scenario
+    """
+
+    def __init__(
+            self,
+            max_states: int = 8,
+            max_candidates: int = 20000,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            max_states (int): max number of scenario provision states stored in cache
+            max_candidates (int): max number of candidates ranked by one request
+        Returns:
+            None
+        """
+
+        self.max_states = max_states
+        self.max_candidates = max_candidates
+        self._states: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_state(
+            self,
+            key: str,
+    ) -> dict | None:
+        """
+        Function returns cached scenario provision state
+        Args:
+            key (str): state key
+        Returns:
+            dict | None: provision state, None if it is not cached
+        """
+
+        with self._lock:
+            if state := self._states.get(key):
+                self._states.move_to_end(key)
+                metrics.increment("placement_state_cache.hit")
+                return state
+        metrics.increment("placement_state_cache.miss")
+        return None
+
+    def set_state(
+            self,
+            key: str,
+            project_id: int,
+            buildings: gpd.GeoDataFrame,
+            matrix: np.ndarray,
+            capacity: np.ndarray,
+            destination: np.ndarray,
+            max_distance: float,
+            threshold: int,
+    ) -> dict:
+        """
+        Function caches scenario provision state. Only buildings with unsupplied demand and their distances to services
+        within triple threshold are kept, distances are stored in sparse matrix shifted by 1 as by prepare_matrix
+        Args:
+            key (str): state key
+            project_id (int): project id of scenario
+            buildings (gpd.GeoDataFrame): scenario buildings with demands in projected crs
+            matrix (np.ndarray): scenario availability matrix with buildings rows and services columns
+            capacity (np.ndarray): scenario services capacities
+            destination (np.ndarray): scenario flows from services rows to buildings columns
+            max_distance (float): max distance between building and service
+            threshold (int): provision threshold
+        Returns:
+            dict: provision state
+        """
+
+        demand_left = buildings["demand"].to_numpy() - destination.sum(axis=0).astype(np.int64)
+        unsupplied = demand_left > 0
+        points = shapely.get_coordinates(np.asarray(buildings.geometry.centroid.values))[unsupplied]
+        distances = matrix[unsupplied]
+        rows, columns = np.nonzero(distances <= threshold * 3)
+        state = {
+            "project_id": project_id,
+            "crs": buildings.crs,
+            "tree": cKDTree(points),
+            "demand_left": demand_left[unsupplied],
+            "capacity_left": capacity - destination.sum(axis=1).astype(np.int64),
+            "distances": csr_matrix(
+                (distances[rows, columns] + 1, (rows, columns)), shape=distances.shape, dtype=np.float32
+            ),
+            "max_distance": max_distance,
+            "threshold": threshold,
+        }
+        with self._lock:
+            self._states[key] = state
+            self._states.move_to_end(key)
+            while len(self._states) > self.max_states:
+                self._states.popitem(last=False)
+        return state
+
+    def invalidate_project(
+            self,
+            project_id: int,
+    ) -> int:
+        """
+        Function deletes cached provision states of project
+        Args:
+            project_id (int): project id
+        Returns:
+            int: number of deleted states
+        """
+
+        with self._lock:
+            keys = [key for key, state in self._states.items() if state["project_id"] == project_id]
+            for key in keys:
+                del self._states[key]
+            return len(keys)
+
+    @staticmethod
+    def get_grid(
+            territory: gpd.GeoDataFrame,
+            crs: CRS,
+            step: float,
+    ) -> np.ndarray:
+        """
+        Function generates regular grid of candidates inside territory
+        Args:
+            territory (gpd.GeoDataFrame): territory layer
+            crs (CRS): projected crs of grid
+            step (float): grid step in meters
+        Returns:
+            np.ndarray: candidates coordinates with shape (n, 2)
+        """
+
+        territory = shapely.union_all(np.asarray(territory.to_crs(crs).geometry.values))
+        min_x, min_y, max_x, max_y = territory.bounds
+        x, y = np.meshgrid(np.arange(min_x + step / 2, max_x, step), np.arange(min_y + step / 2, max_y, step))
+        x, y = x.ravel(), y.ravel()
+        inside = shapely.contains_xy(territory, x, y)
+        return np.column_stack((x[inside], y[inside]))
+
+    @staticmethod
+    def _get_provision_gain(
+            state: dict,
+            buildings: np.ndarray,
+            distances: np.ndarray,
+            capacity: int,
+    ) -> tuple[int, int]:
+        """
+        Function recalculates provision of unsupplied buildings within candidate reach with and without new service.
+        Only services competing for these buildings take part, with capacity left in scenario
+        Args:
+            state (dict): scenario provision state
+            buildings (np.ndarray): state buildings within candidate reach
+            distances (np.ndarray): straight line distances from candidate to buildings
+            capacity (int): new service capacity
+        Returns:
+            tuple[int, int]: gains of supplied demand in total and within threshold
+        Raises:
+            504, http exception request deadline exceeded
+        """
+
+        reached = state["distances"][buildings]
+        services = np.unique(reached.indices)
+        reached = reached[:, services].tocoo()
+        matrix = np.full((len(buildings), len(services) + 1), np.inf, dtype=np.float32)
+        matrix[reached.row, reached.col] = reached.data - 1
+        matrix[:, -1] = distances
+        demand = state["demand_left"][buildings]
+        before = provision_solver.distribute(
+            distances=provision_solver.prepare_matrix(matrix[:, :-1], state["threshold"]),
+            demand=demand,
+            capacity=state["capacity_left"][services],
+            threshold=state["threshold"],
+        )
+        after = provision_solver.distribute(
+            distances=provision_solver.prepare_matrix(matrix, state["threshold"]),
+            demand=demand,
+            capacity=np.append(state["capacity_left"][services], capacity),
+            threshold=state["threshold"],
+        )
+        within = matrix.T <= state["threshold"]
+        return (
+            int(after.sum() - before.sum()),
+            int((after * within).sum() - (before * within[:-1]).sum()),
+        )
+
+    @classmethod
+    def rank(
+            cls,
+            state: dict,
+            candidates: np.ndarray,
+            capacity: int,
+            top: int,
+    ) -> gpd.GeoDataFrame:
+        """
+        Function finds unsupplied buildings within reach of all candidates by one kd-tree query and scores candidates
+        by provision gain. Gain can not exceed reachable demand and capacity of new and competing services, so
+        candidates are scored in descending order of this bound until it is below gain of top candidates, the rest
+        are not returned
+        Args:
+            state (dict): scenario provision state
+            candidates (np.ndarray): candidates coordinates in state crs with shape (n, 2)
+            capacity (int): new service capacity
+            top (int): number of best candidates to return
+        Returns:
+            gpd.GeoDataFrame: best candidates with "rank", "supplied_gain", "within_gain", "reachable_demand",
+            "reachable_buildings" and "mean_distance" in state crs
+        Raises:
+            504, http exception request deadline exceeded
+        """
+
+        pairs = cKDTree(candidates).sparse_distance_matrix(
+            other=state["tree"],
+            max_distance=state["max_distance"],
+            output_type="ndarray",
+        )
+        pairs = pairs[pairs["v"] != 0]
+        pairs = pairs[np.argsort(pairs["i"], kind="stable")]
+        bounds = np.searchsorted(pairs["i"], np.arange(len(candidates) + 1))
+        demands = state["demand_left"][pairs["j"]].astype(np.float64)
+        size = len(candidates)
+        reachable_demand = np.bincount(pairs["i"], weights=demands, minlength=size)
+        distance_sum = np.bincount(pairs["i"], weights=demands * pairs["v"], minlength=size)
+        mean_distance = np.full(size, np.inf)
+        np.divide(distance_sum, reachable_demand, out=mean_distance, where=reachable_demand > 0)
+        # services competing for buildings within reach of each candidate, as candidate * services_n + service
+        indptr, services_n = state["distances"].indptr, state["distances"].shape[1]
+        counts = indptr[pairs["j"] + 1] - indptr[pairs["j"]]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        services = state["distances"].indices[np.repeat(indptr[pairs["j"]], counts) + offsets]
+        competing = np.unique(np.repeat(pairs["i"].astype(np.int64), counts) * services_n + services)
+        competing_capacity = np.bincount(
+            competing // services_n,
+            weights=np.maximum(state["capacity_left"][competing % services_n], 0),
+            minlength=size,
+        )
+        max_gain = np.minimum(reachable_demand, capacity + competing_capacity)
+        supplied_gain = np.zeros(size, dtype=np.int64)
+        within_gain = np.zeros(size, dtype=np.int64)
+        scored = np.zeros(size, dtype=bool)
+        top_keys: list[tuple[int, int, float]] = []
+        for candidate in np.lexsort((mean_distance, -max_gain)):
+            max_key = (max_gain[candidate], max_gain[candidate], -mean_distance[candidate])
+            if len(top_keys) == top and max_key < top_keys[0]:
+                break
+            if reachable_demand[candidate] > 0:
+                candidate_pairs = pairs[bounds[candidate]:bounds[candidate + 1]]
+                supplied_gain[candidate], within_gain[candidate] = cls._get_provision_gain(
+                    state, candidate_pairs["j"], candidate_pairs["v"], capacity
+                )
+            scored[candidate] = True
+            key = (supplied_gain[candidate], within_gain[candidate], -mean_distance[candidate])
+            if len(top_keys) < top:
+                heapq.heappush(top_keys, key)
+            else:
+                heapq.heappushpop(top_keys, key)
+        scored = np.flatnonzero(scored)
+        order = scored[np.lexsort((mean_distance[scored], -within_gain[scored], -supplied_gain[scored]))][:top]
+        metrics.increment("placement_optimizer.candidates", size)
+        metrics.increment("placement_optimizer.scored", int((reachable_demand[scored] > 0).sum()))
+        return gpd.GeoDataFrame(
+            {
+                "rank": np.arange(1, len(order) + 1),
+                "supplied_gain": supplied_gain[order],
+                "within_gain": within_gain[order],
+                "reachable_demand": reachable_demand[order],
+                "reachable_buildings": np.diff(bounds)[order],
+                "mean_distance": np.where(np.isinf(mean_distance[order]), np.nan, mean_distance[order]).round(2),
+            },
+            geometry=shapely.points(candidates[order]),
+            crs=state["crs"],
+        )
+
+
+placement_optimizer = PlacementOptimizer(
+    max_states=int(get_config_value("PLACEMENT_STATES_CACHE_SIZE", "8")),
+    max_candidates=int(get_config_value("PLACEMENT_MAX_CANDIDATES", "20000")),
+)
@@ -0,0 +1,182 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from app.common.metrics.metrics import metrics
+from app.dependencies import urban_api_handler, get_config_value
+
+
+class PopulationLoader:
+    """
+    Class loads territories population from urban_api with bounded concurrency and caches values per territory in
+    bounded cache, so values from bulk and single territory requests are cached the same way
+    """
+
+    def __init__(
+            self,
+            concurrency: int = 16,
+            ttl: int = 3600,
+            max_entries: int = 100000,
+            bulk_endpoint: str | None = None,
+            bulk_size: int = 100,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            concurrency (int): max number of simultaneous requests to urban_api
+            ttl (int): territory population lifetime in cache in seconds
+            max_entries (int): max number of cached territories, the least recently used ones are dropped
+            bulk_endpoint (str | None): urban_api endpoint returning population of several territories passed as
+            comma separated "territories_ids" param, defaults to None (territories are requested one by one)
+            bulk_size (int): max number of territories in one bulk request
+        Returns:
+            None
+        """
+
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bulk_endpoint = bulk_endpoint
+        self.bulk_size = bulk_size
+        self._semaphore: asyncio.Semaphore | None = None
+        self._values: OrderedDict[int, tuple[int, float]] = OrderedDict()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """
+        Function returns requests semaphore, it is created in running event loop on first use
+        Returns:
+            asyncio.Semaphore: requests semaphore
+        """
+
+        if not self._semaphore:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    def _get_cached(
+            self,
+            territory_id: int,
+            now: float,
+    ) -> int | None:
+        """
+        Function returns cached territory population
+        Args:
+            territory_id (int): territory id
+            now (float): current monotonic time
+        Returns:
+            int | None: population, None if it is not cached or expired
+        """
+
+        if not (cached := self._values.get(territory_id)):
+            return None
+        if cached[1] <= now:
+            del self._values[territory_id]
+            return None
+        self._values.move_to_end(territory_id)
+        return cached[0]
+
+    def _set_cached(
+            self,
+            territory_id: int,
+            value: int,
+            expires_at: float,
+    ) -> None:
+        self._values[territory_id] = (value, expires_at)
+        self._values.move_to_end(territory_id)
+        while len(self._values) > self.max_entries:
+            self._values.popitem(last=False)
+
+    async def _load_territory(
+            self,
+            territory_id: int,
+    ) -> int:
+        """
+        Function loads territory population and stores it in cache
+        Args:
+            territory_id (int): territory id
+        Returns:
+            int: population
+        """
+
+        async with self._get_semaphore():
+            response = await urban_api_handler.get(
+                endpoint_url=f"/api/v1/territory/{territory_id}/indicator_values",
+                params={
+                    "indicator_ids": 1
+                }
+            )
+        self._set_cached(territory_id, response[0]["value"], time.monotonic() + self.ttl)
+        return response[0]["value"]
+
+    async def _load_bulk(
+            self,
+            territory_ids: list[int],
+    ) -> dict[int, int]:
+        """
+        Function loads population of several territories by one request and stores it in cache
+        Args:
+            territory_ids (list[int]): territory ids
+        Returns:
+            dict[int, int]: population by territory id, territories missing in response are skipped
+        """
+
+        async with self._get_semaphore():
+            response = await urban_api_handler.get(
+                endpoint_url=self.bulk_endpoint,
+                params={
+                    "indicator_ids": 1,
+                    "territories_ids": ",".join(str(territory_id) for territory_id in territory_ids),
+                }
+            )
+        expires_at = time.monotonic() + self.ttl
+        values = {}
+        for item in response:
+            territory_id = item["territory"]["id"]
+            if territory_id in territory_ids and territory_id not in values:
+                values[territory_id] = item["value"]
+                self._set_cached(territory_id, item["value"], expires_at)
+        metrics.increment("population_loader.bulk_requests")
+        return values
+
+    async def get_population(
+            self,
+            territory_ids: list[int],
+    ) -> int:
+        """
+        Function returns total population of territories. Missing or expired territories are loaded from urban_api,
+        by bulk requests if bulk endpoint is set and one by one for the rest
+        Args:
+            territory_ids (list[int]): territory ids
+        Returns:
+            int: total population
+        """
+
+        now = time.monotonic()
+        values = {}
+        missing_ids = []
+        for territory_id in dict.fromkeys(territory_ids):
+            if (value := self._get_cached(territory_id, now)) is not None:
+                values[territory_id] = value
+            else:
+                missing_ids.append(territory_id)
+        metrics.increment("population_loader.hit", len(values))
+        metrics.increment("population_loader.miss", len(missing_ids))
+        if missing_ids and self.bulk_endpoint:
+            for bulk_values in await asyncio.gather(*[
+                self._load_bulk(missing_ids[i:i + self.bulk_size])
+                for i in range(0, len(missing_ids), self.bulk_size)
+            ]):
+                values |= bulk_values
+            missing_ids = [territory_id for territory_id in missing_ids if territory_id not in values]
+        loaded = await asyncio.gather(*[self._load_territory(territory_id) for territory_id in missing_ids])
+        values |= dict(zip(missing_ids, loaded))
+        # values are summed from loaded ones, cache can be changed by concurrent calls while they are loaded
+        return sum(values[territory_id] for territory_id in territory_ids)
+
+
+population_loader = PopulationLoader(
+    concurrency=int(get_config_value("POPULATION_FETCH_CONCURRENCY", "16")),
+    ttl=int(get_config_value("POPULATION_CACHE_TTL", "3600")),
+    max_entries=int(get_config_value("POPULATION_CACHE_SIZE", "100000")),
+    bulk_endpoint=get_config_value("POPULATION_BULK_ENDPOINT"),
+    bulk_size=int(get_config_value("POPULATION_BULK_SIZE", "100")),
+)
@@ -0,0 +1,118 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+import geopandas as gpd
+
+from app.common.metrics.metrics import metrics
+from app.dependencies import get_config_value
+
+
+class ProjectGeometryService:
+    """
+    Class caches prepared project territory and context buildings spatial index per project
+    """
+
+    def __init__(self, max_projects: int = 16) -> None:
+        """Initialisation function
+
+        Args:
+            max_projects (int): max number of projects stored in cache
+        Returns:
+            None
+        """
+
+        self.max_projects = max_projects
+        self._projects: OrderedDict[int, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_layer_digest(
+            geometries: np.ndarray,
+            ids: np.ndarray,
+    ) -> str:
+        """
+        Function calculates layer identity digest by objects ids and bounds
+        Args:
+            geometries (np.ndarray): layer geometries
+            ids (np.ndarray): layer objects ids
+        Returns:
+            str: layer digest
+        """
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+        digest.update(np.ascontiguousarray(shapely.bounds(geometries)).tobytes())
+        return digest.hexdigest()
+
+    def get_excluded_building_ids(
+            self,
+            project_id: int,
+            project_territory: gpd.GeoDataFrame,
+            context_buildings: gpd.GeoDataFrame,
+    ) -> np.ndarray:
+        """
+        Function returns ids of context buildings intersecting project territory. Result, prepared territory and
+        buildings spatial index are cached per project and reused while territory and context layer are unchanged
+        Args:
+            project_id (int): project id
+            project_territory (gpd.GeoDataFrame): project territory layer in the same crs as buildings
+            context_buildings (gpd.GeoDataFrame): context buildings layer with "building_id" attribute
+        Returns:
+            np.ndarray: ids of buildings to exclude from context
+        """
+
+        if context_buildings.empty:
+            return np.array([], dtype=np.int64)
+        geometries = np.asarray(context_buildings.geometry.values)
+        ids = context_buildings["building_id"].to_numpy()
+        territory = shapely.union_all(np.asarray(project_territory.geometry.values))
+        territory_digest = hashlib.blake2b(shapely.to_wkb(territory), digest_size=16).hexdigest()
+        layer_digest = self._get_layer_digest(geometries, ids)
+        with self._lock:
+            cached = self._projects.get(project_id)
+            if cached and cached["territory_digest"] == territory_digest and cached["layer_digest"] == layer_digest:
+                self._projects.move_to_end(project_id)
+                metrics.increment("project_geometry_cache.hit")
+                return cached["excluded_ids"]
+        metrics.increment("project_geometry_cache.miss")
+        if cached and cached["territory_digest"] == territory_digest:
+            territory = cached["territory"]
+        else:
+            shapely.prepare(territory)
+        if cached and cached["layer_digest"] == layer_digest:
+            tree = cached["tree"]
+        else:
+            tree = shapely.STRtree(geometries)
+        excluded_ids = ids[tree.query(territory, predicate="intersects")]
+        with self._lock:
+            self._projects[project_id] = {
+                "territory_digest": territory_digest,
+                "territory": territory,
+                "layer_digest": layer_digest,
+                "tree": tree,
+                "excluded_ids": excluded_ids,
+            }
+            self._projects.move_to_end(project_id)
+            while len(self._projects) > self.max_projects:
+                self._projects.popitem(last=False)
+        return excluded_ids
+
+    def invalidate_project(self, project_id: int) -> int:
+        """
+        Function deletes cached project geometries
+        Args:
+            project_id (int): project id
+        Returns:
+            int: number of deleted entries
+        """
+
+        with self._lock:
+            return int(self._projects.pop(project_id, None) is not None)
+
+
+project_geometry_service = ProjectGeometryService(
+    max_projects=int(get_config_value("PROJECT_GEOMETRY_CACHE_SIZE", "16")),
+)
@@ -0,0 +1,228 @@
+import threading
+
+import numpy as np
+
+from app.common.deadline.deadline import request_deadline
+
+
+class ProvisionSolver:
+    """
+    Class calculates buildings provision by availability matrix with the same distribution model as objectnat
+    get_service_provision, but over numpy arrays. Only buildings supplied demands are calculated, so it is used when
+    many services capacities variants are solved over one matrix
+    """
+
+    def __init__(self) -> None:
+        """Initialisation function
+
+        Returns:
+            None
+        """
+
+        self._uniforms = np.empty(0)
+        self._lock = threading.Lock()
+
+    def _get_uniforms(
+            self,
+            size: int,
+    ) -> np.ndarray:
+        """
+        Function returns first uniform samples of generator with seed 0. objectnat draws flows by new generator with
+        seed 0 for each object, so all draws are prefixes of one stream
+        Args:
+            size (int): number of samples
+        Returns:
+            np.ndarray: uniform samples
+        """
+
+        with self._lock:
+            if len(self._uniforms) < size:
+                self._uniforms = np.random.default_rng(seed=0).random(max(size, 2 * len(self._uniforms), 1024))
+            return self._uniforms[:size]
+
+    def _choose(
+            self,
+            p: np.ndarray,
+            size: int,
+    ) -> np.ndarray:
+        """
+        Function draws objects by probabilities as numpy Generator.choice with seed 0 does and counts draws
+        Args:
+            p (np.ndarray): objects probabilities
+            size (int): number of draws
+        Returns:
+            np.ndarray: number of draws of each object
+        """
+
+        cdf = p.astype(np.float64).cumsum()
+        cdf /= cdf[-1]
+        return np.bincount(cdf.searchsorted(self._get_uniforms(size), side="right"), minlength=len(p))
+
+    @staticmethod
+    def prepare_matrix(
+            matrix: np.ndarray,
+            threshold: int,
+    ) -> np.ndarray:
+        """
+        Function prepares distances matrix for solving: transposes it to services rows, replaces distances over triple
+        threshold with infinity and shifts distances by 1
+        Args:
+            matrix (np.ndarray): availability matrix with buildings rows and services columns
+            threshold (int): provision threshold
+        Returns:
+            np.ndarray: prepared distances matrix with services rows and buildings columns
+        """
+
+        distances = matrix.T
+        return np.where(distances <= threshold * 3, distances, np.inf).astype(distances.dtype) + 1
+
+    def _get_flows(
+            self,
+            distances: np.ndarray,
+            capacity_left: np.ndarray,
+            selection_range: float,
+            best_houses: float,
+    ) -> np.ndarray:
+        """
+        Function distributes services capacity left to the nearest buildings
+        Args:
+            distances (np.ndarray): prepared distances of active services and buildings
+            capacity_left (np.ndarray): active services capacity left
+            selection_range (float): max distance of buildings receiving capacity
+            best_houses (float): probabilities quantile of buildings receiving capacity
+        Returns:
+            np.ndarray: flows from active services to active buildings
+        """
+
+        flows = np.zeros(distances.shape)
+        for row, capacity in enumerate(capacity_left):
+            columns = np.flatnonzero(distances[row] <= selection_range)
+            if not len(columns):
+                continue
+            distance = distances[row, columns]
+            p = 1 / distance / distance
+            p = p / p.sum()
+            selected = p >= np.percentile(p, best_houses * 100)
+            p = p[selected]
+            p = p / p.sum()
+            if p.sum() == 0:
+                flows[row, columns] = distance
+                continue
+            flows[row, columns[selected]] = self._choose(p, int(capacity))
+        return flows
+
+    def _balance_flows(
+            self,
+            flows: np.ndarray,
+            demand_left: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Function limits flows to buildings by demand left
+        Args:
+            flows (np.ndarray): flows from active services to active buildings
+            demand_left (np.ndarray): active buildings demand left
+        Returns:
+            np.ndarray: balanced flows
+        """
+
+        balanced = np.zeros(flows.shape)
+        for column, demand in enumerate(demand_left):
+            rows = np.flatnonzero(flows[:, column] > 0)
+            if not len(rows):
+                continue
+            flow = flows[rows, column]
+            balanced[rows, column] = np.minimum(flow, self._choose(flow / flow.sum(), int(demand)))
+        return balanced
+
+    def distribute(
+            self,
+            distances: np.ndarray,
+            demand: np.ndarray,
+            capacity: np.ndarray,
+            threshold: int,
+    ) -> np.ndarray:
+        """
+        Function distributes services capacities to buildings demands
+        Args:
+            distances (np.ndarray): matrix prepared by prepare_matrix
+            demand (np.ndarray): buildings demands
+            capacity (np.ndarray): services capacities
+            threshold (int): provision threshold
+        Returns:
+            np.ndarray: flows from services rows to buildings columns
+        Raises:
+            504, http exception request deadline exceeded
+        """
+
+        destination = np.zeros(distances.shape)
+        capacity_left = capacity.copy()
+        demand_left = demand.copy()
+        rows = np.arange(distances.shape[0])
+        columns = np.arange(distances.shape[1])
+
+        def drop_finished(rows: np.ndarray, columns: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+            rows = rows[capacity_left[rows] != 0]
+            columns = columns[demand_left[columns] != 0]
+            rows = rows[~np.isinf(distances[np.ix_(rows, columns)]).all(axis=1)]
+            columns = columns[~np.isinf(distances[np.ix_(rows, columns)]).all(axis=0)]
+            return rows, columns
+
+        rows, columns = drop_finished(rows, columns)
+        selection_range = (threshold + 1) / 2
+        best_houses = 0.9
+        while len(columns) > 0 and len(rows) > 0:
+            request_deadline.check("provision")
+            objects_n = len(rows) + len(columns)
+            active_distances = distances[np.ix_(rows, columns)]
+            flows = self._get_flows(active_distances, capacity_left[rows], selection_range, best_houses)
+            balanced_flows = self._balance_flows(flows, demand_left[columns])
+            if (
+                    not balanced_flows.any()
+                    and (best_houses == 0 or best_houses > 0.1)
+                    and selection_range >= active_distances[np.isfinite(active_distances)].max()
+            ):
+                # next iterations repeat the same draws, objectnat never finishes in this case
+                break
+            destination[np.ix_(rows, columns)] += balanced_flows
+            capacity_left = capacity - destination.sum(axis=1).astype(int)
+            demand_left = demand - destination.sum(axis=0).astype(int)
+            rows, columns = drop_finished(rows, columns)
+            selection_range *= 1.5
+            if best_houses <= 0.1:
+                best_houses = 0
+            else:
+                best_houses = (len(rows) + len(columns)) / (objects_n / best_houses)
+
+        return destination
+
+    def solve(
+            self,
+            matrix: np.ndarray,
+            distances: np.ndarray,
+            demand: np.ndarray,
+            capacity: np.ndarray,
+            threshold: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Function calculates buildings demands supplied within and without threshold
+        Args:
+            matrix (np.ndarray): availability matrix with buildings rows and services columns
+            distances (np.ndarray): matrix prepared by prepare_matrix
+            demand (np.ndarray): buildings demands
+            capacity (np.ndarray): services capacities
+            threshold (int): provision threshold
+        Returns:
+            tuple[np.ndarray, np.ndarray]: buildings demands supplied within and without threshold
+        Raises:
+            504, http exception request deadline exceeded
+        """
+
+        destination = self.distribute(distances, demand, capacity, threshold)
+        within = matrix.T <= threshold
+        return (
+            (destination * within).sum(axis=0).astype(np.uint16),
+            (destination * ~within).sum(axis=0).astype(np.uint16),
+        )
+
+
+provision_solver = ProvisionSolver()
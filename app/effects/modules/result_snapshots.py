@@ -0,0 +1,220 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+from loguru import logger
+
+from app.common.metrics.metrics import metrics
+from app.dependencies import get_config_value
+
+
+class ResultSnapshots:
+    """
+    Class stores effects calculation results prepared in advance by precompute job on disk as gzip compressed json by
+    project, so they are shared by all workers. Snapshots are not revalidated against urban_api, so they are written
+    only by precompute job and expire soon. Stored json is response body, so compressed snapshot can be sent to client
+    as is
+    """
+
+    encoding = "gzip"
+
+    def __init__(
+            self,
+            directory: str | None = None,
+            ttl: int = 3600,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            directory (str | None): snapshots directory, defaults to None (snapshots are disabled)
+            ttl (int): snapshot lifetime in seconds, 0 means snapshots never expire
+        Returns:
+            None
+        """
+
+        self.directory = Path(directory) if directory else None
+        self.ttl = ttl
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def _get_path(
+            self,
+            key: str,
+            project_id: int,
+    ) -> Path:
+        """
+        Function returns snapshot file path
+        Args:
+            key (str): result key
+            project_id (int): project id of result
+        Returns:
+            Path: snapshot path
+        """
+
+        return self.directory / str(project_id) / f"{hashlib.sha1(key.encode()).hexdigest()}.response.json.gz"
+
+    def _is_fresh(
+            self,
+            path: Path,
+    ) -> bool:
+        """
+        Function checks whether snapshot file exists and is not expired
+        Args:
+            path (Path): snapshot path
+        Returns:
+            bool: True if snapshot is fresh
+        """
+
+        try:
+            modified = path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        return not self.ttl or time.time() - modified < self.ttl
+
+    def has(
+            self,
+            key: str,
+            project_id: int,
+    ) -> bool:
+        """
+        Function checks whether fresh snapshot of result exists
+        Args:
+            key (str): result key
+            project_id (int): project id of result
+        Returns:
+            bool: True if snapshot exists and is not expired
+        """
+
+        return self.enabled and self._is_fresh(self._get_path(key, project_id))
+
+    def get(
+            self,
+            key: str,
+            project_id: int,
+    ) -> dict | None:
+        """
+        Function reads stored result
+        Args:
+            key (str): result key
+            project_id (int): project id of result
+        Returns:
+            dict | None: stored result, None if snapshot doesn't exist, is expired or can't be read
+        """
+
+        if not self.has(key, project_id):
+            if self.enabled:
+                metrics.increment("result_snapshots.miss")
+            return None
+        try:
+            with gzip.open(self._get_path(key, project_id), "rt", encoding="utf-8") as snapshot:
+                result = json.load(snapshot)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read result snapshot of project {project_id}: {e}")
+            metrics.increment("result_snapshots.miss")
+            return None
+        metrics.increment("result_snapshots.hit")
+        return result
+
+    def get_compressed(
+            self,
+            key: str,
+            project_id: int,
+    ) -> bytes | None:
+        """
+        Function reads stored result without decompression
+        Args:
+            key (str): result key
+            project_id (int): project id of result
+        Returns:
+            bytes | None: gzip compressed result json, None if snapshot doesn't exist, is expired or can't be read
+        """
+
+        if not self.has(key, project_id):
+            if self.enabled:
+                metrics.increment("result_snapshots.miss")
+            return None
+        try:
+            body = self._get_path(key, project_id).read_bytes()
+        except OSError as e:
+            logger.warning(f"Failed to read result snapshot of project {project_id}: {e}")
+            metrics.increment("result_snapshots.miss")
+            return None
+        metrics.increment("result_snapshots.hit")
+        metrics.increment("result_snapshots.compressed_hit")
+        return body
+
+    def set(
+            self,
+            key: str,
+            project_id: int,
+            body: str,
+    ) -> None:
+        """
+        Function stores result and deletes expired snapshots. Snapshot is written to temporary file and renamed, so
+        readers never see partial file
+        Args:
+            key (str): result key
+            project_id (int): project id of result
+            body (str): result json as it is sent in response
+        Returns:
+            None
+        """
+
+        if not self.enabled:
+            return
+        path = self._get_path(key, project_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as snapshot:
+            snapshot.write(body)
+        os.replace(tmp_path, path)
+        metrics.increment("result_snapshots.stored")
+        self.purge_expired()
+
+    def purge_expired(self) -> int:
+        """
+        Function deletes expired snapshots of all projects
+        Returns:
+            int: number of deleted snapshots
+        """
+
+        if not self.enabled or not self.ttl:
+            return 0
+        deleted = 0
+        for path in self.directory.glob("*/*.response.json.gz"):
+            if not self._is_fresh(path):
+                path.unlink(missing_ok=True)
+                deleted += 1
+        if deleted:
+            metrics.increment("result_snapshots.expired", deleted)
+        return deleted
+
+    def invalidate_project(self, project_id: int) -> int:
+        """
+        Function deletes all stored results of project
+        Args:
+            project_id (int): project id
+        Returns:
+            int: number of deleted snapshots
+        """
+
+        if not self.enabled:
+            return 0
+        project_directory = self.directory / str(project_id)
+        if not project_directory.exists():
+            return 0
+        deleted = len(list(project_directory.glob("*.json.gz")))
+        shutil.rmtree(project_directory, ignore_errors=True)
+        return deleted
+
+
+result_snapshots = ResultSnapshots(
+    directory=get_config_value("SNAPSHOTS_DIR"),
+    ttl=int(get_config_value("SNAPSHOTS_TTL", "3600")),
+)
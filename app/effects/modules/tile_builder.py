@@ -0,0 +1,318 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import mapbox_vector_tile
+
+from app.common.metrics.metrics import metrics
+from app.dependencies import get_config_value
+
+WEB_MERCATOR_HALF_SIZE = 20037508.342789244
+
+
+class TileSet:
+    """
+    Class stores result layers prepared for tiling: geometries in web mercator, spatial index over them and
+    geometries simplified for each requested zoom
+    """
+
+    def __init__(
+            self,
+            project_id: int,
+            layers: dict[str, gpd.GeoDataFrame],
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            project_id (int): project id of result
+            layers (dict[str, gpd.GeoDataFrame]): result layers by name
+        Returns:
+            None
+        """
+
+        self.project_id = project_id
+        self._source_layers = layers
+        self._layers: dict[str, dict] | None = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _prepare_layer(
+            layer: gpd.GeoDataFrame,
+    ) -> dict:
+        """
+        Function reprojects layer to web mercator and builds spatial index over it
+        Args:
+            layer (gpd.GeoDataFrame): result layer
+        Returns:
+            dict: layer "geometries", "tree", "properties" and "simplified" geometries by zoom
+        """
+
+        geometries = np.asarray(layer.geometry.to_crs(3857).values)
+        properties = layer.drop(columns=layer.geometry.name).reset_index()
+        properties = properties.select_dtypes(include=["number", "bool"])
+        return {
+            "geometries": geometries,
+            "tree": shapely.STRtree(geometries),
+            "properties": properties,
+            "simplified": {},
+        }
+
+    def get_layer(
+            self,
+            name: str,
+    ) -> dict | None:
+        """
+        Function returns prepared layer, layers are prepared on first call
+        Args:
+            name (str): layer name
+        Returns:
+            dict | None: prepared layer, None if result has no such layer
+        """
+
+        with self._lock:
+            if self._layers is None:
+                self._layers = {
+                    layer_name: self._prepare_layer(layer) for layer_name, layer in self._source_layers.items()
+                }
+                self._source_layers = {}
+            return self._layers.get(name)
+
+    @property
+    def layer_names(self) -> list[str]:
+        """
+        Function returns names of result layers
+        Returns:
+            list[str]: layer names
+        """
+
+        with self._lock:
+            return list(self._layers if self._layers is not None else self._source_layers)
+
+
+class TileBuilder:
+    """
+    Class builds Mapbox Vector Tiles from cached calculation results and caches encoded tiles
+    """
+
+    def __init__(
+            self,
+            max_results: int = 8,
+            max_tiles: int = 4096,
+            extent: int = 4096,
+            buffer: int = 64,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            max_results (int): max number of results stored for tiling
+            max_tiles (int): max number of encoded tiles stored in cache
+            extent (int): tile extent in tile coordinates
+            buffer (int): tile buffer in tile coordinates, geometries are clipped by tile bounds with buffer
+        Returns:
+            None
+        """
+
+        self.max_results = max_results
+        self.max_tiles = max_tiles
+        self.extent = extent
+        self.buffer = buffer
+        self._results: OrderedDict[str, TileSet] = OrderedDict()
+        self._tiles: OrderedDict[tuple, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_tile_bounds(
+            z: int,
+            x: int,
+            y: int,
+    ) -> tuple[float, float, float, float]:
+        """
+        Function calculates tile bounds in web mercator
+        Args:
+            z (int): zoom
+            x (int): tile column
+            y (int): tile row from the top
+        Returns:
+            tuple[float, float, float, float]: tile bounds
+        """
+
+        size = 2 * WEB_MERCATOR_HALF_SIZE / 2 ** z
+        min_x = -WEB_MERCATOR_HALF_SIZE + x * size
+        max_y = WEB_MERCATOR_HALF_SIZE - y * size
+        return min_x, max_y - size, min_x + size, max_y
+
+    def set_result(
+            self,
+            key: str,
+            project_id: int,
+            layers: dict[str, gpd.GeoDataFrame],
+    ) -> None:
+        """
+        Function stores calculation result layers for tiling and drops tiles of previous result with the same key
+        Args:
+            key (str): result key
+            project_id (int): project id of result
+            layers (dict[str, gpd.GeoDataFrame]): result layers by name
+        Returns:
+            None
+        """
+
+        with self._lock:
+            self._results[key] = TileSet(project_id, layers)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+            for tile_key in [tile_key for tile_key in self._tiles if tile_key[0] == key]:
+                del self._tiles[tile_key]
+
+    def has_result(self, key: str) -> bool:
+        """
+        Function checks if calculation result is stored for tiling
+        Args:
+            key (str): result key
+        Returns:
+            bool: True if result is stored
+        """
+
+        with self._lock:
+            return key in self._results
+
+    def _get_zoom_geometries(
+            self,
+            layer: dict,
+            z: int,
+    ) -> np.ndarray:
+        """
+        Function returns layer geometries simplified with tolerance of tile coordinate unit at zoom
+        Args:
+            layer (dict): prepared layer
+            z (int): zoom
+        Returns:
+            np.ndarray: simplified geometries
+        """
+
+        if (geometries := layer["simplified"].get(z)) is None:
+            tolerance = 2 * WEB_MERCATOR_HALF_SIZE / 2 ** z / self.extent
+            geometries = shapely.simplify(layer["geometries"], tolerance, preserve_topology=True)
+            layer["simplified"][z] = geometries
+        return geometries
+
+    def _encode_layer(
+            self,
+            name: str,
+            layer: dict,
+            z: int,
+            bounds: tuple[float, float, float, float],
+    ) -> dict | None:
+        """
+        Function selects layer features intersecting tile and clips them by tile bounds with buffer
+        Args:
+            name (str): layer name
+            layer (dict): prepared layer
+            z (int): zoom
+            bounds (tuple[float, float, float, float]): tile bounds in web mercator
+        Returns:
+            dict | None: layer for mapbox_vector_tile encoder, None if tile has no layer features
+        """
+
+        buffer = (bounds[2] - bounds[0]) * self.buffer / self.extent
+        indexes = layer["tree"].query(shapely.box(*bounds).buffer(buffer, join_style="mitre"))
+        if not len(indexes):
+            return None
+        indexes.sort()
+        geometries = shapely.clip_by_rect(
+            self._get_zoom_geometries(layer, z)[indexes],
+            bounds[0] - buffer, bounds[1] - buffer, bounds[2] + buffer, bounds[3] + buffer,
+        )
+        properties = layer["properties"].iloc[indexes].to_dict("records")
+        features = [
+            {
+                "geometry": geometry,
+                "properties": {
+                    column: value.item() if isinstance(value, np.generic) else value
+                    for column, value in feature_properties.items() if not pd.isna(value)
+                },
+            }
+            for geometry, feature_properties in zip(geometries, properties)
+            if geometry is not None and not geometry.is_empty
+        ]
+        if not features:
+            return None
+        return {"name": name, "features": features}
+
+    def get_tile(
+            self,
+            key: str,
+            z: int,
+            x: int,
+            y: int,
+            layers: list[str] | None = None,
+    ) -> bytes | None:
+        """
+        Function returns encoded tile of stored result from cache or builds it
+        Args:
+            key (str): result key
+            z (int): zoom
+            x (int): tile column
+            y (int): tile row from the top
+            layers (list[str] | None): names of layers to include, defaults to None (all result layers)
+        Returns:
+            bytes | None: Mapbox Vector Tile, None if result is not stored
+        """
+
+        with self._lock:
+            if not (tile_set := self._results.get(key)):
+                return None
+            self._results.move_to_end(key)
+            layers = tuple(layers or tile_set.layer_names)
+            tile_key = (key, layers, z, x, y)
+            if (tile := self._tiles.get(tile_key)) is not None:
+                self._tiles.move_to_end(tile_key)
+                metrics.increment("tile_cache.hit")
+                return tile
+        metrics.increment("tile_cache.miss")
+        bounds = self.get_tile_bounds(z, x, y)
+        encoded_layers = []
+        for name in layers:
+            if layer := tile_set.get_layer(name):
+                if encoded_layer := self._encode_layer(name, layer, z, bounds):
+                    encoded_layers.append(encoded_layer)
+        tile = mapbox_vector_tile.encode(
+            encoded_layers,
+            default_options={
+                "quantize_bounds": bounds,
+                "extents": self.extent,
+                "y_coord_down": False,
+            },
+        ) if encoded_layers else b""
+        with self._lock:
+            self._tiles[tile_key] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def invalidate_project(self, project_id: int) -> int:
+        """
+        Function deletes stored results and tiles of project
+        Args:
+            project_id (int): project id
+        Returns:
+            int: number of deleted results
+        """
+
+        with self._lock:
+            keys = [key for key, tile_set in self._results.items() if tile_set.project_id == project_id]
+            for key in keys:
+                del self._results[key]
+            for tile_key in [tile_key for tile_key in self._tiles if tile_key[0] in keys]:
+                del self._tiles[tile_key]
+            return len(keys)
+
+
+tile_builder = TileBuilder(
+    max_results=int(get_config_value("TILE_RESULTS_CACHE_SIZE", "8")),
+    max_tiles=int(get_config_value("TILE_CACHE_SIZE", "4096")),
+)
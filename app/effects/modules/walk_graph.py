@@ -0,0 +1,444 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import numba
+import numpy as np
+import geopandas as gpd
+from loguru import logger
+from pyproj import CRS, Transformer
+from scipy.spatial import cKDTree
+from shapely import points
+
+from app.dependencies import get_config_value
+
+
+@numba.njit(cache=True)
+def _grow(array: np.ndarray) -> np.ndarray:
+    grown = np.empty(array.shape[0] * 2, array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
+
+
+@numba.njit(cache=True, parallel=True)
+def _fill_network_matrix(
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        weights: np.ndarray,
+        source_nodes: np.ndarray,
+        source_offsets: np.ndarray,
+        node_targets_indptr: np.ndarray,
+        node_targets: np.ndarray,
+        target_offsets: np.ndarray,
+        cutoff: float,
+        n_chunks: int,
+        matrix: np.ndarray,
+) -> None:
+    """
+    Bounded Dijkstra from every source node. Distances to targets snapped to reached nodes are written to matrix
+    column of source. Sources are split between chunks processed in parallel, each chunk reuses its own distance array
+    """
+
+    n_nodes = indptr.shape[0] - 1
+    n_sources = source_nodes.shape[0]
+    for chunk in numba.prange(n_chunks):
+        dist = np.full(n_nodes, np.inf)
+        touched = np.empty(n_nodes, np.int64)
+        heap_keys = np.empty(1024, np.float64)
+        heap_nodes = np.empty(1024, np.int64)
+        for source in range(chunk, n_sources, n_chunks):
+            start = source_nodes[source]
+            if source_offsets[source] > cutoff:
+                continue
+            dist[start] = source_offsets[source]
+            touched[0] = start
+            n_touched = 1
+            heap_keys[0] = source_offsets[source]
+            heap_nodes[0] = start
+            size = 1
+            while size > 0:
+                node_dist = heap_keys[0]
+                node = heap_nodes[0]
+                size -= 1
+                heap_keys[0] = heap_keys[size]
+                heap_nodes[0] = heap_nodes[size]
+                i = 0
+                while True:
+                    child = 2 * i + 1
+                    if child >= size:
+                        break
+                    if child + 1 < size and heap_keys[child + 1] < heap_keys[child]:
+                        child += 1
+                    if heap_keys[i] <= heap_keys[child]:
+                        break
+                    heap_keys[i], heap_keys[child] = heap_keys[child], heap_keys[i]
+                    heap_nodes[i], heap_nodes[child] = heap_nodes[child], heap_nodes[i]
+                    i = child
+                if node_dist > dist[node]:
+                    continue
+                for k in range(node_targets_indptr[node], node_targets_indptr[node + 1]):
+                    target = node_targets[k]
+                    value = node_dist + target_offsets[target]
+                    if 0 < value <= cutoff:
+                        matrix[target, source] = value
+                for edge in range(indptr[node], indptr[node + 1]):
+                    neighbour_dist = node_dist + weights[edge]
+                    neighbour = indices[edge]
+                    if neighbour_dist > cutoff or neighbour_dist >= dist[neighbour]:
+                        continue
+                    if dist[neighbour] == np.inf:
+                        touched[n_touched] = neighbour
+                        n_touched += 1
+                    dist[neighbour] = neighbour_dist
+                    if size == heap_keys.shape[0]:
+                        heap_keys = _grow(heap_keys)
+                        heap_nodes = _grow(heap_nodes)
+                    heap_keys[size] = neighbour_dist
+                    heap_nodes[size] = neighbour
+                    i = size
+                    size += 1
+                    while i > 0:
+                        parent = (i - 1) >> 1
+                        if heap_keys[parent] <= heap_keys[i]:
+                            break
+                        heap_keys[i], heap_keys[parent] = heap_keys[parent], heap_keys[i]
+                        heap_nodes[i], heap_nodes[parent] = heap_nodes[parent], heap_nodes[i]
+                        i = parent
+            for k in range(n_touched):
+                dist[touched[k]] = np.inf
+
+
+# kernel launches are serialised, as workqueue numba threading layer does not support concurrent launches
+_kernel_lock = threading.Lock()
+
+
+class WalkGraph:
+    """
+    Class for pedestrian graph stored as CSR adjacency in projected crs with kd-tree over its nodes
+    """
+
+    def __init__(
+            self,
+            indptr: np.ndarray,
+            indices: np.ndarray,
+            weights: np.ndarray,
+            crs: str,
+            bounds: list[float],
+            node_tree: cKDTree,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            indptr (np.ndarray): CSR row pointers
+            indices (np.ndarray): CSR neighbour nodes
+            weights (np.ndarray): CSR edges lengths in meters
+            crs (str): graph nodes crs
+            bounds (list[float]): graph bounds in EPSG:4326
+            node_tree (cKDTree): kd-tree over graph nodes coordinates
+        Returns:
+            None
+        """
+
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.crs = CRS.from_user_input(crs)
+        self.bounds = bounds
+        self.node_tree = node_tree
+
+    def covers(self, bounds: np.ndarray) -> bool:
+        """
+        Function checks if graph covers area
+        Args:
+            bounds (np.ndarray): area bounds in EPSG:4326
+        Returns:
+            bool: True if area is within graph bounds
+        """
+
+        return (
+                self.bounds[0] <= bounds[0] and self.bounds[1] <= bounds[1]
+                and bounds[2] <= self.bounds[2] and bounds[3] <= self.bounds[3]
+        )
+
+    def snap(
+            self,
+            coordinates: np.ndarray,
+            crs: CRS,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Function snaps points to nearest graph nodes
+        Args:
+            coordinates (np.ndarray): points coordinates with shape (n, 2)
+            crs (CRS): points crs
+        Returns:
+            tuple[np.ndarray, np.ndarray]: nearest nodes and distances to them
+        """
+
+        if not self.crs.equals(crs):
+            transformer = Transformer.from_crs(crs, self.crs, always_xy=True)
+            coordinates = np.column_stack(transformer.transform(coordinates[:, 0], coordinates[:, 1]))
+        offsets, nodes = self.node_tree.query(coordinates)
+        return nodes.astype(np.int64), offsets.astype(np.float64)
+
+    def fill_matrix(
+            self,
+            matrix: np.ndarray,
+            buildings_points: np.ndarray,
+            services_points: np.ndarray,
+            crs: CRS,
+            cutoff: float,
+    ) -> None:
+        """
+        Function writes walk distances by graph between buildings and services within cutoff to matrix
+        Args:
+            matrix (np.ndarray): preallocated matrix filled with nan
+            buildings_points (np.ndarray): buildings coordinates
+            services_points (np.ndarray): services coordinates
+            crs (CRS): points crs
+            cutoff (float): max walk distance in meters
+        Returns:
+            None
+        """
+
+        if not len(buildings_points) or not len(services_points):
+            return
+        buildings_nodes, buildings_offsets = self.snap(buildings_points, crs)
+        services_nodes, services_offsets = self.snap(services_points, crs)
+        node_targets = np.argsort(buildings_nodes, kind="stable")
+        node_targets_indptr = np.zeros(self.indptr.shape[0], np.int64)
+        np.cumsum(np.bincount(buildings_nodes, minlength=self.indptr.shape[0] - 1), out=node_targets_indptr[1:])
+        with _kernel_lock:
+            _fill_network_matrix(
+                self.indptr,
+                self.indices,
+                self.weights,
+                services_nodes,
+                services_offsets,
+                node_targets_indptr,
+                node_targets,
+                buildings_offsets,
+                float(cutoff),
+                min(len(services_points), numba.get_num_threads()),
+                matrix,
+            )
+
+
+class WalkGraphStore:
+    """
+    Class loads regional pedestrian graphs from GraphML files and persists them as memory-mapped arrays cache
+    """
+
+    def __init__(
+            self,
+            graph_dir: str | None,
+            cache_dir: str,
+    ) -> None:
+        """Initialisation function
+
+        Args:
+            graph_dir (str | None): directory with regional GraphML graphs
+            cache_dir (str): directory for graphs arrays cache
+        Returns:
+            None
+        """
+
+        self.graph_dir = Path(graph_dir) if graph_dir else None
+        self.cache_dir = Path(cache_dir)
+        self._graphs: dict[str, WalkGraph] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_graphml(
+            path: Path,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, str]:
+        """
+        Function reads nodes coordinates and edges from GraphML file incrementally
+        Args:
+            path (Path): GraphML file path
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, str]: nodes x and y, edges sources,
+            targets and lengths (nan if length is not set), graph crs
+        """
+
+        keys = {}
+        nodes = {}
+        x, y, sources, targets, lengths = [], [], [], [], []
+        crs = "EPSG:4326"
+        graph = None
+        for event, element in ET.iterparse(path, events=("start", "end")):
+            tag = element.tag.rsplit("}", 1)[-1]
+            if event == "start":
+                if tag == "graph":
+                    graph = element
+                continue
+            if tag == "key":
+                keys[element.get("id")] = element.get("attr.name")
+            elif tag in ("node", "edge"):
+                data = {keys.get(item.get("key")): item.text for item in element}
+                if tag == "node":
+                    nodes[element.get("id")] = len(x)
+                    x.append(float(data["x"]))
+                    y.append(float(data["y"]))
+                else:
+                    sources.append(element.get("source"))
+                    targets.append(element.get("target"))
+                    lengths.append(float(data.get("length") or "nan"))
+                graph.remove(element)
+            elif tag == "data" and graph is not None and keys.get(element.get("key")) == "crs":
+                crs = element.text
+        return (
+            np.array(x),
+            np.array(y),
+            np.array([nodes[source] for source in sources], dtype=np.int64),
+            np.array([nodes[target] for target in targets], dtype=np.int64),
+            np.array(lengths),
+            crs,
+        )
+
+    def _build_cache(
+            self,
+            path: Path,
+            cache_path: Path,
+    ) -> None:
+        """
+        Function converts GraphML graph to undirected CSR adjacency in local projected crs and saves it to cache.
+        Cache is written to temporary directory and renamed, so workers building the same cache simultaneously never
+        read partial one
+        Args:
+            path (Path): GraphML file path
+            cache_path (Path): graph cache directory
+        Returns:
+            None
+        """
+
+        logger.info(f"Building walk graph cache for {path}")
+        x, y, sources, targets, lengths, crs = self._read_graphml(path)
+        nodes = gpd.GeoSeries(points(x, y), crs=crs)
+        bounds = nodes.to_crs(4326).total_bounds.tolist()
+        if not nodes.crs.is_projected:
+            nodes = nodes.to_crs(nodes.estimate_utm_crs())
+        coordinates = np.column_stack((nodes.x.to_numpy(), nodes.y.to_numpy()))
+        missing_lengths = np.isnan(lengths)
+        lengths[missing_lengths] = np.linalg.norm(
+            coordinates[sources[missing_lengths]] - coordinates[targets[missing_lengths]], axis=1
+        )
+        edges_sources = np.concatenate((sources, targets))
+        edges_targets = np.concatenate((targets, sources))
+        edges_lengths = np.concatenate((lengths, lengths))
+        order = np.argsort(edges_sources, kind="stable")
+        indptr = np.zeros(len(x) + 1, np.int64)
+        np.cumsum(np.bincount(edges_sources, minlength=len(x)), out=indptr[1:])
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        tmp_path.mkdir(parents=True, exist_ok=True)
+        np.save(tmp_path / "indptr.npy", indptr)
+        np.save(tmp_path / "indices.npy", edges_targets[order].astype(np.int64))
+        np.save(tmp_path / "weights.npy", edges_lengths[order].astype(np.float64))
+        np.save(tmp_path / "nodes.npy", coordinates.astype(np.float64))
+        with open(tmp_path / "meta.json", "w") as meta_file:
+            json.dump({"crs": nodes.crs.to_string(), "bounds": bounds}, meta_file)
+        try:
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # cache is already built by another worker
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _load(self, path: Path) -> WalkGraph:
+        """
+        Function loads graph from memory-mapped cache, building cache if it does not exist or is outdated
+        Args:
+            path (Path): GraphML file path
+        Returns:
+            WalkGraph: loaded graph
+        """
+
+        stat = path.stat()
+        # cache format version is part of digest, so caches of previous format are rebuilt
+        digest = hashlib.blake2b(f"2:{stat.st_size}:{stat.st_mtime_ns}".encode(), digest_size=8).hexdigest()
+        cache_path = self.cache_dir / f"{path.stem}-{digest}"
+        if not cache_path.exists():
+            self._build_cache(path, cache_path)
+        with open(cache_path / "meta.json") as meta_file:
+            meta = json.load(meta_file)
+        node_tree = cKDTree(np.load(cache_path / "nodes.npy"))
+        return WalkGraph(
+            indptr=np.asarray(np.load(cache_path / "indptr.npy", mmap_mode="r")),
+            indices=np.asarray(np.load(cache_path / "indices.npy", mmap_mode="r")),
+            weights=np.asarray(np.load(cache_path / "weights.npy", mmap_mode="r")),
+            crs=meta["crs"],
+            bounds=meta["bounds"],
+            node_tree=node_tree,
+        )
+
+    def load_all(self) -> list[WalkGraph]:
+        """
+        Function loads all regional graphs from graph directory
+        Returns:
+            list[WalkGraph]: loaded graphs
+        """
+
+        if not self.graph_dir:
+            return []
+        with self._lock:
+            for path in sorted(self.graph_dir.glob("*.graphml")):
+                if path.name not in self._graphs:
+                    self._graphs[path.name] = self._load(path)
+            return list(self._graphs.values())
+
+    def warmup(self) -> None:
+        """
+        Function loads regional graphs and compiles walk distances kernel on two nodes graph
+        Returns:
+            None
+        """
+
+        self.load_all()
+        # graph arrays are memory-mapped read only, kernel is compiled for the same signature
+        indptr, indices, weights = (
+            np.array([0, 1, 2], dtype=np.int64),
+            np.array([1, 0], dtype=np.int64),
+            np.array([1.0, 1.0], dtype=np.float64),
+        )
+        for array in (indptr, indices, weights):
+            array.flags.writeable = False
+        matrix = np.full((1, 1), np.nan, dtype=np.float32)
+        with _kernel_lock:
+            _fill_network_matrix(
+                indptr,
+                indices,
+                weights,
+                np.array([0], dtype=np.int64),
+                np.array([0.0], dtype=np.float64),
+                np.array([0, 0, 1], dtype=np.int64),
+                np.array([0], dtype=np.int64),
+                np.array([0.0], dtype=np.float64),
+                10.0,
+                1,
+                matrix,
+            )
+
+    def get_graph(
+            self,
+            bounds: np.ndarray,
+    ) -> WalkGraph | None:
+        """
+        Function returns regional graph covering area
+        Args:
+            bounds (np.ndarray): area bounds in EPSG:4326
+        Returns:
+            WalkGraph | None: graph covering area, None if there is no such graph
+        """
+
+        for graph in self.load_all():
+            if graph.covers(bounds):
+                return graph
+        return None
+
+
+walk_graph_store = WalkGraphStore(
+    graph_dir=get_config_value("WALK_GRAPH_DIR"),
+    cache_dir=get_config_value("WALK_GRAPH_CACHE_DIR", os.path.join(os.getcwd(), ".walk_graph_cache")),
+)
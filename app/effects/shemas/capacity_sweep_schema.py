@@ -0,0 +1,15 @@
+from pydantic import BaseModel
+
+from .effects_base_schema import PivotSchema
+
+
+class CapacityVariantSchema(BaseModel):
+
+    capacities: dict[int, int]
+    pivot: PivotSchema
+
+
+class CapacitySweepSchema(BaseModel):
+
+    pivot: PivotSchema
+    variants: list[CapacityVariantSchema]
@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+
+from .effects_base_schema import FeatureCollectionSchema
+
+
+class IntervalSchema(BaseModel):
+
+    mean: float
+    lower: float
+    upper: float
+
+
+class DemandUncertaintySchema(BaseModel):
+
+    realizations: int
+    confidence: float
+    pivot: dict[str, IntervalSchema]
+    effects: FeatureCollectionSchema
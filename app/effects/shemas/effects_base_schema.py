@@ -46,9 +46,20 @@ class PivotSchema(BaseModel):
         median_absolute_within: int
 
 
+class DeltaSummarySchema(BaseModel):
+
+    buildings_total: int
+    buildings_changed: int
+    buildings_unchanged: int
+    services_total: int
+    services_changed: int
+    services_unchanged: int
+
+
 class EffectsSchema(BaseModel):
 
     before_prove_data: ProvisionSchema
     after_prove_data: ProvisionSchema
     effects: FeatureCollectionSchema
     pivot: PivotSchema
+    delta_summary: Optional[DeltaSummarySchema] = None
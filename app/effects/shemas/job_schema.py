@@ -0,0 +1,17 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+
+class JobSchema(BaseModel):
+
+    job_id: str
+    status: Literal["queued", "running", "done", "failed", "cancelled"]
+    stage: Optional[str] = None
+    completed_stages: list[str]
+    progress: float
+    params: dict
+    error: Optional[dict] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+
+from .effects_base_schema import FeatureCollectionSchema
+
+
+class PlacementSchema(BaseModel):
+
+    capacity: int
+    candidates_count: int
+    candidates: FeatureCollectionSchema
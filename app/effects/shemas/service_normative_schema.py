@@ -0,0 +1,15 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+class ServiceNormativeSchema(BaseModel):
+
+    model_config = ConfigDict(extra="allow")
+
+    service_type: dict
+    normative_value: int | float
+    normative_type: Literal["time", "dist"]
+    capacity_type: Literal["unit", "capacity"]
+    services_per_1000_normative: Optional[int | float] = None
+    services_capacity_per_1000_normative: Optional[int | float] = None
@@ -1,16 +1,33 @@
-import aiofiles
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Annotated, Literal
+
+from fastapi import FastAPI, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import FileResponse, RedirectResponse
 
-from .dependencies import config
+from .common.compression.compression_middleware import CompressionMiddleware
+from .common.deadline.deadline_middleware import DeadlineMiddleware
+from .common.logs.request_id_middleware import RequestIdMiddleware
+from .common.metrics.metrics import metrics
+from .dependencies import config, effects_job_queue, get_config_value, log_buffer, log_tail, profile_store, response_codecs
 from .effects.effects_controller import effects_router
+from .effects.effects_service import effects_service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if get_config_value("WARMUP", "true").lower() == "true":
+        await asyncio.to_thread(effects_service.warmup)
+    yield
+    await effects_job_queue.stop()
 
 
 app = FastAPI(
     title="ObjectNat effects API",
     description="API for calculating effects for territory by ObjectNat library",
     version=config.get("APP_VERSION"),
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -21,6 +38,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(
+    CompressionMiddleware,
+    codecs=response_codecs,
+    min_size=int(get_config_value("COMPRESSION_MIN_SIZE", "1024")),
+)
+app.add_middleware(
+    DeadlineMiddleware,
+    timeout=float(get_config_value("REQUEST_TIMEOUT", "0")) or None,
+)
+# request id is bound before deadline middleware starts request handling task, so the task inherits it
+app.add_middleware(RequestIdMiddleware)
 
 @app.get("/", response_model=dict[str, str])
 def read_root():
@@ -30,11 +58,40 @@ def read_root():
 async def read_root():
     return {"status": "OK"}
 
+@app.get("/metrics")
+async def read_metrics() -> dict[str, int | float]:
+    return metrics.snapshot()
+
 @app.get("/logs")
-async def read_logs():
-    async with aiofiles.open(config.get("LOGS_FILE")) as logs_file:
-        logs = await logs_file.read()
-        return logs[-1:-10000]
+async def read_logs(
+        limit: Annotated[int, Query(ge=1, le=10000)] = 1000,
+        level: Literal["TRACE", "DEBUG", "INFO", "SUCCESS", "WARNING", "ERROR", "CRITICAL"] | None = None,
+        request_id: str | None = None,
+        source: Literal["file", "buffer"] = "file",
+) -> list[dict]:
+    if source == "buffer":
+        return log_buffer.get_records(limit=limit, level=level, request_id=request_id)
+    return await asyncio.to_thread(log_tail.read, limit=limit, level=level, request_id=request_id)
+
+@app.get("/profiles/{request_id}")
+async def read_profile(
+        request_id: str,
+        x_profile_token: Annotated[str | None, Header()] = None,
+) -> dict:
+    profile_store.check_token(x_profile_token)
+    return await asyncio.to_thread(profile_store.get_summary, request_id)
+
+@app.get("/profiles/{request_id}/flamegraph", response_class=FileResponse)
+async def download_profile_flamegraph(
+        request_id: str,
+        x_profile_token: Annotated[str | None, Header()] = None,
+) -> FileResponse:
+    profile_store.check_token(x_profile_token)
+    return FileResponse(
+        profile_store.get_folded_stacks_path(request_id),
+        media_type="text/plain",
+        filename=f"{request_id}.folded",
+    )
 
 
 app.include_router(effects_router)
\ No newline at end of file
@@ -0,0 +1,314 @@
+"""
+Offline precompute of effects for all scenarios and service types of a project.
+
+Scenarios are requested from urban_api project scenarios (base scenario is skipped) and service types from territory
+normatives (only service types with capacity normative). Each scenario and service type pair is calculated by effects
+service pipeline in process pool. Worker processes memoize urban_api layers, so project context is loaded once per
+worker and shared by all its tasks.
+
+Results are written to result snapshots (SNAPSHOTS_DIR from app env file must be set), so dashboard requests are
+answered from snapshots until they expire (SNAPSHOTS_TTL), or to GeoParquet files (requires pyarrow). Progress is
+stored in json manifest after each task, interrupted job is resumed by the same command, finished tasks are skipped.
+
+Usage:
+    python -m app.precompute --project-id 72 --workers 4
+    python -m app.precompute --project-id 72 --service-types 7 5 --format parquet --output precomputed
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+
+import geopandas as gpd
+from fastapi import HTTPException
+from loguru import logger
+
+from app.effects.dto.effects_dto import EffectsDTO
+from app.effects.effects_service import effects_service
+from app.effects.modules import effects_api_gateway, normatives_catalog, result_snapshots
+from app.effects.shemas.effects_base_schema import EffectsSchema
+
+LAYERS = ("before_prove_data", "after_prove_data")
+_worker_loop: asyncio.AbstractEventLoop | None = None
+
+
+async def enumerate_tasks(
+        project_id: int,
+        year: int,
+        service_type_ids: list[int] | None = None,
+) -> list[EffectsDTO]:
+    """
+    Function enumerates effects calculations of all project scenarios and service types
+    Args:
+        project_id (int): project id
+        year (int): normatives year
+        service_type_ids (list[int] | None): service types to calculate, defaults to None (all service types with
+        capacity normative)
+    Returns:
+        list[EffectsDTO]: effects params ordered by service type and scenario
+    """
+
+    project_data = await effects_api_gateway.get_project_data(project_id)
+    scenarios = await effects_api_gateway.get_project_scenarios(project_id)
+    normatives = await normatives_catalog.get_normatives(project_data["territory"]["id"], year)
+    if service_type_ids is None:
+        service_type_ids = [
+            service_type_id for service_type_id, normative in normatives.items()
+            if normative and normative.capacity_type == "capacity"
+        ]
+    scenario_ids = [scenario["scenario_id"] for scenario in scenarios if not scenario.get("is_based")]
+    return [
+        EffectsDTO(project_id=project_id, scenario_id=scenario_id, service_type_id=service_type_id, year=year)
+        for service_type_id in service_type_ids
+        for scenario_id in scenario_ids
+    ]
+
+
+def read_manifest(
+        path: Path,
+        project_id: int,
+) -> dict:
+    """
+    Function reads manifest of interrupted job or creates new one
+    Args:
+        path (Path): manifest path
+        project_id (int): project id
+    Returns:
+        dict: manifest with "project_id" and "tasks" by effects params key
+    """
+
+    if path.exists():
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get("project_id") == project_id:
+            return manifest
+    return {"project_id": project_id, "tasks": {}}
+
+
+def write_manifest(
+        path: Path,
+        manifest: dict,
+) -> None:
+    """
+    Function writes manifest to temporary file and renames it, so interrupted job never leaves broken manifest
+    Args:
+        path (Path): manifest path
+        manifest (dict): manifest
+    Returns:
+        None
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def write_parquet(
+        result: dict,
+        directory: Path,
+) -> None:
+    """
+    Function writes effects calculation result layers to GeoParquet files and pivot to json file
+    Args:
+        result (dict): effects calculation result
+        directory (Path): result directory
+    Returns:
+        None
+    """
+
+    directory.mkdir(parents=True, exist_ok=True)
+    layers = {"effects": result["effects"]}
+    for prove_data in LAYERS:
+        for layer_name, layer in result[prove_data].items():
+            layers[f"{prove_data.removesuffix('_prove_data')}_{layer_name}"] = layer
+    for layer_name, layer in layers.items():
+        if layer["features"]:
+            gpd.GeoDataFrame.from_features(layer, crs=4326).to_parquet(directory / f"{layer_name}.parquet")
+    with open(directory / "pivot.json", "w") as pivot_file:
+        json.dump({"pivot": result["pivot"], "delta_summary": result["delta_summary"]}, pivot_file)
+
+
+def init_worker() -> None:
+    """
+    Function initialises worker process: creates event loop reused by all worker tasks and enables layers
+    memoization, so shared project context is requested once per worker
+    Returns:
+        None
+    """
+
+    global _worker_loop
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+    effects_api_gateway.memoize_layers()
+
+
+def run_task(
+        params: dict,
+        output_format: str,
+        output: str | None,
+) -> dict:
+    """
+    Function calculates effects of one scenario and service type in worker process
+    Args:
+        params (dict): effects params
+        output_format (str): "snapshots" or "parquet"
+        output (str | None): GeoParquet output directory
+    Returns:
+        dict: task "status", "seconds" and "error" if task failed
+    """
+
+    effects_params = EffectsDTO(**params)
+    start = time.perf_counter()
+    try:
+        result = _worker_loop.run_until_complete(
+            effects_service.calculate_effects(effects_params, use_snapshots=False)
+        )
+        if output_format == "snapshots":
+            result_snapshots.set(
+                key=effects_params.model_dump_json(),
+                project_id=effects_params.project_id,
+                body=EffectsSchema(**result).model_dump_json(),
+            )
+        else:
+            write_parquet(
+                result=result,
+                directory=Path(output) / str(effects_params.scenario_id) / str(effects_params.service_type_id),
+            )
+    except HTTPException as e:
+        return {"status": "failed", "seconds": time.perf_counter() - start, "error": e.detail}
+    except Exception as e:
+        return {"status": "failed", "seconds": time.perf_counter() - start, "error": repr(e)}
+    return {"status": "done", "seconds": time.perf_counter() - start}
+
+
+def is_done(
+        effects_params: EffectsDTO,
+        manifest: dict,
+        output_format: str,
+) -> bool:
+    """
+    Function checks whether task is finished by previous run
+    Args:
+        effects_params (EffectsDTO): effects params
+        manifest (dict): job manifest
+        output_format (str): "snapshots" or "parquet"
+    Returns:
+        bool: True if task result exists
+    """
+
+    key = effects_params.model_dump_json()
+    if output_format == "snapshots":
+        return result_snapshots.has(key, effects_params.project_id)
+    return manifest["tasks"].get(key, {}).get("status") == "done"
+
+
+def precompute(args: argparse.Namespace) -> dict[str, int | float]:
+    """
+    Function runs precompute job and reports its throughput
+    Args:
+        args (argparse.Namespace): command line arguments
+    Returns:
+        dict[str, int | float]: job summary
+    """
+
+    tasks = asyncio.run(enumerate_tasks(args.project_id, args.year, args.service_types))
+    manifest_path = Path(args.manifest)
+    manifest = read_manifest(manifest_path, args.project_id)
+    pending = [
+        effects_params for effects_params in tasks
+        if args.force or not is_done(effects_params, manifest, args.format)
+    ]
+    summary = {"tasks": len(tasks), "skipped": len(tasks) - len(pending), "done": 0, "failed": 0}
+    logger.info(
+        f"Precomputing {len(pending)} of {len(tasks)} effects of project {args.project_id} in {args.workers} workers"
+    )
+    start = time.perf_counter()
+    task_seconds = 0.0
+    with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=get_context("spawn"),
+            initializer=init_worker,
+    ) as executor:
+        futures = {
+            executor.submit(run_task, effects_params.model_dump(), args.format, args.output): effects_params
+            for effects_params in pending
+        }
+        for future in as_completed(futures):
+            effects_params = futures[future]
+            try:
+                task = future.result()
+            except Exception as e:
+                task = {"status": "failed", "seconds": 0.0, "error": repr(e)}
+            manifest["tasks"][effects_params.model_dump_json()] = {
+                "scenario_id": effects_params.scenario_id,
+                "service_type_id": effects_params.service_type_id,
+                **task,
+            }
+            write_manifest(manifest_path, manifest)
+            summary[task["status"]] += 1
+            task_seconds += task["seconds"]
+            finished = summary["done"] + summary["failed"]
+            elapsed = time.perf_counter() - start
+            message = (
+                f"[{finished}/{len(pending)}] scenario {effects_params.scenario_id} service type "
+                f"{effects_params.service_type_id} {task['status']} in {task['seconds']:.1f} s, "
+                f"{finished / elapsed * 60:.2f} tasks/min"
+            )
+            if task["status"] == "done":
+                logger.info(message)
+            else:
+                logger.warning(f"{message}: {task['error']}")
+    elapsed = time.perf_counter() - start
+    finished = summary["done"] + summary["failed"]
+    summary |= {
+        "seconds": round(elapsed, 2),
+        "tasks_per_minute": round(finished / elapsed * 60, 2) if finished else 0.0,
+        "mean_task_seconds": round(task_seconds / finished, 2) if finished else 0.0,
+    }
+    logger.info(f"Precompute of project {args.project_id} finished: {summary}")
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Precompute effects of all project scenarios and service types")
+    parser.add_argument("--project-id", type=int, required=True)
+    parser.add_argument("--service-types", type=int, nargs="+", default=None,
+                        help="service type ids, all service types with capacity normative by default")
+    parser.add_argument("--year", type=int, default=2024)
+    parser.add_argument("--workers", type=int, default=max((os.cpu_count() or 2) // 2, 1))
+    parser.add_argument("--format", choices=("snapshots", "parquet"), default="snapshots")
+    parser.add_argument("--output", default=None, help="GeoParquet output directory")
+    parser.add_argument("--manifest", default=None,
+                        help="progress manifest path, defaults to precompute_<project_id>.json in output directory or "
+                             "in current directory for snapshots, as project snapshots are deleted on invalidation")
+    parser.add_argument("--force", action="store_true", help="recalculate finished tasks")
+    args = parser.parse_args()
+
+    if args.format == "snapshots":
+        if not result_snapshots.enabled:
+            parser.error("SNAPSHOTS_DIR is not set in app env file, snapshots can't be stored")
+        directory = Path.cwd()
+    else:
+        if importlib.util.find_spec("pyarrow") is None:
+            parser.error("GeoParquet output requires pyarrow to be installed")
+        if not args.output:
+            parser.error("--output is required for parquet format")
+        args.output = str(Path(args.output) / str(args.project_id))
+        directory = Path(args.output)
+    args.manifest = args.manifest or str(directory / f"precompute_{args.project_id}.json")
+
+    summary = precompute(args)
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compression benchmark of effects response codecs.
+
+Measures compressed size and cpu time of compression and decompression for each available codec (gzip, brotli and
+zstd if their packages are installed) and level. Body is synthetic feature collection shaped like effects response
+or json file of real response, e.g. saved with curl from /effects/evaluate_provision.
+
+Usage:
+    python -m benchmarks.compression_benchmark --features 50000
+    python -m benchmarks.compression_benchmark --input effects.json
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.common.compression.response_codecs import ResponseCodecs
+
+
+def generate_body(size: int, rng: np.random.Generator) -> bytes:
+    centers = rng.uniform((30.2, 59.9), (30.4, 60.0), size=(size, 2))
+    features = []
+    for feature_id, (x, y) in enumerate(centers):
+        ring = [[x, y], [x + 0.0003, y], [x + 0.0003, y + 0.0002], [x, y + 0.0002], [x, y]]
+        features.append({
+            "id": feature_id,
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+            "properties": {
+                "building_id": feature_id,
+                "population": int(rng.integers(0, 300)),
+                "demand": int(rng.integers(0, 30)),
+                "absolute_scenario_project": int(rng.integers(-5, 5)),
+                "index_scenario_project": float(rng.uniform(-1, 1)),
+                "is_project": bool(rng.random() < 0.05),
+            },
+        })
+    return json.dumps({"type": "FeatureCollection", "features": features}).encode()
+
+
+def measure(codecs: ResponseCodecs, encoding: str, body: bytes) -> tuple[int, float, float]:
+    start = time.process_time()
+    compressed = codecs.compress(body, encoding)
+    compress_time = time.process_time() - start
+    start = time.process_time()
+    codecs.decompress(compressed, encoding)
+    decompress_time = time.process_time() - start
+    return len(compressed), compress_time, decompress_time
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", type=int, default=50000, help="number of synthetic features")
+    parser.add_argument("--input", help="json file to compress instead of synthetic body")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, "rb") as body_file:
+            body = body_file.read()
+    else:
+        body = generate_body(args.features, np.random.default_rng(0))
+
+    levels = {
+        "gzip": [{"gzip_level": level} for level in (1, 6, 9)],
+        "br": [{"brotli_quality": quality} for quality in (1, 5, 9)],
+        "zstd": [{"zstd_level": level} for level in (1, 3, 9)],
+    }
+    print(f"body: {len(body) / 1024 / 1024:.1f} MiB")
+    print(f"{'codec':<6} {'level':>5} {'size, MiB':>10} {'ratio':>6} {'compress, s':>12} {'decompress, s':>14} "
+          f"{'MiB/s':>7}")
+    for encoding in ResponseCodecs().encodings:
+        for params in levels[encoding]:
+            size, compress_time, decompress_time = measure(ResponseCodecs(**params), encoding, body)
+            print(
+                f"{encoding:<6} {next(iter(params.values())):>5} {size / 1024 / 1024:>10.2f} {len(body) / size:>6.1f} "
+                f"{compress_time:>12.3f} {decompress_time:>14.3f} "
+                f"{len(body) / 1024 / 1024 / max(compress_time, 1e-9):>7.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Memory benchmark of before/after layers composition.
+
+Compares peak traced memory of the former composition by four concatenations with sorting and deduplication against
+composition from one shared frame by index arrays. Layers are synthetic and do not require urban_api.
+
+Usage:
+    python -m benchmarks.memory_benchmark --buildings 200000 --services 2000
+"""
+
+import argparse
+import time
+import tracemalloc
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from app.effects.modules.layer_composer import layer_composer
+from app.effects.modules.layer_schema import restored_buildings_schema, services_schema
+
+
+def generate_buildings(size: int, first_id: int, is_project: bool, rng: np.random.Generator) -> gpd.GeoDataFrame:
+    points = rng.uniform((30.2, 59.9), (30.4, 60.0), size=(size, 2))
+    buildings = gpd.GeoDataFrame(
+        {
+            "building_id": np.arange(first_id, first_id + size),
+            "storeys_count": rng.integers(1, 20, size),
+            "living_area": rng.integers(100, 5000, size),
+            "population": rng.integers(0, 300, size),
+            "demand": rng.integers(0, 30, size),
+            "is_project": is_project,
+        },
+        geometry=shapely.buffer(shapely.points(points), 0.0001, quad_segs=2),
+        crs=4326,
+    )
+    return restored_buildings_schema.apply(buildings)
+
+
+def generate_services(size: int, first_id: int, rng: np.random.Generator) -> gpd.GeoDataFrame:
+    points = rng.uniform((30.2, 59.9), (30.4, 60.0), size=(size, 2))
+    services = gpd.GeoDataFrame(
+        {
+            "service_id": np.arange(first_id, first_id + size),
+            "capacity": rng.integers(50, 500, size),
+        },
+        geometry=shapely.points(points),
+        crs=4326,
+    )
+    return services_schema.apply(services)
+
+
+def compose_by_concat(context_buildings, target_buildings, base_buildings,
+                      context_services, target_services, base_services, local_crs):
+    layers = []
+    for buildings, services in (
+            (base_buildings, base_services),
+            (target_buildings, target_services),
+    ):
+        layer_buildings = pd.concat([context_buildings, buildings])
+        layer_services = pd.concat([context_services, services])
+        layer_buildings.sort_values("is_project", ascending=False, inplace=True)
+        layer_buildings.drop_duplicates("building_id", keep="first", inplace=True)
+        layer_buildings.set_index("building_id", inplace=True)
+        layer_services.set_index("service_id", inplace=True)
+        layer_services.drop_duplicates("geometry", inplace=True)
+        layer_buildings.to_crs(local_crs, inplace=True)
+        layer_services.to_crs(local_crs, inplace=True)
+        layers.append((layer_buildings, layer_services))
+    return layers
+
+
+def compose_by_positions(context_buildings, target_buildings, base_buildings,
+                         context_services, target_services, base_services, local_crs):
+    return (
+        layer_composer.compose_buildings(context_buildings, target_buildings, base_buildings, local_crs),
+        layer_composer.compose_services(context_services, target_services, base_services, local_crs),
+    )
+
+
+def measure(func: Callable, **kwargs) -> tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(**kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak / 1024 / 1024, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buildings", type=int, default=200000, help="number of context buildings")
+    parser.add_argument("--services", type=int, default=2000, help="number of context services")
+    parser.add_argument("--project-share", type=float, default=0.05, help="scenario layers size share of context")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    project_buildings = int(args.buildings * args.project_share)
+    project_services = max(int(args.services * args.project_share), 1)
+    layers = {
+        "context_buildings": generate_buildings(args.buildings, 0, False, rng),
+        "target_buildings": generate_buildings(project_buildings, args.buildings - project_buildings // 2, True, rng),
+        "base_buildings": generate_buildings(project_buildings, args.buildings - project_buildings // 2, True, rng),
+        "context_services": generate_services(args.services, 0, rng),
+        "target_services": generate_services(project_services, args.services, rng),
+        "base_services": generate_services(project_services, args.services + project_services, rng),
+    }
+    layers["local_crs"] = layers["target_buildings"].estimate_utm_crs()
+
+    print(f"{'composition':<12} {'peak, MiB':>10} {'time, s':>8}")
+    for name, func in (("concat", compose_by_concat), ("positions", compose_by_positions)):
+        peak, elapsed = measure(func, **layers)
+        print(f"{name:<12} {peak:>10.1f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Startup benchmark of gunicorn workers.
+
+Starts service with and without preload and warmup, reports time until service answers and latency of the first and
+the second request to the path. Path should be effects request to measure cold caches, for example:
+
+    python -m benchmarks.startup_benchmark \\
+        --path "/effects/evaluate_provision?project_id=72&scenario_id=192&service_type_id=7&year=2024"
+
+urban_api from app env file must be available for effects requests.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+MODES = {
+    "cold": {"GUNICORN_PRELOAD": "false", "WARMUP": "false"},
+    "preload": {"GUNICORN_PRELOAD": "true", "WARMUP": "false"},
+    "preload+warmup": {"GUNICORN_PRELOAD": "true", "WARMUP": "true"},
+}
+
+
+def request(url: str, timeout: float) -> float:
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            request(url, timeout=1)
+            return time.perf_counter() - start
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"{url} is not ready in {timeout} s")
+
+
+def run_mode(mode: str, args: argparse.Namespace) -> tuple[float, float, float]:
+    env = os.environ | MODES[mode] | {
+        "GUNICORN_BIND": f"127.0.0.1:{args.port}",
+        "GUNICORN_WORKERS": str(args.workers),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "app.main:app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        ready = wait_ready(f"{base_url}/status", process, args.timeout)
+        first = request(f"{base_url}{args.path}", args.timeout)
+        second = request(f"{base_url}{args.path}", args.timeout)
+    finally:
+        process.terminate()
+        process.wait()
+    return ready, first, second
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/status", help="path of measured request")
+    parser.add_argument("--port", type=int, default=8090, help="port to bind service to")
+    parser.add_argument("--workers", type=int, default=1, help="number of gunicorn workers")
+    parser.add_argument("--timeout", type=float, default=600, help="max time to wait for service and requests")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES), help="modes to benchmark")
+    args = parser.parse_args()
+
+    print(f"{'mode':<16} {'ready, s':>9} {'first, s':>9} {'second, s':>10}")
+    for mode in args.modes:
+        ready, first, second = run_mode(mode, args)
+        print(f"{mode:<16} {ready:>9.2f} {first:>9.2f} {second:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
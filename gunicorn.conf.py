@@ -0,0 +1,12 @@
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:80")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+# Heavy modules are imported once in master and shared by forked workers copy-on-write. Each worker warms up
+# pipeline in its lifespan after fork
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+if preload_app:
+    # objectnat runs numba parallel code on import, default tbb thread pool started in master hangs its exit after
+    # fork. workqueue layer is fork safe, walk graph kernel launches are serialised as it is not thread safe
+    os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")